@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import logging
+import argparse
+
+from runner import Runner
+from dataReader import DataReader
+from cars import ContextAwareRecommendation
+from successCalculator import SuccessCalculator
+
+log = logging.getLogger("AnytimeQuery")
+
+
+def create_engine(runner, fold, num_of_neighbors):
+    """
+    Create the context-aware engine of a fold, whose similarities and ground truth must have
+    been computed by a previous evaluation.
+
+    :return: A tuple (engine, metric calculator, testing projects).
+    """
+    step = runner.num_of_projects // 10
+    bounds = runner.get_fold_bounds(fold, step)
+    sub_folder = f"evaluation/round{fold + 1}"
+    engine = ContextAwareRecommendation(runner.src_dir, sub_folder, num_of_neighbors, bounds[4], bounds[5],
+                                        prune_candidates=runner.prune_candidates)
+    calc = SuccessCalculator(runner.src_dir, sub_folder, bounds[4], bounds[5])
+    testing_projects = DataReader().read_project_list(os.path.join(runner.src_dir, "List.txt"), bounds[4], bounds[5])
+    return engine, calc, list(testing_projects.values())
+
+
+def benchmark(prop_file, deadlines, fold=0, num_of_neighbors=20, ns=(1, 5, 10, 20)):
+    """
+    Compare the accuracy and latency of deadline-bounded queries with unbounded ones on the
+    testing projects of a fold.
+
+    :param prop_file: Properties file of the evaluation.
+    :param deadlines: The deadlines to compare, in seconds.
+    :param fold: The fold to evaluate.
+    :param num_of_neighbors: Number of neighbors to consider for the recommendation engine.
+    :param ns: The cutoffs of the reported metrics.
+    :return: A dictionary mapping every deadline (None when unbounded) to its (mean seconds,
+             maximum seconds, mean number of neighbors used, metrics), the metrics mapping every
+             cutoff to its (success rate, precision, recall).
+    """
+    runner = Runner()
+    runner.load_configurations(prop_file)
+    # Similarities, testing invocations and ground truth of the fold
+    runner.evaluate_fold(fold, runner.num_of_projects // 10, num_of_neighbors, runner.similarity_type, list(ns))
+    engine, calc, testing_projects = create_engine(runner, fold, num_of_neighbors)
+
+    results = {}
+    for deadline in [None] + sorted(deadlines):
+        latencies = []
+        num_of_used = 0
+        totals = {n: [0, 0, 0] for n in ns}
+        for project in testing_projects:
+            before = time.monotonic()
+            ranking, used = engine.query(project, deadline, max(ns))
+            latencies.append(time.monotonic() - before)
+            num_of_used += used
+
+            metrics = calc.compute_ranking_metrics(project, [mi for mi, _ in ranking], ns)
+            for n in ns:
+                for i in range(3):
+                    totals[n][i] += metrics[n][i]
+
+        count = len(testing_projects)
+        metrics = {n: (totals[n][0] * 100 / count, totals[n][1] / count, totals[n][2] / count) for n in ns}
+        results[deadline] = (sum(latencies) / count, max(latencies), num_of_used / count, metrics)
+
+    print("Deadline\tMean ms\tMax ms\tNeighbors\t" + "\t".join(f"SR@{n}\tP@{n}\tR@{n}" for n in ns))
+    for deadline, (mean_time, max_time, neighbors, metrics) in results.items():
+        label = f"{deadline * 1000:g} ms" if deadline is not None else "none"
+        values = "\t".join(f"{metrics[n][0]:.2f}\t{metrics[n][1]:.3f}\t{metrics[n][2]:.3f}" for n in ns)
+        print(f"{label}\t{mean_time * 1000:.2f}\t{max_time * 1000:.2f}\t{neighbors:.1f}\t{values}")
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Interactive MemoRec recommendation queries.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    query = commands.add_parser("query", help="Recommend invocations for a testing project within a deadline")
+    query.add_argument("properties", help="Properties file of the evaluation")
+    query.add_argument("project", help="Testing project of the fold")
+    query.add_argument("--deadline", type=float, help="Deadline in milliseconds (default: none)")
+    query.add_argument("--top", type=int, default=20, help="Number of recommendations")
+    batch = commands.add_parser("declarations", help="Recommend invocations for several declarations of a testing project")
+    batch.add_argument("properties", help="Properties file of the evaluation")
+    batch.add_argument("project", help="Testing project of the fold")
+    batch.add_argument("--declaration", action="append", required=True, metavar="DECLARATION=MI,MI",
+                       help="Active declaration and the invocations it already contains, may be repeated")
+    batch.add_argument("--top", type=int, default=20, help="Number of recommendations per declaration")
+    bench = commands.add_parser("benchmark", help="Compare accuracy and latency against the deadline")
+    bench.add_argument("properties", help="Properties file of the evaluation")
+    bench.add_argument("--deadline", type=float, action="append",
+                       help="Deadline in milliseconds, may be repeated (default: 1, 5, 20 and 100)")
+    for command in (query, batch, bench):
+        command.add_argument("--fold", type=int, default=0, help="Fold of the testing project, from 0 to 9")
+        command.add_argument("--neighbors", type=int, default=20, help="Number of neighbors")
+    options = parser.parse_args(args)
+
+    if options.command == "benchmark":
+        deadlines = options.deadline or [1, 5, 20, 100]
+        benchmark(options.properties, [deadline / 1000 for deadline in deadlines], options.fold, options.neighbors)
+        return
+
+    runner = Runner()
+    if not runner.load_configurations(options.properties):
+        return
+    engine, _, testing_projects = create_engine(runner, options.fold, options.neighbors)
+    if options.project not in testing_projects:
+        log.error(f"{options.project} is not a testing project of fold {options.fold}")
+        return
+    if options.command == "declarations":
+        active_declarations = {}
+        for declaration in options.declaration:
+            md, _, mis = declaration.partition("=")
+            active_declarations[md] = {mi for mi in mis.split(",") if mi}
+        rankings = engine.query_declarations(options.project, active_declarations, options.top)
+        for md, ranking in rankings.items():
+            for mi, rating in ranking:
+                print(f"{md}\t{mi}\t{rating}")
+        return
+
+    deadline = options.deadline / 1000 if options.deadline is not None else None
+    ranking, used = engine.query(options.project, deadline, options.top)
+    log.info("%d recommendations from %d of %d neighbors", len(ranking), used, options.neighbors)
+    for mi, rating in ranking:
+        print(f"{mi}\t{rating}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
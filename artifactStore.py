@@ -0,0 +1,237 @@
+import io
+import os
+import sys
+import sqlite3
+import logging
+
+class FileArtifactStore:
+    """
+    Default artifact store: every artifact is a file in the per-project layout
+    `<src_dir>/<sub_folder>/<kind>/<project>`.
+    """
+
+    def open(self, filename, mode='r'):
+        return open(filename, mode)
+
+    def makedirs(self, directory):
+        os.makedirs(directory, exist_ok=True)
+
+    def set_k(self, k):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteArtifactStore:
+    """
+    Artifact store keeping the similarities, testing invocations, ground truth and
+    recommendations of a run in a single SQLite database instead of one file per testing
+    project.
+
+    Artifacts are addressed by the same paths as in the per-file layout: a path
+    `<root>/<scope>/<kind>/<project>` whose kind is one of `KINDS` is mapped to the row
+    (scope, kind, k, project), where the scope is the sub-folder of the evaluation round and
+    k the number of neighbors the recommendations were computed with. Any other path is
+    opened as a regular file. Writes are buffered and committed in batched transactions.
+
+    Every process opens its own connection on first use, so that a store can be shared with
+    worker processes, whether they are forked or started from scratch.
+
+    :param db_file: Path of the SQLite database.
+    :param root: The source directory the artifact paths are relative to.
+    :param batch_size: Number of artifacts written per transaction.
+    """
+
+    log = logging.getLogger("SQLiteArtifactStore")
+
+    KINDS = ("Similarities", "TestingInvocations", "GroundTruth", "Recommendations")
+
+    def __init__(self, db_file, root, batch_size=1000):
+        self.db_file = db_file
+        self.root = os.path.abspath(root)
+        self.batch_size = batch_size
+        self.k = -1
+        self.pending = {}
+        self.connection = None
+        self.pid = None
+        self.get_connection()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["connection"] = None
+        state["pending"] = {}
+        return state
+
+    def get_connection(self):
+        """
+        Get the connection of the current process to the database, opening it if needed. A
+        connection inherited from the parent process is never used, and the artifacts it
+        buffered are left to the parent to commit.
+        """
+        if self.connection is None or self.pid != os.getpid():
+            if self.pid != os.getpid():
+                self.pending = {}
+            self.connection = sqlite3.connect(self.db_file, timeout=60)
+            self.pid = os.getpid()
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "scope TEXT NOT NULL, kind TEXT NOT NULL, k INTEGER NOT NULL, project TEXT NOT NULL, "
+                "content TEXT NOT NULL, PRIMARY KEY (scope, kind, k, project))")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS artifacts_by_project ON artifacts (project, scope)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS artifacts_by_round ON artifacts (scope, k, kind)")
+            self.connection.commit()
+        return self.connection
+
+    def set_k(self, k):
+        """
+        Set the number of neighbors the recommendations written from now on belong to.
+        """
+        self.k = k
+
+    def is_artifact_dir(self, directory):
+        """
+        Check whether a directory of the per-file layout holds artifacts kept in the database.
+        """
+        kind_dir = os.path.abspath(directory)
+        scope_dir = os.path.dirname(kind_dir)
+        return os.path.basename(kind_dir) in self.KINDS and os.path.commonpath([self.root, scope_dir]) == self.root
+
+    def makedirs(self, directory):
+        """
+        Create a directory of the per-file layout, unless its artifacts are kept in the database.
+        """
+        if not self.is_artifact_dir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def get_key(self, filename):
+        """
+        Map an artifact path to its key.
+
+        :param filename: The path of the artifact in the per-file layout.
+        :return: A (scope, kind, k, project) tuple, or None if the path is not an artifact.
+        """
+        path = os.path.abspath(filename)
+        kind_dir = os.path.dirname(path)
+        kind = os.path.basename(kind_dir)
+        scope_dir = os.path.dirname(kind_dir)
+        if not self.is_artifact_dir(kind_dir):
+            return None
+
+        scope = os.path.relpath(scope_dir, self.root)
+        k = self.k if kind == "Recommendations" else -1
+        return scope, kind, k, os.path.basename(path)
+
+    def open(self, filename, mode='r'):
+        """
+        Open an artifact for reading or writing.
+
+        :param filename: The path of the artifact in the per-file layout.
+        :param mode: 'r' or 'w'.
+        :return: A file-like object; written content is stored when the object is closed.
+        """
+        key = self.get_key(filename)
+        if key is None:
+            return open(filename, mode)
+
+        if 'w' in mode:
+            store = self
+
+            class ArtifactWriter(io.StringIO):
+                def close(self):
+                    if not self.closed:
+                        store.write(key, self.getvalue())
+                    super().close()
+
+            return ArtifactWriter()
+
+        content = self.read(key)
+        if content is None:
+            raise FileNotFoundError(f"No artifact {filename} in {self.db_file}")
+        return io.StringIO(content)
+
+    def write(self, key, content):
+        self.pending[key] = content
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def read(self, key):
+        if key in self.pending:
+            return self.pending[key]
+        row = self.get_connection().execute(
+            "SELECT content FROM artifacts WHERE scope = ? AND kind = ? AND k = ? AND project = ?", key).fetchone()
+        return row[0] if row else None
+
+    def flush(self):
+        """
+        Commit the buffered artifacts in one transaction.
+        """
+        if self.pending:
+            connection = self.get_connection()
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO artifacts (scope, kind, k, project, content) VALUES (?, ?, ?, ?, ?)",
+                    [key + (content,) for key, content in self.pending.items()])
+            self.pending.clear()
+
+    def close(self):
+        if self.connection is not None and self.pid == os.getpid():
+            self.flush()
+            self.connection.close()
+        self.connection = None
+
+    def get_projects(self, scope, kind, k=-1):
+        """
+        List the projects having an artifact of a kind in an evaluation round.
+
+        :param scope: The sub-folder of the evaluation round.
+        :param kind: The kind of artifact.
+        :param k: The number of neighbors, for recommendations.
+        :return: A sorted list of project names.
+        """
+        self.flush()
+        rows = self.get_connection().execute(
+            "SELECT project FROM artifacts WHERE scope = ? AND k = ? AND kind = ? ORDER BY project",
+            (scope, k, kind))
+        return [row[0] for row in rows]
+
+    def export(self, target_root, k=None):
+        """
+        Write the artifacts to the per-file layout.
+
+        :param target_root: The directory the layout is written under.
+        :param k: Export the recommendations computed with this number of neighbors. If None,
+                  the last recommendations written for every project are exported.
+        :return: The number of files written.
+        """
+        self.flush()
+        query = "SELECT scope, kind, project, content FROM artifacts"
+        params = ()
+        if k is not None:
+            query += " WHERE kind != 'Recommendations' OR k = ?"
+            params = (k,)
+
+        count = 0
+        for scope, kind, project, content in self.get_connection().execute(query + " ORDER BY rowid", params):
+            directory = os.path.join(target_root, scope, kind)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, project), 'w') as writer:
+                writer.write(content)
+            count += 1
+
+        self.log.info("Exported %d artifacts to %s", count, target_root)
+        return count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 4 or sys.argv[1] != "export":
+        print("Usage: python artifactStore.py export <database> <target directory> [k]")
+        sys.exit(1)
+
+    store = SQLiteArtifactStore(sys.argv[2], sys.argv[3])
+    store.export(sys.argv[3], int(sys.argv[4]) if len(sys.argv) > 4 else None)
+    store.close()
@@ -1,13 +1,27 @@
 import os
+import time
+import heapq
 import numpy as np
+from itertools import islice
 from collections import defaultdict
 from typing import List, Dict, Set
 
-from dataReader import *
-from graphSimilarity import *
+from dataReader import DataReader
+from graphSimilarity import GraphBasedSimilarityCalculator
 
 class ContextAwareRecommendation:
-    def __init__(self, source_dir: str, sub_folder: str, num_of_neighbors: int, testing_start_pos: int, testing_end_pos: int):
+    """
+    Context-aware recommendation of method invocations from a user-item-context matrix of
+    the most similar projects.
+
+    :param prune_candidates: Score only the declarations sharing at least one invocation with
+                             the active declaration, found through an inverted index. Otherwise,
+                             every declaration of every neighbor project is scored.
+    :param cutoff: Number of recommendations written for every testing project, None for all of them.
+    """
+
+    def __init__(self, source_dir: str, sub_folder: str, num_of_neighbors: int, testing_start_pos: int, testing_end_pos: int,
+                 prune_candidates: bool = True, cutoff: int = None):
         self.src_dir = source_dir
         self.sub_folder = sub_folder
         self.num_of_neighbors = num_of_neighbors
@@ -16,9 +30,15 @@ class ContextAwareRecommendation:
         self.sim_dir = os.path.join(self.src_dir, self.sub_folder, "Similarities")
         self.testing_start_pos = testing_start_pos
         self.testing_end_pos = testing_end_pos
+        self.testing_projects = None
+        self.prune_candidates = prune_candidates
+        self.cutoff = cutoff
         self.reader = DataReader()
 
         self.num_of_slices = self.num_of_rows = self.num_of_cols = None
+        # Inverted index from an invocation to the (slice, row) declarations of the neighbor projects containing it
+        self.declaration_index = None
+        self.active_invocations = None
 
     def build_user_item_context_matrix(self, testing_pro: str, list_of_projects: List[str], list_of_method_invocations: List[str]) -> np.ndarray:
         sim_projects = self.reader.get_most_similar_projects(os.path.join(self.sim_dir, testing_pro), self.num_of_neighbors)
@@ -125,27 +145,47 @@ class ContextAwareRecommendation:
             else:
                 matrix[self.num_of_slices - 1, self.num_of_rows - 1, k] = -1
 
+        self.build_declaration_index(list_of_prs, list_of_mds, all_projects)
+        self.active_invocations = set(tmp_mi_set)
+
         # Adding projects and method invocations to the respective lists
         list_of_projects.extend(list_of_prs)
         list_of_method_invocations.extend(list_of_mis)
         return matrix
 
-    def recommendation(self):
-        testing_projects = self.reader.read_project_list(os.path.join(self.src_dir, "List.txt"), self.testing_start_pos, self.testing_end_pos)
-
-        for testing_pro in testing_projects:
-            # print(testing_projects[testing_pro])
-            recommendations = {}
-            list_of_prs = []
-            list_of_mis = []
-
-            sim_scores = self.reader.get_similarity_scores(os.path.join(self.sim_dir, testing_projects[testing_pro]), self.num_of_neighbors)
-            matrix = self.build_user_item_context_matrix(testing_projects[testing_pro], list_of_prs, list_of_mis)
-
-            # print(sim_scores, matrix)
-            # testing_method_vector = matrix[-1, -1]
+    def build_declaration_index(self, list_of_prs: List[str], list_of_mds: List[str],
+                                all_projects: Dict[str, Dict[str, Set[str]]]):
+        """
+        Build the inverted index from every invocation to the rows of the neighbor slices of
+        the matrix that contain it.
+
+        :param list_of_prs: The projects of the slices, the testing project last.
+        :param list_of_mds: The declarations of the rows.
+        :param all_projects: A dictionary mapping projects to their declarations and invocations.
+        """
+        row_ids = {md: j for j, md in enumerate(list_of_mds)}
+        self.declaration_index = defaultdict(list)
+        for i in range(len(list_of_prs) - 1):
+            for md, mis in all_projects.get(list_of_prs[i], {}).items():
+                for mi in set(mis):
+                    self.declaration_index[mi].append((i, row_ids[md]))
+
+    def get_top_declarations(self, matrix: np.ndarray, num_of_declarations: int = 3) -> Dict[str, float]:
+        """
+        Find the declarations of the neighbor projects most similar to the active declaration.
+
+        The Jaccard similarity of a row only depends on the number of invocations it shares with
+        the active declaration, so with pruning only the rows found in the inverted index are
+        scored and all other rows implicitly score zero. Ties keep the (slice, row) order of
+        the exhaustive scan, and zero-score rows fill up the result in the same order, so both
+        paths return the same declarations.
+
+        :param matrix: The user-item-context matrix.
+        :param num_of_declarations: The number of declarations to return.
+        :return: A dictionary mapping "slice#row" keys to their similarity, by decreasing similarity.
+        """
+        if not self.prune_candidates:
             testing_method_vector = matrix[self.num_of_slices - 1][self.num_of_rows - 1]
-            # print(self.num_of_slices, self.num_of_rows)
             md_sim_scores = {}
 
             for i in range(self.num_of_slices - 1):
@@ -154,47 +194,285 @@ class ContextAwareRecommendation:
 
                     sim_calculator = GraphBasedSimilarityCalculator(self.src_dir)
                     sim = sim_calculator.compute_jaccard_similarity(testing_method_vector, other_method_vector)
-                    # print(sim)
                     key = f"{i}#{j}"
                     md_sim_scores[key] = sim
 
             sim_sorted_map = sorted(md_sim_scores.items(), key=lambda item: item[1], reverse=True)
-            top3_sim = dict(sim_sorted_map[:3])
+            return dict(sim_sorted_map[:num_of_declarations])
 
-            try:
-                ratings = np.zeros(self.num_of_cols - 1)
-                for k in range(self.num_of_cols):
-                    if matrix[self.num_of_slices - 1][self.num_of_rows - 1][k] == -1:
-                        total_sim = 0
-
-                        for key, method_sim in top3_sim.items():
-                            slice_idx, row_idx = map(int, key.split("#"))
-                            avg_md_rating = np.mean(matrix[slice_idx][row_idx])
-                            project = list_of_prs[slice_idx]
-                            project_sim = sim_scores[project]
-                            val = project_sim * matrix[slice_idx][row_idx][k]
-
-                            total_sim += method_sim
-                            try:
-                                ratings[k] += (val - avg_md_rating) * method_sim
-                            except Exception as e:
-                                print(f"Error processing {testing_projects[testing_pro]}: {e}")
-
-                        if total_sim != 0:
-                            ratings[k] /= total_sim
-
-                        active_md_rating = 0.8
-                        ratings[k] += active_md_rating
-                        method_invocation = list_of_mis[k]
-                        recommendations[method_invocation] = ratings[k]
+        shared = defaultdict(int)
+        for mi in self.active_invocations:
+            for row in self.declaration_index.get(mi, ()):
+                shared[row] += 1
+
+        candidates = sorted(shared.items(), key=lambda item: (-item[1], item[0]))
+        top = {f"{i}#{j}": count / (2 * self.num_of_cols - count)
+               for (i, j), count in candidates[:num_of_declarations]}
+
+        if len(top) < num_of_declarations:
+            for i in range(self.num_of_slices - 1):
+                for j in range(self.num_of_rows):
+                    if len(top) == num_of_declarations:
+                        return top
+                    if (i, j) not in shared:
+                        top[f"{i}#{j}"] = 0.0
+        return top
+
+    def rank_invocations(self, matrix: np.ndarray, top_declarations: Dict[str, float], list_of_prs: List[str],
+                         list_of_mis: List[str], sim_scores: Dict[str, float]):
+        """
+        Rank the invocations missing from the active declaration.
+
+        The rating of an invocation only depends on the cells of its column in the top
+        declarations, so every invocation none of them contains gets the same baseline rating.
+        Only the columns of the invocations found in the top declarations are scored; the
+        others are merged into the ranking with the baseline rating as it is consumed. Ties
+        keep the column order, as in a stable sort of all the ratings.
+
+        :param matrix: The user-item-context matrix.
+        :param top_declarations: The top declarations, as returned by `get_top_declarations`.
+        :param list_of_prs: The projects of the slices of the matrix.
+        :param list_of_mis: The invocations of the columns of the matrix.
+        :param sim_scores: A dictionary mapping the neighbor projects to their similarity.
+        :return: An iterator over (invocation, rating) tuples by decreasing rating.
+        """
+        neighbors = []
+        for key, method_sim in top_declarations.items():
+            slice_idx, row_idx = map(int, key.split("#"))
+            row = matrix[slice_idx][row_idx]
+            neighbors.append(({list_of_mis[k] for k in np.flatnonzero(row)}, np.mean(row),
+                              sim_scores[list_of_prs[slice_idx]], method_sim))
+
+        open_cols = np.flatnonzero(matrix[self.num_of_slices - 1][self.num_of_rows - 1][:self.num_of_cols - 1] == -1)
+        return self.rank_open_invocations(neighbors, [list_of_mis[k] for k in open_cols])
+
+    @staticmethod
+    def rank_open_invocations(neighbors, open_mis: List[str]):
+        """
+        Rate the invocations missing from the active declaration from the top declarations.
+
+        :param neighbors: A list of (invocations, mean rating, project similarity, declaration
+                          similarity) tuples of the top declarations.
+        :param open_mis: The invocations missing from the active declaration, in column order.
+        :return: An iterator over (invocation, rating) tuples by decreasing rating.
+        """
+        total_sim = 0
+        for _, _, _, method_sim in neighbors:
+            total_sim += method_sim
+
+        def rate(mi):
+            rating = 0.0
+            for mis, avg_md_rating, project_sim, method_sim in neighbors:
+                value = 1 if mi in mis else 0
+                rating += (project_sim * value - avg_md_rating) * method_sim
+            if total_sim != 0:
+                rating /= total_sim
+            active_md_rating = 0.8
+            return rating + active_md_rating
+
+        contained = set()
+        for mis, _, _, _ in neighbors:
+            contained |= mis
+
+        scored = sorted((-rate(mi), k) for k, mi in enumerate(open_mis) if mi in contained)
+        baseline = -rate(None)
+        rest = ((baseline, k) for k, mi in enumerate(open_mis) if mi not in contained)
+        return ((open_mis[k], -rating) for rating, k in heapq.merge(scored, rest))
+
+    def set_testing_projects(self, testing_projects):
+        """
+        Restrict the recommendation to a subset of the testing projects.
+
+        :param testing_projects: The IDs of the testing projects to process, None for all of them.
+        """
+        self.testing_projects = set(testing_projects) if testing_projects is not None else None
+
+    def recommendation(self):
+        testing_projects = self.reader.read_project_list(os.path.join(self.src_dir, "List.txt"), self.testing_start_pos, self.testing_end_pos)
+        if self.testing_projects is not None:
+            testing_projects = {pos: project for pos, project in testing_projects.items()
+                                if project in self.testing_projects}
+
+        for testing_pro in testing_projects:
+            # print(testing_projects[testing_pro])
+            list_of_prs = []
+            list_of_mis = []
+
+            sim_scores = self.reader.get_similarity_scores(os.path.join(self.sim_dir, testing_projects[testing_pro]), self.num_of_neighbors)
+            matrix = self.build_user_item_context_matrix(testing_projects[testing_pro], list_of_prs, list_of_mis)
+
+            top3_sim = self.get_top_declarations(matrix)
 
+            # Consumed one by one, so that the recommendations ranked before an error are still written
+            rec_sorted_map = {}
+            try:
+                ranking = self.rank_invocations(matrix, top3_sim, list_of_prs, list_of_mis, sim_scores)
+                for method_invocation, rating in islice(ranking, self.cutoff):
+                    rec_sorted_map[method_invocation] = rating
             except Exception as e:
                 print(f"Error processing {testing_projects[testing_pro]}: {e}")
 
-            rec_sorted_map = dict(sorted(recommendations.items(), key=lambda item: item[1], reverse=True))
+            self.reader.make_artifact_dir(self.rec_dir)
+
+            self.reader.write_recommendations(os.path.join(self.rec_dir, testing_projects[testing_pro]), rec_sorted_map, rec_sorted_map)
+
+    def query(self, testing_pro: str, deadline: float = None, cutoff: int = 20):
+        """
+        Anytime recommendation for the active declaration of a testing project.
+
+        The neighbor projects are added one at a time by decreasing project similarity, and the
+        ranking is refined after each of them from the declarations of the neighbors added so
+        far, through an inverted index instead of the user-item-context matrix. A neighbor is
+        only added if the mean time of the previous ones still fits in the deadline. With all
+        the neighbors, the ranking is the one written by `recommendation`.
+
+        :param testing_pro: The testing project.
+        :param deadline: Time budget of the query in seconds, None to add all the neighbors.
+        :param cutoff: Number of recommendations returned, None for all of them.
+        :return: A tuple (ranking, number of neighbors used), the ranking being a list of
+                 (invocation, rating) tuples by decreasing rating.
+        """
+        start = time.monotonic()
+        sim_projects = self.reader.get_most_similar_projects(os.path.join(self.sim_dir, testing_pro), self.num_of_neighbors)
+        sim_scores = self.reader.get_similarity_scores(os.path.join(self.sim_dir, testing_pro), self.num_of_neighbors)
+
+        ground_truth_mis = self.reader.get_ground_truth_invocations(self.ground_truth, testing_pro)
+        testing_mis = {}
+        tmp_mis = self.reader.get_testing_project_details(self.src_dir, testing_pro, ground_truth_mis, testing_mis)
+        testing_md = list(testing_mis.keys())[0]
+        active_mis = testing_mis[testing_md]
+
+        all_mis = set(active_mis)
+        for mis in tmp_mis.values():
+            all_mis.update(mis)
+
+        # Declarations of the neighbors as (row order, project, invocations) and the inverted index over them
+        declarations = []
+        declaration_index = defaultdict(list)
+
+        def rank():
+            shared = defaultdict(int)
+            for mi in active_mis:
+                for declaration in declaration_index.get(mi, ()):
+                    shared[declaration] += 1
+            top = sorted(shared.items(), key=lambda item: (-item[1], declarations[item[0]][0]))[:3]
+
+            num_of_cols = len(all_mis)
+            neighbors = []
+            for declaration, count in top:
+                _, project, mis = declarations[declaration]
+                neighbors.append((mis, len(mis) / num_of_cols, sim_scores[project], count / (2 * num_of_cols - count)))
+
+            open_mis = sorted(all_mis - active_mis)
+            if not active_mis:
+                # The last column of the matrix is never rated
+                open_mis = open_mis[:-1]
+            return list(islice(self.rank_open_invocations(neighbors, open_mis), cutoff))
+
+        ranking = rank()
+        num_of_used = 0
+        neighbors_start = time.monotonic()
+        for i, project in enumerate(sim_projects.values()):
+            now = time.monotonic()
+            mean_time = (now - neighbors_start) / num_of_used if num_of_used else 0
+            if deadline is not None and now - start + mean_time > deadline:
+                break
+
+            for md, mis in self.reader.get_project_details_from_arff2(self.src_dir, project).items():
+                # Rows of the matrix are sorted by declaration, the active declaration last
+                declarations.append(((i, md == testing_md, md), project, mis))
+                for mi in mis:
+                    declaration_index[mi].append(len(declarations) - 1)
+                all_mis.update(mis)
+
+            ranking = rank()
+            num_of_used += 1
+
+        return ranking, num_of_used
+
+    def query_declarations(self, testing_pro: str, active_declarations: Dict[str, Set[str]], cutoff: int = 20):
+        """
+        Recommend invocations for several active declarations of a testing project at once.
+
+        The neighbor slices are built once, as a binary matrix of the declarations of the
+        neighbor projects over the invocations of the neighbors and of the testing project. The
+        invocations shared by every active declaration with every neighbor declaration are
+        counted with one matrix product, and the ratings of all the active declarations are
+        computed together from their top declarations. The other declarations of the testing
+        project are read from its file, each active declaration taking the place of its own
+        lines with the invocations given for it.
+
+        :param testing_pro: The testing project.
+        :param active_declarations: A dictionary mapping the active declarations to the
+                                    invocations they already contain.
+        :param cutoff: Number of recommendations returned for every declaration, None for all of them.
+        :return: A dictionary mapping every active declaration to its ranking, a list of
+                 (invocation, rating) tuples by decreasing rating.
+        """
+        sim_projects = self.reader.get_most_similar_projects(os.path.join(self.sim_dir, testing_pro), self.num_of_neighbors)
+        sim_scores = self.reader.get_similarity_scores(os.path.join(self.sim_dir, testing_pro), self.num_of_neighbors)
 
-            if not os.path.exists(self.rec_dir):
-                os.makedirs(self.rec_dir)
+        all_mis = set()
+        for md, mis in self.reader.get_project_declarations(self.src_dir, testing_pro).items():
+            if md not in active_declarations:
+                all_mis.update(mis)
+        for mis in active_declarations.values():
+            all_mis.update(mis)
+
+        # Declarations of the neighbor slices, in slice order
+        rows = []
+        for i, project in enumerate(sim_projects.values()):
+            for md, mis in self.reader.get_project_details_from_arff2(self.src_dir, project).items():
+                rows.append((i, md, project, mis))
+                all_mis.update(mis)
 
-            self.reader.write_recommendations(os.path.join(self.rec_dir, testing_projects[testing_pro]), rec_sorted_map, recommendations)
-            
\ No newline at end of file
+        list_of_mis = sorted(all_mis)
+        num_of_cols = len(list_of_mis)
+        col_ids = {mi: k for k, mi in enumerate(list_of_mis)}
+        # The last row stays empty, for the declarations with fewer than three top declarations
+        neighbor_matrix = np.zeros((len(rows) + 1, num_of_cols), dtype=np.uint8)
+        for r, (_, _, _, mis) in enumerate(rows):
+            neighbor_matrix[r, [col_ids[mi] for mi in mis]] = 1
+
+        mds = list(active_declarations)
+        active_matrix = np.zeros((len(mds), num_of_cols), dtype=np.uint8)
+        for a, md in enumerate(mds):
+            active_matrix[a, [col_ids[mi] for mi in active_declarations[md]]] = 1
+        shared = active_matrix.astype(np.float64) @ neighbor_matrix.T.astype(np.float64)
+        row_sizes = neighbor_matrix.sum(axis=1)
+
+        num_of_declarations = 3
+        top_rows = np.full((len(mds), num_of_declarations), len(rows))
+        top_terms = np.zeros((len(mds), num_of_declarations, 3))
+        total_sims = []
+        for a, md in enumerate(mds):
+            # Ties keep the row order of the matrix, where the active declaration is the last row
+            candidates = sorted(np.flatnonzero(shared[a]).tolist(),
+                                key=lambda r: (-shared[a, r], rows[r][0], rows[r][1] == md, rows[r][1]))
+            total_sim = 0
+            for t, r in enumerate(candidates[:num_of_declarations]):
+                count = int(shared[a, r])
+                method_sim = count / (2 * num_of_cols - count)
+                top_rows[a, t] = r
+                top_terms[a, t] = (sim_scores[rows[r][2]], row_sizes[r] / num_of_cols, method_sim)
+                total_sim += method_sim
+            total_sims.append(total_sim)
+
+        ratings = np.zeros((len(mds), num_of_cols))
+        for t in range(num_of_declarations):
+            project_sim, avg_md_rating, method_sim = (top_terms[:, t, c][:, None] for c in range(3))
+            ratings += (project_sim * neighbor_matrix[top_rows[:, t]] - avg_md_rating) * method_sim
+        total_sims = np.array(total_sims)[:, None]
+        ratings = np.divide(ratings, total_sims, out=ratings, where=total_sims != 0)
+        active_md_rating = 0.8
+        ratings += active_md_rating
+
+        rankings = {}
+        for a, md in enumerate(mds):
+            open_cols = np.flatnonzero(active_matrix[a] == 0)
+            if not active_declarations[md]:
+                # The last column of the matrix is never rated
+                open_cols = open_cols[:-1]
+            order = open_cols[np.argsort(-ratings[a, open_cols], kind="stable")][:cutoff]
+            rankings[md] = [(list_of_mis[k], float(ratings[a, k])) for k in order]
+        return rankings
@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+from collections import defaultdict
+from typing import Dict
+
+from dataReader import DataReader
+
+class CooccurrenceRecommendation:
+    """
+    Recommendation engine based on a precomputed item-item co-occurrence matrix.
+
+    The sparse invocation-by-invocation matrix counts, for every pair of invocations, the
+    training declarations that contain both of them. It is built once per fold; a query is
+    then scored by summing the rows of the invocations already known for the active
+    declaration, so its cost only depends on the size of the query.
+
+    :param source_dir: Source directory where the project data is located.
+    :param sub_folder: Sub-folder under the source directory of the evaluation round.
+    :param training_start_pos1: Start position for the first set of training data.
+    :param training_end_pos1: End position for the first set of training data.
+    :param training_start_pos2: Start position for the second set of training data.
+    :param training_end_pos2: End position for the second set of training data.
+    :param testing_start_pos: Start position for the testing data.
+    :param testing_end_pos: End position for the testing data.
+    """
+
+    log = logging.getLogger("CooccurrenceRecommendation")
+
+    def __init__(self, source_dir: str, sub_folder: str, training_start_pos1: int, training_end_pos1: int,
+                 training_start_pos2: int, training_end_pos2: int, testing_start_pos: int, testing_end_pos: int):
+        self.src_dir = source_dir
+        self.sub_folder = sub_folder
+        self.ground_truth = os.path.join(self.src_dir, self.sub_folder, "GroundTruth")
+        self.rec_dir = os.path.join(self.src_dir, self.sub_folder, "Recommendations")
+        self.training_start_pos1 = training_start_pos1
+        self.training_end_pos1 = training_end_pos1
+        self.training_start_pos2 = training_start_pos2
+        self.training_end_pos2 = training_end_pos2
+        self.testing_start_pos = testing_start_pos
+        self.testing_end_pos = testing_end_pos
+        self.testing_projects = None
+        self.reader = DataReader()
+
+        self.invocation_ids = {}
+        self.invocations = []
+        self.popularity = []
+        self.matrix = None
+
+    def set_testing_projects(self, testing_projects):
+        """
+        Restrict the recommendation to a subset of the testing projects.
+
+        :param testing_projects: The IDs of the testing projects to process, None for all of them.
+        """
+        self.testing_projects = set(testing_projects) if testing_projects is not None else None
+
+    def get_invocation_id(self, invocation: str) -> int:
+        if invocation not in self.invocation_ids:
+            self.invocation_ids[invocation] = len(self.invocations)
+            self.invocations.append(invocation)
+            self.popularity.append(0)
+            self.matrix.append(defaultdict(int))
+        return self.invocation_ids[invocation]
+
+    def build_cooccurrence_matrix(self):
+        """
+        Build the sparse co-occurrence matrix over all declarations of the training projects.
+        Every row is a dictionary mapping the co-occurring invocation ids to their counts.
+        """
+        before = time.time()
+        self.matrix = []
+        list_file = os.path.join(self.src_dir, "List.txt")
+
+        training_projects = {}
+        if self.training_start_pos1 < self.training_end_pos1:
+            training_projects.update(self.reader.read_project_list(list_file, self.training_start_pos1,
+                                                                   self.training_end_pos1))
+        if self.training_start_pos2 < self.training_end_pos2:
+            training_projects.update(self.reader.read_project_list(list_file, self.training_start_pos2,
+                                                                   self.training_end_pos2))
+
+        num_of_declarations = 0
+        for project in training_projects.values():
+            for invocations in self.reader.get_project_details_from_arff2(self.src_dir, project).values():
+                ids = [self.get_invocation_id(mi) for mi in invocations]
+                for i in ids:
+                    self.popularity[i] += 1
+                    row = self.matrix[i]
+                    for j in ids:
+                        if i != j:
+                            row[j] += 1
+                num_of_declarations += 1
+
+        self.log.info("Co-occurrence matrix of %d invocations built from %d declarations in %.2f ms",
+                      len(self.invocations), num_of_declarations, (time.time() - before) * 1000)
+
+    def recommend(self, known_invocations) -> Dict[str, float]:
+        """
+        Score the candidate invocations of an active declaration by summing the co-occurrence
+        rows of its known invocations.
+
+        :param known_invocations: The invocations already present in the active declaration.
+        :return: A dictionary of candidate invocations and their scores, sorted by decreasing score.
+                 Ties are broken by the popularity of the invocation, then by its name.
+        """
+        scores = defaultdict(int)
+        known_ids = set()
+        for invocation in known_invocations:
+            invocation_id = self.invocation_ids.get(invocation)
+            if invocation_id is not None:
+                known_ids.add(invocation_id)
+                for other, count in self.matrix[invocation_id].items():
+                    scores[other] += count
+
+        for invocation_id in known_ids:
+            scores.pop(invocation_id, None)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -self.popularity[item[0]],
+                                                          self.invocations[item[0]]))
+        return {self.invocations[invocation_id]: float(score) for invocation_id, score in ranked}
+
+    def recommendation(self):
+        """
+        Compute and write the recommendations of all testing projects of the fold.
+        """
+        if self.matrix is None:
+            self.build_cooccurrence_matrix()
+
+        testing_projects = self.reader.read_project_list(os.path.join(self.src_dir, "List.txt"),
+                                                         self.testing_start_pos, self.testing_end_pos)
+        if self.testing_projects is not None:
+            testing_projects = {pos: project for pos, project in testing_projects.items()
+                                if project in self.testing_projects}
+
+        self.reader.make_artifact_dir(self.rec_dir)
+
+        query_time = 0
+        for testing_pro in testing_projects.values():
+            ground_truth_mis = self.reader.get_ground_truth_invocations(self.ground_truth, testing_pro)
+            testing_mis = {}
+            self.reader.get_testing_project_details(self.src_dir, testing_pro, ground_truth_mis, testing_mis)
+            known_invocations = next(iter(testing_mis.values()), set())
+
+            before = time.time()
+            recommendations = self.recommend(known_invocations)
+            query_time += time.time() - before
+
+            self.reader.write_recommendations(os.path.join(self.rec_dir, testing_pro), recommendations,
+                                              recommendations)
+
+        if testing_projects:
+            self.log.info("Average co-occurrence query latency %.3f ms over %d queries",
+                          query_time * 1000 / len(testing_projects), len(testing_projects))
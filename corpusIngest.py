@@ -0,0 +1,204 @@
+import os
+import sys
+import time
+import pickle
+import hashlib
+import logging
+import argparse
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from dataReader import DataReader
+
+class Corpus:
+    """
+    Parsed dataset, holding for every project the structures DataReader builds from its file:
+    the invocation frequencies (`get_project_invocations`), the declarations with their
+    invocation lists (`get_project_details2`) and the declarations with their invocation sets
+    (`get_project_details_from_arff2`). The corpus records the fingerprint of the dataset it
+    was ingested from, so that a corpus file is not used once the dataset changed.
+
+    :param src_dir: Source directory the corpus was ingested from.
+    """
+
+    def __init__(self, src_dir):
+        self.src_dir = os.path.abspath(src_dir)
+        self.fingerprint = None
+        self.invocations = {}
+        self.declarations = {}
+        self.arff_declarations = {}
+
+    def __len__(self):
+        return len(self.invocations)
+
+    def covers(self, path):
+        """
+        Check whether a directory is the source directory of the corpus.
+        """
+        return os.path.abspath(path) == self.src_dir
+
+    def save(self, filename):
+        with open(filename, 'wb') as writer:
+            pickle.dump(self, writer, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(filename, src_dir=None):
+        """
+        Load a corpus file, refusing it if it was ingested from another version of the dataset.
+
+        :param filename: Path of the corpus file.
+        :param src_dir: Source directory of the dataset the corpus is used with, None to skip the check.
+        :return: The Corpus.
+        :raise ValueError: If the fingerprint of the dataset changed since the ingestion.
+        """
+        with open(filename, 'rb') as reader:
+            corpus = pickle.load(reader)
+        if src_dir is not None:
+            fingerprint = Corpus.dataset_fingerprint(src_dir)
+            if fingerprint is None or fingerprint != getattr(corpus, "fingerprint", None):
+                raise ValueError(f"{filename} was ingested from another version of {src_dir}")
+        return corpus
+
+    @staticmethod
+    def dataset_fingerprint(src_dir):
+        """
+        Compute a fingerprint of a dataset from the content of List.txt and the size and
+        modification time of every project file, without reading them.
+
+        :param src_dir: Source directory of the dataset.
+        :return: A hexadecimal digest, or None if a file is missing.
+        """
+        reader = DataReader()
+        list_file = os.path.join(src_dir, "List.txt")
+        digest = hashlib.sha256()
+        try:
+            with reader.source.open(list_file) as file:
+                digest.update(file.read().encode())
+            for project in reader.read_project_list(list_file, 1, -1).values():
+                stat = os.stat(reader.source.locate(os.path.join(src_dir, project)))
+                digest.update(f"{project}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode())
+        except (OSError, TypeError):
+            return None
+        return digest.hexdigest()
+
+
+def parse_project(src_dir, project):
+    """
+    Parse one project file into all the structures of the corpus, reading it only once. A
+    project that cannot be read or parsed fails the ingestion instead of being stored empty.
+
+    :param src_dir: The source directory.
+    :param project: The project file name.
+    :return: A tuple (project, invocations, declarations, arff declarations, size in bytes).
+    :raise ValueError: If the project file cannot be read or parsed.
+    """
+    reader = DataReader()
+    filename = os.path.join(src_dir, project)
+    try:
+        with reader.open_dataset(filename) as file:
+            lines = file.readlines()
+
+        invocations = defaultdict(int)
+        reader.parse_invocations(lines, invocations)
+        declarations = OrderedDict()
+        reader.parse_declarations(lines, declarations)
+        reader.remove_short_declarations(declarations)
+        arff_declarations = {}
+        reader.parse_arff_declarations(lines, arff_declarations)
+    except (OSError, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Couldn't parse project {filename}: {e}") from e
+
+    try:
+        size = os.path.getsize(reader.source.locate(filename))
+    except (OSError, TypeError):
+        size = 0
+    return project, dict(invocations), declarations, arff_declarations, size
+
+
+def parse_projects(src_dir, projects):
+    return [parse_project(src_dir, project) for project in projects]
+
+
+class CorpusIngestor:
+    """
+    Cold-start ingest of a dataset: discovers all the projects listed in List.txt and parses
+    them in parallel across cores, in one pass, into a Corpus.
+
+    :param src_dir: Source directory of the dataset.
+    :param num_of_workers: Number of worker processes, defaults to the number of CPUs.
+    :param chunk_size: Number of projects parsed per task.
+    """
+
+    log = logging.getLogger("CorpusIngestor")
+
+    def __init__(self, src_dir, num_of_workers=None, chunk_size=64):
+        self.src_dir = src_dir
+        self.num_of_workers = num_of_workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.reader = DataReader()
+
+    def ingest(self):
+        """
+        Parse all the projects of the dataset.
+
+        :return: A tuple with the Corpus and a dictionary of statistics: number of files,
+                 bytes, seconds, files/sec and MB/sec.
+        """
+        before = time.time()
+        projects = list(dict.fromkeys(
+            self.reader.read_project_list(os.path.join(self.src_dir, "List.txt"), 1, -1).values()))
+        chunks = [projects[i:i + self.chunk_size] for i in range(0, len(projects), self.chunk_size)]
+
+        corpus = Corpus(self.src_dir)
+        # Taken before parsing, so that files changed during the ingestion invalidate the corpus
+        corpus.fingerprint = Corpus.dataset_fingerprint(self.src_dir)
+        num_of_bytes = 0
+        if self.num_of_workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=self.num_of_workers, initializer=DataReader.set_worker_state,
+                                     initargs=(DataReader.get_worker_state(),)) as executor:
+                results = executor.map(parse_projects, [self.src_dir] * len(chunks), chunks)
+                for chunk in results:
+                    num_of_bytes += self.add(corpus, chunk)
+        else:
+            for chunk in chunks:
+                num_of_bytes += self.add(corpus, parse_projects(self.src_dir, chunk))
+
+        elapsed = max(time.time() - before, 1e-9)
+        stats = {
+            "files": len(projects),
+            "bytes": num_of_bytes,
+            "seconds": elapsed,
+            "files_per_sec": len(projects) / elapsed,
+            "mb_per_sec": num_of_bytes / (1024 * 1024) / elapsed,
+        }
+        self.log.info("Ingested %d files (%.2f MB) in %.2f s with %d workers: %.1f files/sec, %.2f MB/sec",
+                      stats["files"], num_of_bytes / (1024 * 1024), elapsed, self.num_of_workers,
+                      stats["files_per_sec"], stats["mb_per_sec"])
+        return corpus, stats
+
+    @staticmethod
+    def add(corpus, chunk):
+        num_of_bytes = 0
+        for project, invocations, declarations, arff_declarations, size in chunk:
+            corpus.invocations[project] = invocations
+            corpus.declarations[project] = declarations
+            corpus.arff_declarations[project] = arff_declarations
+            num_of_bytes += size
+        return num_of_bytes
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Parse a MemoRec dataset in parallel into a corpus file.")
+    parser.add_argument("src_dir", help="Source directory of the dataset")
+    parser.add_argument("output", help="Corpus file to write")
+    parser.add_argument("--workers", type=int, help="Number of worker processes")
+    options = parser.parse_args(args)
+
+    corpus, stats = CorpusIngestor(options.src_dir, options.workers).ingest()
+    corpus.save(options.output)
+    print(f"{stats['files']} files, {stats['files_per_sec']:.1f} files/sec, {stats['mb_per_sec']:.2f} MB/sec")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
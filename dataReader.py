@@ -3,15 +3,107 @@ from collections import defaultdict, OrderedDict
 from typing import Dict, Set
 
 import logging
-# Configure the logger
-logging.basicConfig(level=logging.DEBUG,  # Set the minimum level of severity to DEBUG
-                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+from artifactStore import FileArtifactStore
+from datasetSource import DatasetSource
 
 class DataReader:
 
+    # Store of the evaluation artifacts (similarities, testing invocations, ground truth and
+    # recommendations), shared by all readers. Defaults to one file per testing project.
+    store = FileArtifactStore()
+
+    # Source of the dataset files, reading them uncompressed, compressed or from an archive
+    source = DatasetSource()
+
+    # Parsed dataset shared by all readers, see corpusIngest.Corpus. Project files found in it
+    # are not read again.
+    corpus = None
+
     def __init__(self):
         self.log = logging.getLogger("DataReader_Class")
 
+    @classmethod
+    def set_store(cls, store):
+        """
+        Set the store of the evaluation artifacts used by all readers.
+
+        :param store: A FileArtifactStore or SQLiteArtifactStore.
+        """
+        cls.store = store
+
+    @classmethod
+    def set_corpus(cls, corpus):
+        """
+        Set the parsed dataset used by all readers instead of the project files.
+
+        :param corpus: A corpusIngest.Corpus, or None to read the project files.
+        """
+        cls.corpus = corpus
+
+    @classmethod
+    def get_worker_state(cls):
+        """
+        Get the state shared by all readers, to initialize worker processes with instead of
+        relying on them inheriting it: the source of the dataset files, the store of the
+        evaluation artifacts and the parsed dataset. A parsed dataset with a shared layout (a
+        model snapshot) is passed as its handle, so that workers attach to it without copying it.
+
+        :return: A picklable tuple, to pass to `set_worker_state` in the workers.
+        """
+        return cls.source, cls.store, getattr(cls.corpus, "handle", None)
+
+    @classmethod
+    def set_worker_state(cls, state):
+        """
+        Initialize the readers of a worker process, e.g. as the initializer of a process pool.
+
+        :param state: The tuple returned by `get_worker_state` in the parent process.
+        """
+        cls.source, cls.store, corpus_handle = state
+        corpus = None
+        if corpus_handle is not None:
+            from sharedCorpus import SharedCorpus
+            corpus = SharedCorpus.attach(corpus_handle)
+        cls.corpus = corpus
+
+    @classmethod
+    def set_source(cls, source):
+        """
+        Set the source of the dataset files used by all readers.
+
+        :param source: A DatasetSource.
+        """
+        cls.source = source
+
+    def open_dataset(self, filename):
+        """
+        Open a file of the dataset (List.txt, a project or arff file) through the configured source.
+
+        :param filename: The path of the file in the uncompressed layout.
+        :return: A text file object.
+        """
+        return self.source.open(filename)
+
+    def open_artifact(self, filename, mode='r'):
+        """
+        Open an evaluation artifact through the configured store.
+
+        :param filename: The path of the artifact in the per-file layout.
+        :param mode: 'r' or 'w'.
+        :return: A file-like object.
+        """
+        return self.store.open(filename, mode)
+
+    def make_artifact_dir(self, directory):
+        """
+        Create a directory of evaluation artifacts, unless the configured store does not keep
+        them in files.
+
+        :param directory: The path of the directory in the per-file layout.
+        """
+        self.store.makedirs(directory)
+
     def read_project_list(self, filename, start_pos, end_pos):
         """
         Reads a list of projects from a file, returning a dictionary mapping an index to each project name.
@@ -25,7 +117,7 @@ class DataReader:
         project_id = start_pos
 
         try:
-            with open(filename, 'r') as reader:
+            with self.open_dataset(filename) as reader:
                 # Skip lines until we reach the start position
                 while start_pos != -1 and count < start_pos:
                     line = reader.readline()
@@ -61,7 +153,7 @@ class DataReader:
         count = 0
 
         try:
-            with open(filename, 'r') as file:
+            with self.open_artifact(filename, 'r') as file:
                 for line in file:
                     vals = line.split("\t")
                     library = vals[0].strip()
@@ -86,7 +178,7 @@ class DataReader:
         ret = set()
 
         try:
-            with open(filename, 'r') as reader:
+            with self.open_artifact(filename, 'r') as reader:
                 for line in reader:
                     vals = line.split("#")
                     invocation = vals[1].strip()
@@ -106,18 +198,16 @@ class DataReader:
         :param name: The name of the file containing the method invocations.
         :return: A dictionary mapping the project name to its method invocations and their frequencies.
         """
+        if self.corpus is not None and name in self.corpus.invocations and self.corpus.covers(path):
+            return defaultdict(dict, {name: dict(self.corpus.invocations[name])})
+
         method_invocations = defaultdict(dict)
         terms = defaultdict(int)
         filename = os.path.join(path, name)
 
         try:
-            with open(filename, 'r') as reader:
-                for line in reader:
-                    parts = line.strip().split("#")
-                    mi = parts[1].strip()
-
-                    # Update frequency of the method invocation
-                    terms[mi] += 1
+            with self.open_dataset(filename) as reader:
+                self.parse_invocations(reader, terms)
 
         except Exception as e:
             # self.log.error(f"Couldn't read file {filename}", exc_info=True)
@@ -126,76 +216,119 @@ class DataReader:
         method_invocations[name] = dict(terms)
         return method_invocations
 
+    @staticmethod
+    def parse_invocations(lines, terms):
+        """
+        Count the method invocations of the lines of a project file.
+
+        :param lines: The lines of the project file.
+        :param terms: The dictionary of invocation frequencies to update.
+        """
+        for line in lines:
+            parts = line.strip().split("#")
+            mi = parts[1].strip()
+
+            # Update frequency of the method invocation
+            terms[mi] += 1
+
     def get_project_details2(self, path, filename):
+        if self.corpus is not None and filename in self.corpus.declarations and self.corpus.covers(path):
+            return OrderedDict((md, list(mis)) for md, mis in self.corpus.declarations[filename].items())
+
         method_invocations = OrderedDict()  # Equivalent of LinkedHashMap in Java
         filename = os.path.join(path, filename)
+
+        try:
+            with self.open_dataset(filename) as reader:
+                self.parse_declarations(reader, method_invocations)
+        except Exception as e:
+            self.log.error(f"Couldn't read file {filename}", exc_info=True)
+
+        self.remove_short_declarations(method_invocations)
+        # print(method_invocations)
+        return method_invocations
+
+    @staticmethod
+    def parse_declarations(lines, method_invocations):
+        """
+        Group the method invocations of the lines of a project file by declaration, in file order.
+
+        :param lines: The lines of the project file.
+        :param method_invocations: The dictionary of declarations and their invocation lists to update.
+        """
         prev_md = ""
         current_md = ""
         start = True
         done_declarations = set()
 
-        try:
-            with open(filename, 'r') as reader:
-                for line in reader:
-                    parts = line.strip().split("#")
-                    md = parts[0].strip()
-                    mi = parts[1].strip()
-
-                    # To avoid a project with two identical method declarations
-                    if start:
-                        prev_md = md
-                        start = False
-                    current_md = md
-
-                    if current_md != prev_md:
-                        done_declarations.add(prev_md)
-                        prev_md = current_md
-
-                    if current_md not in done_declarations:
-                        if md in method_invocations:
-                            vector = method_invocations[md]
-                        else:
-                            vector = []
-                        vector.append(mi)
-                        method_invocations[md] = vector
-        except Exception as e:
-            log.error(f"Couldn't read file {filename}", exc_info=True)
-
+        for line in lines:
+            parts = line.strip().split("#")
+            md = parts[0].strip()
+            mi = parts[1].strip()
+
+            # To avoid a project with two identical method declarations
+            if start:
+                prev_md = md
+                start = False
+            current_md = md
+
+            if current_md != prev_md:
+                done_declarations.add(prev_md)
+                prev_md = current_md
+
+            if current_md not in done_declarations:
+                if md in method_invocations:
+                    vector = method_invocations[md]
+                else:
+                    vector = []
+                vector.append(mi)
+                method_invocations[md] = vector
+
+    @staticmethod
+    def remove_short_declarations(method_invocations):
         # Remove all declarations with fewer than 2 invocations from the data
         temp = [key for key in method_invocations if len(method_invocations[key]) < 2]
 
         for key in temp:
             method_invocations.pop(key)
-        
-        # print(method_invocations)
-        return method_invocations
     
-    def get_testing_project_invocations(self, path, sub_folder, filename, num_of_invocations, remove_half):
+    def split_testing_project(self, path, filename, num_of_invocations, remove_half):
+        """
+        Split a testing project into the part visible to the recommender and the ground truth.
+
+        :param path: The directory path where the project file is located.
+        :param filename: The name of the project file.
+        :param num_of_invocations: Number of invocations of the testing declaration kept as query.
+        :param remove_half: Whether the second half of the declarations is removed.
+        :return: A tuple with the remaining method declarations and their invocations, the testing
+                 declaration, its query invocations and its ground-truth invocations.
+        """
         # print(num_of_invocations)
         method_invocations = self.get_project_details2(path, filename)
 
-        key_set = set(method_invocations.keys())
-        removed_key = set()
+        # Declarations are taken in file order, so that the split does not depend on the hash
+        # seed and cached splits stay valid across processes
+        key_list = list(method_invocations.keys())
+        removed_key = []
 
         # Remove the last half of the method declarations if there are more than 5
-        if len(key_set) < 3:
+        if len(key_list) < 3:
             remove_half = False
 
         if remove_half:
             size = len(method_invocations)
             half = round(size / 2)
             count = 0
-            for key in key_set:
+            for key in key_list:
                 count += 1
                 if count > half:
-                    removed_key.add(key)
+                    removed_key.append(key)
 
         # Remove the last declarations
         for key in removed_key:
             method_invocations.pop(key, None)
 
-        key_set = set(method_invocations.keys())
-        key_list = list(key_set)
+        key_list = list(method_invocations.keys())
         size = len(key_list)
 
         # Select the last method as testing
@@ -221,12 +354,26 @@ class DataReader:
         tmp_method_invocations = {testing_declaration: invocation_list}
         method_invocations.update(tmp_method_invocations)
 
+        return method_invocations, testing_declaration, query, ground_truth_mis
+
+    def write_testing_split(self, path, sub_folder, filename, testing_declaration, query, ground_truth_mis):
+        """
+        Write the query and ground-truth invocations of a testing project to the TestingInvocations
+        and GroundTruth directories of an evaluation round.
+
+        :param path: The source directory.
+        :param sub_folder: The sub-folder of the evaluation round.
+        :param filename: The name of the testing project.
+        :param testing_declaration: The testing declaration.
+        :param query: The invocations of the testing declaration kept as query.
+        :param ground_truth_mis: The invocations of the testing declaration to be recommended.
+        """
         testing_invocation_location = os.path.join(path, sub_folder, "TestingInvocations")
-        os.makedirs(testing_invocation_location, exist_ok=True)
+        self.make_artifact_dir(testing_invocation_location)
 
         # Save the testing method invocations to an external file for future usage
         try:
-            with open(os.path.join(testing_invocation_location, filename), 'w') as writer:
+            with self.open_artifact(os.path.join(testing_invocation_location, filename), 'w') as writer:
                 for invocation in query:
                     content = f"{testing_declaration}#{invocation}"
                     writer.write(content + '\n')
@@ -234,19 +381,24 @@ class DataReader:
             print(f"Couldn't read file {testing_invocation_location}{filename}: {e}")
 
         ground_truth_path = os.path.join(path, sub_folder, "GroundTruth")
-        os.makedirs(ground_truth_path, exist_ok=True)
+        self.make_artifact_dir(ground_truth_path)
 
         # Save the ground-truth method invocations to an external file for future comparison
         # print("gtm", ground_truth_mis)
         # exit()
         try:
-            with open(os.path.join(ground_truth_path, filename), 'w') as writer:
-                for s in ground_truth_mis:
+            with self.open_artifact(os.path.join(ground_truth_path, filename), 'w') as writer:
+                for s in sorted(ground_truth_mis):
                     content = f"{testing_declaration}#{s}"
                     writer.write(content + '\n')
         except IOError as e:
             print(f"Couldn't read file {ground_truth_path}{filename}: {e}")
 
+    def get_testing_project_invocations(self, path, sub_folder, filename, num_of_invocations, remove_half):
+        method_invocations, testing_declaration, query, ground_truth_mis = self.split_testing_project(
+            path, filename, num_of_invocations, remove_half)
+        self.write_testing_split(path, sub_folder, filename, testing_declaration, query, ground_truth_mis)
+
         ret = {}
         map = defaultdict(int)
 
@@ -262,50 +414,64 @@ class DataReader:
         filename = os.path.join(sim_dir, project)
 
         try:
-            with open(filename, 'w') as writer:
+            with self.open_artifact(filename, 'w') as writer:
                 for project_name, similarity_score in similarities.items():
                     writer.write(f"{project}\t{project_name}\t{similarity_score}\n")
                     writer.flush()
         except IOError as e:
-            log.error(f"Couldn't write file {filename}", exc_info=True)
+            self.log.error(f"Couldn't write file {filename}", exc_info=True)
     
 
 
     def get_project_details_from_arff2(self, path: str, filename: str) -> Dict[str, Set[str]]:
+        if self.corpus is not None and filename in self.corpus.arff_declarations and self.corpus.covers(path):
+            return {md: set(mis) for md, mis in self.corpus.arff_declarations[filename].items()}
+
         method_invocations = {}
         filename = os.path.join(path, filename)
-        count = 0
 
         try:
-            with open(filename, 'r') as file:
-                for line in file:
-                    count += 1
-                    if count > 6:
-                        parts = line.split('#')
-                        md = parts[0].replace("'", "").strip()
-                        temp = parts[1].replace("'", "").strip()
-
-                        invocations = temp.split()
-                        vector = method_invocations.get(md, set())
-
-                        for mi in invocations:
-                            mi = mi.strip()
-                            if mi:
-                                vector.add(mi)
-
-                        method_invocations[md] = vector
+            with self.open_dataset(filename) as file:
+                self.parse_arff_declarations(file, method_invocations)
 
         except IOError as e:
             print(f"Couldn't read file {filename}: {e}")
 
         return method_invocations
+
+    @staticmethod
+    def parse_arff_declarations(lines, method_invocations):
+        """
+        Collect the sets of method invocations of every declaration of the lines of an arff
+        file, skipping its header.
+
+        :param lines: The lines of the arff file.
+        :param method_invocations: The dictionary of declarations and their invocation sets to update.
+        """
+        count = 0
+        for line in lines:
+            count += 1
+            if count > 6:
+                parts = line.split('#')
+                md = parts[0].replace("'", "").strip()
+                temp = parts[1].replace("'", "").strip()
+
+                invocations = temp.split()
+                vector = method_invocations.get(md, set())
+
+                for mi in invocations:
+                    mi = mi.strip()
+                    if mi:
+                        vector.add(mi)
+
+                method_invocations[md] = vector
     
     def get_most_similar_projects(self, filename: str, size: int) -> Dict[int, str]:
         projects = {}
         count = 0
 
         try:
-            with open(filename, 'r') as file:
+            with self.open_artifact(filename, 'r') as file:
                 for line in file:
                     vals = line.split('\t')
                     if len(vals) > 1:
@@ -323,7 +489,7 @@ class DataReader:
         projects = {}
         count = 0
         try:
-            with open(filename, 'r') as file:
+            with self.open_artifact(filename, 'r') as file:
                 for line in file:
                     vals = line.split('\t')
                     if len(vals) > 2:
@@ -347,7 +513,7 @@ class DataReader:
 
         # print("file", file_path)
         try:
-            with open(file_path, 'r') as file:
+            with self.open_artifact(file_path, 'r') as file:
                 for line in file:
                     # print(line)
                     gt_invocations.add(line.strip())
@@ -377,7 +543,7 @@ class DataReader:
         # print("fp", file_path)
 
         try:
-            with open(file_path, 'r') as file:
+            with self.open_dataset(file_path) as file:
                 for line in file:
                     line = line.strip()
                     if testing_md in line:
@@ -401,9 +567,29 @@ class DataReader:
         # print(testing_mis)
         return method_invocations
     
+    def get_project_declarations(self, path: str, filename: str) -> Dict[str, Set[str]]:
+        """
+        Read the declarations of a project file with their invocation sets.
+
+        :param path: The directory path where the project file is located.
+        :param filename: The name of the project file.
+        :return: A dictionary mapping every declaration to the set of its invocations.
+        """
+        method_invocations = {}
+        file_path = os.path.join(path, filename)
+        try:
+            with self.open_dataset(file_path) as file:
+                for line in file:
+                    parts = line.strip().split("#")
+                    if len(parts) > 1:
+                        method_invocations.setdefault(parts[0].strip(), set()).add(parts[1].strip())
+        except IOError as e:
+            print(f"Couldn't read file {file_path}: {e}")
+        return method_invocations
+
     def write_recommendations(self, filename: str, sorted_map: dict, recommendations: dict) -> None:
         try:
-            with open(filename, 'w') as file:
+            with self.open_artifact(filename, 'w') as file:
                 for key in sorted_map.keys():
                     file.write(f"{key}\t{recommendations.get(key)}\n")
         except IOError as e:
@@ -0,0 +1,464 @@
+import io
+import os
+import sys
+import gzip
+import time
+import queue
+import shutil
+import logging
+import tarfile
+import zipfile
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class ReadAheadStream(io.RawIOBase):
+    """
+    Binary stream decompressed ahead of the reader by a background thread, so that parsing
+    overlaps with reading and decompressing the next chunks. zlib and zstd release the GIL
+    while decompressing.
+
+    :param stream: The decompressing binary stream.
+    :param chunk_size: Number of bytes decompressed at a time.
+    :param depth: Number of chunks decompressed ahead of the reader.
+    """
+
+    def __init__(self, stream, chunk_size=1 << 18, depth=8):
+        super().__init__()
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=depth)
+        self.pending = memoryview(b"")
+        self.eof = False
+        self.stopped = False
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def fill(self):
+        while not self.stopped:
+            try:
+                chunk = self.stream.read(self.chunk_size)
+            except Exception as e:
+                chunk = e
+            while not self.stopped:
+                try:
+                    self.chunks.put(chunk, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if not chunk or isinstance(chunk, Exception):
+                return
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self.pending:
+            if self.eof:
+                return 0
+            chunk = self.chunks.get()
+            if isinstance(chunk, Exception):
+                self.eof = True
+                raise chunk
+            if not chunk:
+                self.eof = True
+                return 0
+            self.pending = memoryview(chunk)
+
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.stopped = True
+            self.thread.join()
+            self.stream.close()
+        super().close()
+
+
+class RestartingStream(io.RawIOBase):
+    """
+    Seekable view of a decompressing binary stream that can only be read forward: seeking
+    forward skips the decompressed bytes, seeking backward decompresses again from the start.
+
+    :param opener: A function opening the decompressing stream from the start.
+    """
+
+    def __init__(self, opener):
+        super().__init__()
+        self.opener = opener
+        self.stream = opener()
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        chunk = self.stream.read(len(buffer))
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Cannot seek from the end of a decompressing stream")
+        if offset < self.position:
+            self.stream.close()
+            self.stream = self.opener()
+            self.position = 0
+        while self.position < offset:
+            chunk = self.stream.read(min(1 << 20, offset - self.position))
+            if not chunk:
+                break
+            self.position += len(chunk)
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+        super().close()
+
+
+class ArchiveDataset:
+    """
+    Dataset files read from the members of an archive. Members are decompressed one at a time
+    by a background thread, which decompresses the `prefetch` members following the last one
+    opened, in archive order, so that parsing a member overlaps with decompressing the next
+    ones whatever their size. At most `prefetch` members are held in memory ahead of the reader.
+
+    :param members: A dictionary mapping the member names to the members, in archive order.
+    :param prefetch: Number of members decompressed ahead of the reader.
+    """
+
+    def __init__(self, members, prefetch):
+        self.members = members
+        self.order = list(members)
+        self.positions = {name: pos for pos, name in enumerate(self.order)}
+        self.prefetch = prefetch
+        # A single thread reads the archive, which is not thread-safe
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = {}
+
+    def read(self, member):
+        """
+        Decompress a member.
+
+        :return: The content of the member, as bytes.
+        """
+        raise NotImplementedError
+
+    def open(self, name):
+        future = self.pending.pop(name, None)
+        if future is None:
+            future = self.executor.submit(self.read, self.members[name])
+
+        pos = self.positions[name]
+        ahead = self.order[pos + 1:pos + 1 + self.prefetch]
+        for other in set(self.pending) - set(ahead):
+            self.pending.pop(other).cancel()
+        for other in ahead:
+            if other not in self.pending:
+                self.pending[other] = self.executor.submit(self.read, self.members[other])
+        return io.BytesIO(future.result())
+
+    def __contains__(self, name):
+        return name in self.members
+
+
+class ZipDataset(ArchiveDataset):
+    """
+    Dataset files read from a zip archive, whose members are decompressed independently.
+    """
+
+    def __init__(self, filename, prefetch=8):
+        self.archive = zipfile.ZipFile(filename)
+        super().__init__(strip_common_prefix({info.filename: info for info in self.archive.infolist()
+                                              if not info.is_dir()}), prefetch)
+
+    def read(self, member):
+        return self.archive.read(member)
+
+
+class TarDataset(ArchiveDataset):
+    """
+    Dataset files read from a tar archive, optionally gzip, bzip2, xz or zstd compressed.
+    The headers of the members are indexed in one streaming pass on first access, and
+    members are then decompressed from the archive as they are read, so the archive is never
+    held in memory. A compressed tar archive cannot be read at random without decompressing it
+    again from the start, so members are best read in archive order, i.e. in List.txt order for
+    the archives written by `compress_dataset`.
+    """
+
+    def __init__(self, filename, prefetch=8):
+        if filename.endswith(".zst"):
+            self.archive = tarfile.open(fileobj=RestartingStream(lambda: open_zstd(filename)), mode='r:')
+        else:
+            self.archive = tarfile.open(filename, mode='r:*')
+        super().__init__(strip_common_prefix({info.name: info for info in self.archive.getmembers()
+                                              if info.isfile()}), prefetch)
+
+    def read(self, member):
+        with self.archive.extractfile(member) as file:
+            return file.read()
+
+
+def strip_common_prefix(members):
+    """
+    Remove the top-level directory of the members of an archive, if they all share one.
+    """
+    prefixes = {name.split("/", 1)[0] for name in members}
+    if len(prefixes) == 1 and all("/" in name for name in members):
+        return {name.split("/", 1)[1]: member for name, member in members.items()}
+    return members
+
+
+def open_zstd(filename):
+    try:
+        import zstandard
+    except ImportError as e:
+        raise IOError(f"Reading {filename} requires the zstandard package") from e
+    return zstandard.open(filename, 'rb')
+
+
+class DatasetSource:
+    """
+    Opens the files of the dataset (List.txt, project and arff files) for DataReader.
+
+    A file missing from the source directory is read from its gzip (`.gz`) or zstd (`.zst`)
+    compressed copy next to it, or from the archive of the dataset if one is set. Compressed
+    files are decompressed as streams, and decompression runs ahead of parsing in a background
+    thread for files of at least `read_ahead_size` compressed bytes. The members of an archive
+    are decompressed ahead of parsing by count, `prefetch` members at a time.
+
+    :param archive: Path of a zip or tar archive holding the dataset, None if there is none.
+    :param root: The directory the paths of the archive members are relative to, i.e. the
+                 source directory.
+    :param read_ahead_size: Minimum compressed size in bytes of a file decompressed ahead.
+    :param chunk_size: Number of bytes decompressed at a time ahead of the reader.
+    :param depth: Number of chunks decompressed ahead of the reader.
+    :param prefetch: Number of archive members decompressed ahead of the reader.
+    """
+
+    log = logging.getLogger("DatasetSource")
+
+    COMPRESSED_SUFFIXES = (".gz", ".zst")
+
+    def __init__(self, archive=None, root=None, read_ahead_size=1 << 20, chunk_size=1 << 18, depth=8,
+                 prefetch=8):
+        self.archive_file = archive
+        self.root = os.path.abspath(root) if root else None
+        self.read_ahead_size = read_ahead_size
+        self.chunk_size = chunk_size
+        self.depth = depth
+        self.prefetch = prefetch
+        self.archive = None
+        # Process the archive was opened in, since forked processes do not inherit its thread
+        self.archive_pid = None
+
+    def __getstate__(self):
+        # Worker processes open the archive again
+        state = dict(self.__dict__)
+        state["archive"] = None
+        return state
+
+    def open(self, filename):
+        """
+        Open a file of the dataset as text.
+
+        :param filename: The path of the file in the uncompressed layout.
+        :return: A text file object.
+        """
+        try:
+            return open(filename, 'r')
+        except FileNotFoundError:
+            pass
+
+        for suffix in self.COMPRESSED_SUFFIXES:
+            if os.path.exists(filename + suffix):
+                return io.TextIOWrapper(self.open_compressed(filename + suffix))
+
+        member = self.get_member(filename)
+        if member is not None and member in self.get_archive():
+            return io.TextIOWrapper(self.get_archive().open(member))
+        raise FileNotFoundError(f"No such file in the dataset: {filename}")
+
+    def open_compressed(self, filename):
+        """
+        Open a compressed file as a decompressed binary stream.
+        """
+        if filename.endswith(".gz"):
+            stream = gzip.open(filename, 'rb')
+        else:
+            stream = open_zstd(filename)
+
+        if os.path.getsize(filename) >= self.read_ahead_size:
+            return io.BufferedReader(ReadAheadStream(stream, self.chunk_size, self.depth))
+        return stream
+
+    def get_member(self, filename):
+        """
+        Map a path of the uncompressed layout to the name of its archive member.
+
+        :return: The member name, or None if there is no archive or the path is not under the root.
+        """
+        if self.archive_file is None or self.root is None:
+            return None
+        path = os.path.abspath(filename)
+        if os.path.commonpath([self.root, path]) != self.root:
+            return None
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def get_archive(self):
+        if self.archive is None or self.archive_pid != os.getpid():
+            before = time.time()
+            if zipfile.is_zipfile(self.archive_file):
+                self.archive = ZipDataset(self.archive_file, self.prefetch)
+            else:
+                self.archive = TarDataset(self.archive_file, self.prefetch)
+            self.archive_pid = os.getpid()
+            self.log.info("Opened dataset archive %s in %.2f s", self.archive_file, time.time() - before)
+        return self.archive
+
+    def locate(self, filename):
+        """
+        Find the file actually holding a file of the dataset, e.g. to compute its digest.
+
+        :param filename: The path of the file in the uncompressed layout.
+        :return: The path of the file, of its compressed copy or of the archive, or None if not found.
+        """
+        if os.path.exists(filename):
+            return filename
+        for suffix in self.COMPRESSED_SUFFIXES:
+            if os.path.exists(filename + suffix):
+                return filename + suffix
+        if self.get_member(filename) is not None and os.path.exists(self.archive_file):
+            return self.archive_file
+        return None
+
+
+def compress_dataset(src_dir, target_dir, layout):
+    """
+    Write a compressed copy of a dataset: List.txt and the project files it lists.
+
+    :param src_dir: Source directory of the uncompressed dataset.
+    :param target_dir: Directory to write the copy to.
+    :param layout: "plain", "gzip" or "zstd" for one file per project, "zip" or "tar.gz" for
+                   a single archive.
+    :return: The path of the archive, or None for the per-file layouts.
+    """
+    with open(os.path.join(src_dir, "List.txt"), 'r') as reader:
+        names = ["List.txt"] + [line.strip() for line in reader if line.strip()]
+    os.makedirs(target_dir, exist_ok=True)
+
+    if layout == "zip":
+        archive = os.path.join(target_dir, "dataset.zip")
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as writer:
+            for name in names:
+                writer.write(os.path.join(src_dir, name), name)
+        return archive
+    if layout == "tar.gz":
+        archive = os.path.join(target_dir, "dataset.tar.gz")
+        with tarfile.open(archive, 'w:gz') as writer:
+            for name in names:
+                writer.add(os.path.join(src_dir, name), name)
+        return archive
+
+    for name in names:
+        source = os.path.join(src_dir, name)
+        target = os.path.join(target_dir, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if layout == "plain":
+            shutil.copyfile(source, target)
+        elif layout == "gzip":
+            with open(source, 'rb') as reader, gzip.open(target + ".gz", 'wb') as writer:
+                shutil.copyfileobj(reader, writer)
+        elif layout == "zstd":
+            try:
+                import zstandard
+            except ImportError as e:
+                raise IOError("Writing zstd files requires the zstandard package") from e
+            with open(source, 'rb') as reader, zstandard.open(target + ".zst", 'wb') as writer:
+                shutil.copyfileobj(reader, writer)
+        else:
+            raise ValueError(f"Invalid layout {layout}")
+    return None
+
+
+def benchmark(prop_file, layouts, fold=0, num_of_neighbors=20):
+    """
+    Compare the end-to-end time of a fold (similarities, recommendations and metrics) on
+    compressed copies of the dataset against an uncompressed copy.
+
+    :param prop_file: Properties file of the evaluation.
+    :param layouts: The compressed layouts to compare, see `compress_dataset`.
+    :param fold: The fold to evaluate.
+    :param num_of_neighbors: Number of neighbors to consider for the recommendation engine.
+    :return: A dictionary mapping every layout to its (dataset bytes, seconds, metrics).
+    """
+    from runner import Runner
+    from dataReader import DataReader
+
+    results = {}
+    for layout in ["plain"] + [layout for layout in layouts if layout != "plain"]:
+        runner = Runner()
+        runner.load_configurations(prop_file)
+        runner.cache = None
+        DataReader.set_corpus(None)
+        source_dir = runner.src_dir
+
+        with tempfile.TemporaryDirectory() as target_dir:
+            archive = compress_dataset(source_dir, target_dir, layout)
+            size = sum(os.path.getsize(os.path.join(target_dir, name)) for name in os.listdir(target_dir))
+            runner.src_dir = target_dir + os.sep
+            DataReader.set_source(DatasetSource(archive, target_dir))
+
+            before = time.time()
+            metrics = runner.evaluate_fold(fold, runner.num_of_projects // 10, num_of_neighbors,
+                                           runner.similarity_type, list(range(1, 21)))
+            results[layout] = (size, time.time() - before, metrics)
+            DataReader.set_source(DatasetSource())
+
+    plain_time = results["plain"][1]
+    for layout, (size, seconds, metrics) in results.items():
+        same = "same metrics" if metrics == results["plain"][2] else "DIFFERENT metrics"
+        print(f"{layout}\t{size / (1024 * 1024):.2f} MB\t{seconds:.2f} s\t{seconds / plain_time:.2f}x\t{same}")
+    return results
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Compress a MemoRec dataset or benchmark reading it compressed.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compress = commands.add_parser("compress", help="Write a compressed copy of a dataset")
+    compress.add_argument("src_dir", help="Source directory of the dataset")
+    compress.add_argument("target_dir", help="Directory to write the copy to")
+    compress.add_argument("layout", choices=["gzip", "zstd", "zip", "tar.gz"])
+    bench = commands.add_parser("benchmark", help="Compare fold times on compressed and uncompressed copies")
+    bench.add_argument("properties", help="Properties file of the evaluation")
+    bench.add_argument("--layout", action="append", choices=["gzip", "zstd", "zip", "tar.gz"],
+                       help="Compressed layout to compare, may be repeated (default: gzip and zip)")
+    bench.add_argument("--fold", type=int, default=0, help="Fold to evaluate, from 0 to 9")
+    bench.add_argument("--neighbors", type=int, default=20, help="Number of neighbors")
+    options = parser.parse_args(args)
+
+    if options.command == "compress":
+        archive = compress_dataset(options.src_dir, options.target_dir, options.layout)
+        if archive:
+            print(f"Wrote {archive}; set datasetArchive to it and sourceDirectory to {options.target_dir}")
+    else:
+        benchmark(options.properties, options.layout or ["gzip", "zip"], options.fold, options.neighbors)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,350 @@
+import os
+import sys
+import math
+import time
+import logging
+import argparse
+
+from runner import Runner
+from dataReader import DataReader
+from stageCache import StageCache
+from artifactStore import FileArtifactStore, SQLiteArtifactStore
+from corpusIngest import Corpus, CorpusIngestor
+from nearDuplicates import NearDuplicateCollapser
+from anytimeQuery import create_engine
+
+class EquivalenceHarness:
+    """
+    Golden-output check of the fast execution paths of the pipeline.
+
+    One fold of the ten-fold cross-validation is evaluated twice on the same dataset slice:
+    once with the reference implementation (in-memory similarities, exhaustive declaration
+    scoring, sequential metrics, no cache, corpus or artifact store, context-aware engine
+    writing all the recommendations) and once with a fast path. The similarity rankings, the
+    recommendation orderings and the per-N metrics of both runs are compared, and the speedup
+    of the fast path is reported. The settings of the runner and of the shared reader state
+    are restored afterwards.
+
+    Fast paths are given as options of the runner:
+
+    - `memory_limit`: streaming similarities with this memory ceiling in MB, which keep only
+      the `num_of_neighbors` most similar projects, so that only the top of the similarity
+      rankings is compared;
+    - `prune_candidates`: candidate pruning of the context-aware recommendation (true/false);
+    - `workers`: number of processes computing the metrics;
+    - `cache`: directory of the stage cache;
+    - `corpus`: corpus file, ingested first if missing;
+    - `artifact_store`: SQLite database of the artifacts;
+    - `features`: number of hashed features of the graph similarity;
+    - `duplicates`: Jaccard threshold of near-duplicate collapsing;
+    - `cutoff`: number of recommendations written by the context-aware engine, so that only
+      the top of the recommendation orderings is compared;
+    - `query`: "anytime" to compare the rankings of unbounded anytime queries, "declarations"
+      to compare those of multi-declaration queries for the active declaration, instead of the
+      recommendations written by the engine.
+
+    :param runner: A Runner with the configurations loaded.
+    :param fold: The index of the fold to evaluate, from 0 to 9.
+    :param num_of_neighbors: Number of neighbors to consider for the recommendation engine.
+    :param rel_tol: Relative tolerance when comparing scores and metrics.
+    :param abs_tol: Absolute tolerance when comparing scores and metrics.
+    :param ties: "strict" to require the same order everywhere, "equal-scores" to accept any
+                 order among entries whose scores are equal within the tolerances.
+    :param top: Number of entries of every ranking compared, None for all of them.
+    """
+
+    log = logging.getLogger("EquivalenceHarness")
+
+    OPTIONS = ("memory_limit", "prune_candidates", "workers", "cache", "corpus", "artifact_store",
+               "features", "duplicates", "cutoff", "query")
+
+    # Settings of the runner changed by `configure`
+    RUNNER_ATTRIBUTES = ("memory_limit", "prune_candidates", "num_of_workers", "cache", "num_of_features",
+                         "collapser", "recommendation_cutoff", "recommendation_engine", "cooccurrence_engine")
+
+    def __init__(self, runner, fold=0, num_of_neighbors=20, rel_tol=0.0, abs_tol=0.0, ties="strict", top=None):
+        if ties not in ("strict", "equal-scores"):
+            raise ValueError(f"Invalid tie-breaking rule {ties}")
+        self.runner = runner
+        self.fold = fold
+        self.num_of_neighbors = num_of_neighbors
+        self.rel_tol = rel_tol
+        self.abs_tol = abs_tol
+        self.ties = ties
+        self.top = top
+        self.ns = list(range(1, 21))
+        self.reader = DataReader()
+        # Artifact store created by the last call of configure
+        self.store = None
+
+    def configure(self, options):
+        """
+        Configure the runner and the shared reader state for a run.
+
+        :param options: A dictionary of fast path options, empty for the reference implementation.
+        """
+        unknown = set(options) - set(self.OPTIONS)
+        if unknown:
+            raise ValueError(f"Unknown options {sorted(unknown)}")
+        if options.get("query") not in (None, "anytime", "declarations"):
+            raise ValueError(f"Invalid query mode {options['query']}")
+
+        runner = self.runner
+        memory_limit = options.get("memory_limit")
+        runner.memory_limit = int(float(memory_limit) * 1024 * 1024) if memory_limit else None
+        runner.prune_candidates = str(options.get("prune_candidates", "false")).lower() in ("true", "1", "yes")
+        runner.num_of_workers = int(options.get("workers", 1))
+        runner.cache = StageCache(options["cache"]) if options.get("cache") else None
+        runner.num_of_features = int(options["features"]) if options.get("features") else None
+        runner.collapser = NearDuplicateCollapser(runner.src_dir, float(options["duplicates"])) \
+            if options.get("duplicates") else None
+        runner.recommendation_cutoff = int(options["cutoff"]) if options.get("cutoff") else None
+        runner.recommendation_engine = "context-aware"
+
+        corpus = None
+        if options.get("corpus"):
+            if os.path.exists(options["corpus"]):
+                try:
+                    corpus = Corpus.load(options["corpus"], runner.src_dir)
+                except ValueError as e:
+                    self.log.warning(f"Ingesting the dataset again: {e}")
+            if corpus is None:
+                corpus, _ = CorpusIngestor(runner.src_dir).ingest()
+                corpus.save(options["corpus"])
+        DataReader.set_corpus(corpus)
+
+        # The store of the previous run is closed, the one of the caller only flushed
+        if DataReader.store is self.store:
+            DataReader.store.close()
+        else:
+            DataReader.store.flush()
+        if options.get("artifact_store"):
+            self.store = SQLiteArtifactStore(options["artifact_store"], runner.src_dir)
+        else:
+            self.store = FileArtifactStore()
+        DataReader.set_store(self.store)
+
+    def save_state(self):
+        """
+        Save the settings of the runner and the shared reader state changed by `configure`.
+
+        :return: A tuple to pass to `restore_state`.
+        """
+        return ({name: getattr(self.runner, name) for name in self.RUNNER_ATTRIBUTES},
+                DataReader.corpus, DataReader.store)
+
+    def restore_state(self, state):
+        """
+        Restore the settings saved by `save_state`, closing the artifact store of the last run.
+        """
+        attributes, corpus, store = state
+        for name, value in attributes.items():
+            setattr(self.runner, name, value)
+        DataReader.set_corpus(corpus)
+        if DataReader.store is self.store:
+            DataReader.store.close()
+        DataReader.set_store(store)
+        self.store = None
+
+    def evaluate(self, options):
+        """
+        Evaluate the fold with the given options and read back its outputs.
+
+        :param options: A dictionary of fast path options.
+        :return: A tuple (seconds, similarity rankings, recommendation orderings, metrics).
+        """
+        self.configure(options)
+        step = self.runner.num_of_projects // 10
+        before = time.time()
+        metrics = self.runner.evaluate_fold(self.fold, step, self.num_of_neighbors, self.runner.similarity_type,
+                                            self.ns)
+        elapsed = time.time() - before
+
+        fold_dir = os.path.join(self.runner.src_dir, f"evaluation/round{self.fold + 1}")
+        testing_start_pos, testing_end_pos = self.runner.get_fold_bounds(self.fold, step)[4:]
+        testing_projects = self.reader.read_project_list(
+            os.path.join(self.runner.src_dir, "List.txt"), testing_start_pos, testing_end_pos).values()
+
+        similarities = {project: self.read_ranking(os.path.join(fold_dir, "Similarities", project), 1)
+                        for project in testing_projects}
+        if options.get("query"):
+            before = time.time()
+            recommendations = self.query_recommendations(options["query"], testing_projects)
+            elapsed += time.time() - before
+        else:
+            recommendations = {project: self.read_ranking(os.path.join(fold_dir, "Recommendations", project), 0)
+                               for project in testing_projects}
+        return elapsed, similarities, recommendations, {int(n): tuple(values) for n, values in metrics.items()}
+
+    def query_recommendations(self, mode, testing_projects):
+        """
+        Recommend invocations for the active declaration of every testing project of the fold
+        with the query modes of the context-aware engine.
+
+        :param mode: "anytime" for queries without deadline, "declarations" for multi-declaration
+                     queries of the active declaration alone.
+        :param testing_projects: The testing projects of the fold.
+        :return: A dictionary mapping every testing project to its ranking, a list of
+                 (invocation, rating) tuples.
+        """
+        engine, _, _ = create_engine(self.runner, self.fold, self.num_of_neighbors)
+        cutoff = self.runner.recommendation_cutoff
+        recommendations = {}
+        for project in testing_projects:
+            if mode == "anytime":
+                recommendations[project], _ = engine.query(project, None, cutoff)
+            else:
+                ground_truth_mis = self.reader.get_ground_truth_invocations(engine.ground_truth, project)
+                testing_mis = {}
+                self.reader.get_testing_project_details(self.runner.src_dir, project, ground_truth_mis, testing_mis)
+                md, mis = next(iter(testing_mis.items()))
+                recommendations[project] = engine.query_declarations(project, {md: set(mis)}, cutoff)[md]
+        return recommendations
+
+    def read_ranking(self, filename, name_column):
+        """
+        Read a ranking written by the pipeline.
+
+        :param filename: The path of the artifact.
+        :param name_column: The column of the ranked names, the score being the last column.
+        :return: A list of (name, score) tuples in file order, or None if the artifact is missing.
+        """
+        try:
+            with self.reader.open_artifact(filename, 'r') as file:
+                ranking = []
+                for line in file:
+                    values = line.rstrip('\n').split('\t')
+                    if len(values) > name_column:
+                        ranking.append((values[name_column], float(values[-1])))
+                return ranking
+        except (IOError, ValueError):
+            return None
+
+    def close_enough(self, value1, value2):
+        return math.isclose(value1, value2, rel_tol=self.rel_tol, abs_tol=self.abs_tol) or value1 == value2
+
+    def compare_rankings(self, reference, fast, top=None):
+        """
+        Compare two rankings according to the tolerances and the tie-breaking rule.
+
+        :param reference: The ranking of the reference implementation.
+        :param fast: The ranking of the fast path.
+        :param top: Number of entries compared, None for all of them.
+        :return: None if the rankings match, otherwise a description of the first difference.
+        """
+        if reference is None and fast is None:
+            return None
+        if reference is None or fast is None:
+            return "missing output"
+        truncated = top is not None and len(reference) > top
+        if top is not None:
+            reference = reference[:top]
+            fast = fast[:top]
+        if len(reference) != len(fast):
+            return f"{len(reference)} entries instead of {len(fast)}"
+
+        for pos, ((name1, score1), (name2, score2)) in enumerate(zip(reference, fast)):
+            if not self.close_enough(score1, score2):
+                return f"score {score2} instead of {score1} at position {pos}"
+            if self.ties == "strict" and name1 != name2:
+                return f"{name2} instead of {name1} at position {pos}"
+
+        if self.ties == "equal-scores":
+            start = 0
+            while start < len(reference):
+                end = start + 1
+                while end < len(reference) and self.close_enough(reference[start][1], reference[end][1]):
+                    end += 1
+                # The last group of a truncated ranking may be cut differently by both runs
+                if end < len(reference) or not truncated:
+                    names1 = sorted(name for name, _ in reference[start:end])
+                    names2 = sorted(name for name, _ in fast[start:end])
+                    if names1 != names2:
+                        return f"different entries among the ties at positions {start}-{end - 1}"
+                start = end
+        return None
+
+    def run(self, options):
+        """
+        Evaluate the fold with the reference implementation and with the fast path, and compare them.
+
+        :param options: A dictionary of fast path options.
+        :return: A report dictionary with the timings, the speedup, the numbers of compared and
+                 mismatching outputs of every kind, and examples of differences.
+        """
+        state = self.save_state()
+        try:
+            ref_time, ref_similarities, ref_recommendations, ref_metrics = self.evaluate({})
+            fast_time, fast_similarities, fast_recommendations, fast_metrics = self.evaluate(options)
+        finally:
+            self.restore_state(state)
+
+        # Streaming similarities are truncated to the neighbors read by the recommendation engine,
+        # and recommendations to the cutoff
+        similarity_top = self.top
+        if options.get("memory_limit"):
+            similarity_top = min(self.top or self.num_of_neighbors, self.num_of_neighbors)
+        recommendation_top = self.top
+        if options.get("cutoff"):
+            recommendation_top = min(self.top or int(options["cutoff"]), int(options["cutoff"]))
+
+        report = {
+            "reference_seconds": ref_time,
+            "fast_seconds": fast_time,
+            "speedup": ref_time / fast_time if fast_time > 0 else float("inf"),
+            "differences": [],
+        }
+        for kind, reference, fast, top in (("similarities", ref_similarities, fast_similarities, similarity_top),
+                                           ("recommendations", ref_recommendations, fast_recommendations,
+                                            recommendation_top)):
+            mismatches = 0
+            for project in reference:
+                difference = self.compare_rankings(reference[project], fast.get(project), top)
+                if difference:
+                    mismatches += 1
+                    report["differences"].append(f"{kind} of {project}: {difference}")
+            report[kind] = (len(reference), mismatches)
+
+        mismatches = 0
+        for n in self.ns:
+            if not all(self.close_enough(value1, value2) for value1, value2 in zip(ref_metrics[n], fast_metrics[n])):
+                mismatches += 1
+                report["differences"].append(f"metrics at N={n}: {fast_metrics[n]} instead of {ref_metrics[n]}")
+        report["metrics"] = (len(self.ns), mismatches)
+        report["equivalent"] = not report["differences"]
+
+        self.log.info("Fold %d, k = %d, fast path %s", self.fold, self.num_of_neighbors, options)
+        for kind in ("similarities", "recommendations", "metrics"):
+            self.log.info("\t%s: %d of %d differ", kind, report[kind][1], report[kind][0])
+        for difference in report["differences"][:10]:
+            self.log.info("\t%s", difference)
+        self.log.info("\treference %.2f s, fast path %.2f s, speedup %.2fx: %s", ref_time, fast_time,
+                      report["speedup"], "EQUIVALENT" if report["equivalent"] else "DIFFERENT")
+        return report
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Compare a fast path of MemoRec with the reference implementation.")
+    parser.add_argument("properties", help="Properties file of the evaluation")
+    parser.add_argument("--fast", action="append", default=[], metavar="OPTION=VALUE",
+                        help=f"Fast path option, one of {', '.join(EquivalenceHarness.OPTIONS)}")
+    parser.add_argument("--fold", type=int, default=0, help="Fold to evaluate, from 0 to 9")
+    parser.add_argument("--neighbors", type=int, default=20, help="Number of neighbors")
+    parser.add_argument("--rel-tol", type=float, default=0.0, help="Relative tolerance of scores and metrics")
+    parser.add_argument("--abs-tol", type=float, default=0.0, help="Absolute tolerance of scores and metrics")
+    parser.add_argument("--ties", choices=["strict", "equal-scores"], default="strict", help="Tie-breaking rule")
+    parser.add_argument("--top", type=int, help="Compare only the top entries of every ranking")
+    options = parser.parse_args(args)
+
+    runner = Runner()
+    if not runner.load_configurations(options.properties):
+        return 2
+    harness = EquivalenceHarness(runner, options.fold, options.neighbors, options.rel_tol, options.abs_tol,
+                                 options.ties, options.top)
+    report = harness.run(dict(option.split("=", 1) for option in options.fast))
+    return 0 if report["equivalent"] else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -1,21 +1,175 @@
+import sys
 import math
+import zlib
+import hashlib
+import heapq
 from collections import defaultdict
-from logging import getLogger, Formatter, FileHandler
+from logging import getLogger
 
-from similarityCalculator import *
+from similarityCalculator import SimilarityCalculator
 
 class GraphBasedSimilarityCalculator(SimilarityCalculator):
+    """
+    TF-IDF and cosine based similarity calculator.
+
+    :param memory_limit: If set, similarities are computed in streaming mode, holding at most
+                         this many bytes of training projects in memory at a time.
+    :param top_k: Number of most similar projects written for every testing project in
+                  streaming mode, None for all of them.
+    :param num_of_features: If set, invocations are hashed into this many features with signed
+                            hashing instead of being kept as a vocabulary of strings, so that
+                            the size of the vectors and document frequencies stays bounded.
+    """
     
     log = getLogger("GraphBasedSimilarityCalculator")
-    handler = FileHandler('similarity_calculator.log')
-    handler.setFormatter(Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-    log.addHandler(handler)
-    log.setLevel("DEBUG")
+
+    # Key of the hash deciding the sign of a hashed invocation. It must be independent of the
+    # bucket hash: because CRC32 is linear, a reseeded CRC32 would tie the sign to the bucket.
+    SIGN_KEY = b"memorec-sign"
     
     def __init__(self, src_dir, sub_folder=None, conf=None, training_start_pos1=None, training_end_pos1=None,
-                 training_start_pos2=None, training_end_pos2=None, testing_start_pos=None, testing_end_pos=None):
+                 training_start_pos2=None, training_end_pos2=None, testing_start_pos=None, testing_end_pos=None,
+                 memory_limit=None, top_k=None, num_of_features=None):
         super().__init__(src_dir, sub_folder, conf, training_start_pos1, training_end_pos1, training_start_pos2,
                          training_end_pos2, testing_start_pos, testing_end_pos)
+        self.memory_limit = memory_limit
+        self.top_k = top_k
+        self.num_of_features = num_of_features
+        # Document frequencies of the training corpus, computed by the first streaming pass
+        self.training_frequency = None
+
+    def set_training_weights(self, training_weights):
+        super().set_training_weights(training_weights)
+        self.training_frequency = None
+
+    def compute_project_similarity(self):
+        """
+        Compute the similarity between all testing projects and training projects,
+        streaming the training corpus from disk if a memory limit is set.
+        """
+        if self.memory_limit is None:
+            super().compute_project_similarity()
+        else:
+            self.compute_project_similarity_streaming()
+
+    def compute_project_similarity_streaming(self):
+        """
+        Compute the similarity between all testing projects and training projects without
+        loading the whole training corpus in memory.
+
+        A first pass over the training projects computes their document frequencies, once for
+        all the calls on the same training corpus. The training corpus is then read again in
+        blocks of at most `memory_limit` bytes, and every block is scored against all testing
+        projects, keeping a running top-K heap per testing project. The similarity files are identical to the in-memory ones (truncated
+        to `top_k` entries if set).
+        """
+        training_projects_id = self.read_training_project_ids()
+        testing_projects_id = self.read_testing_project_ids()
+        num_of_testing_invocations, remove_half = self.get_testing_settings()
+
+        testing_projects = {}
+        for testing_id in testing_projects_id.values():
+            testing_projects.update(self.prepare_terms(self.reader.get_testing_project_invocations(
+                self.src_dir, self.sub_folder, testing_id, num_of_testing_invocations, remove_half
+            )))
+
+        # First pass: document frequencies of the training corpus
+        if self.training_frequency is None:
+            self.training_frequency = defaultdict(int)
+            for training_id in training_projects_id.values():
+                for term in self.prepare_terms(self.reader.get_project_invocations(self.src_dir, training_id))[training_id]:
+                    self.training_frequency[term] += self.get_weight(training_id)
+        training_frequency = self.training_frequency
+
+        total = sum(self.get_weight(training_id) for training_id in training_projects_id.values()) + 1
+        testing_vectors = {}
+        for testing_pro, terms in testing_projects.items():
+            testing_vectors[testing_pro] = self.compute_tf_idf_vector(
+                terms, total, lambda term: training_frequency.get(term, 0) + 1)
+
+        # Second pass: score the training corpus block by block
+        heaps = {testing_pro: [] for testing_pro in testing_projects}
+        block = []
+        block_size = 0
+        for order, training_id in enumerate(training_projects_id.values()):
+            terms = self.prepare_terms(self.reader.get_project_invocations(self.src_dir, training_id))[training_id]
+            size = self.estimate_size(terms)
+            if block and block_size + size > self.memory_limit:
+                self.score_block(block, testing_projects, testing_vectors, training_frequency, total, heaps)
+                block = []
+                block_size = 0
+            block.append((order, training_id, terms))
+            block_size += size
+
+        if block:
+            self.score_block(block, testing_projects, testing_vectors, training_frequency, total, heaps)
+
+        for testing_pro, heap in heaps.items():
+            ranked = sorted(heap, reverse=True)
+            sorted_similarities = {training_project: similarity for similarity, _, training_project in ranked}
+            self.reader.write_similarity_scores(self.get_sim_dir(), testing_pro, sorted_similarities)
+
+    def score_block(self, block, testing_projects, testing_vectors, training_frequency, total, heaps):
+        """
+        Score a block of training projects against every testing project and push the
+        results into the running top-K heaps. Ties are broken by position in List.txt, as
+        the stable sort of the in-memory path does.
+
+        :param block: A list of (order, project, terms) tuples.
+        :param testing_projects: The term frequencies of the testing projects.
+        :param testing_vectors: The TF-IDF vectors of the testing projects.
+        :param training_frequency: The document frequencies of the training corpus.
+        :param total: The number of projects the IDF is computed over.
+        :param heaps: The running heaps, keyed by testing project.
+        """
+        for testing_pro, testing_terms in testing_projects.items():
+            frequency = lambda term: training_frequency.get(term, 0) + (1 if term in testing_terms else 0)
+            heap = heaps[testing_pro]
+            for order, training_project, training_terms in block:
+                training_project_vector = self.compute_tf_idf_vector(training_terms, total, frequency)
+                similarity = self.compute_cosine_similarity(testing_vectors[testing_pro], training_project_vector)
+                item = (similarity, -order, training_project)
+                if self.top_k is None or len(heap) < self.top_k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+    @staticmethod
+    def estimate_size(terms):
+        """
+        Estimate the memory held by the term frequencies of a project.
+
+        :param terms: A dictionary of terms and their counts.
+        :return: The estimated size in bytes.
+        """
+        return sys.getsizeof(terms) + sum(sys.getsizeof(term) + sys.getsizeof(count) for term, count in terms.items())
+
+    def prepare_terms(self, projects):
+        """
+        Hash the invocations of projects into features if feature hashing is enabled.
+
+        :param projects: A dictionary mapping projects to their term frequencies.
+        :return: A dictionary mapping projects to their term or feature frequencies.
+        """
+        if self.num_of_features is None:
+            return projects
+        return {project: self.hash_terms(terms) for project, terms in projects.items()}
+
+    def hash_terms(self, terms):
+        """
+        Hash the term frequencies of a project into a fixed-width feature space. Every term is
+        added to its feature with a sign given by a second hash, so that colliding terms
+        cancel out on average instead of inflating the similarity.
+
+        :param terms: A dictionary of terms and their counts.
+        :return: A dictionary mapping feature indices to their signed counts.
+        """
+        features = defaultdict(int)
+        for term, count in terms.items():
+            encoded = term.encode("utf-8")
+            sign = -1 if hashlib.blake2b(encoded, digest_size=8, key=self.SIGN_KEY).digest()[0] & 1 else 1
+            features[zlib.crc32(encoded) % self.num_of_features] += sign * count
+        return dict(features)
 
     def compute_similarity(self, testing_pro, projects):
         """
@@ -25,28 +179,85 @@ class GraphBasedSimilarityCalculator(SimilarityCalculator):
         :param testing_pro: The project that needs to be tested against all other projects.
         :param projects: A dictionary of all projects with their respective term frequencies.
         """
-        term_frequency = self.compute_term_frequency(projects)
-        testing_project_vector = {}
+        sorted_similarities = self.rank_projects(testing_pro, projects)
+        self.reader.write_similarity_scores(self.get_sim_dir(), testing_pro, sorted_similarities)
+
+    def rank_projects(self, testing_pro, projects):
+        """
+        Rank all other projects by decreasing similarity to the testing project.
+
+        :param testing_pro: The project that needs to be tested against all other projects.
+        :param projects: A dictionary of all projects with their respective term frequencies.
+        :return: A dictionary mapping projects to their similarity, by decreasing similarity.
+        """
+        term_frequency = self.compute_term_frequency(projects, testing_pro)
         project_similarities = {}
+        total = sum(self.get_weight(project) for project in projects if project != testing_pro) + 1
         
         terms = projects[testing_pro]
-        for term in terms.keys():
-            tf_idf = self.compute_tf_idf(terms[term], len(projects), term_frequency[term])
-            testing_project_vector[term] = tf_idf
+        testing_project_vector = self.compute_tf_idf_vector(terms, total, lambda term: term_frequency[term])
         
         for training_project, training_terms in projects.items():
             if training_project != testing_pro:
-                training_project_vector = {}
-                
-                for term in training_terms.keys():
-                    tf_idf = self.compute_tf_idf(training_terms[term], len(projects), term_frequency.get(term, 0))
-                    training_project_vector[term] = tf_idf
+                training_project_vector = self.compute_tf_idf_vector(training_terms, total,
+                                                                     lambda term: term_frequency.get(term, 0))
                 
                 similarity = self.compute_cosine_similarity(testing_project_vector, training_project_vector)
                 project_similarities[training_project] = similarity
 
-        sorted_similarities = dict(sorted(project_similarities.items(), key=lambda item: item[1], reverse=True))
-        self.reader.write_similarity_scores(self.get_sim_dir(), testing_pro, sorted_similarities)
+        return dict(sorted(project_similarities.items(), key=lambda item: item[1], reverse=True))
+
+    def compare_with_exact_vocabulary(self, num_of_neighbors=20):
+        """
+        Measure how far the neighbor rankings computed with feature hashing drift from the ones
+        computed with the exact vocabulary, over the testing projects of the fold. The testing
+        splits are written as by `compute_project_similarity`.
+
+        :param num_of_neighbors: The number of top neighbors compared for every testing project.
+        :return: A dictionary with the number of testing projects, the mean fraction of the exact
+                 top neighbors also found by hashing (overlap), the mean absolute difference of
+                 their positions in the two rankings (displacement) and the fraction of testing
+                 projects whose top neighbors are identical and in the same order.
+        """
+        training_projects = {}
+        for training_id in self.read_training_project_ids().values():
+            training_projects.update(self.reader.get_project_invocations(self.src_dir, training_id))
+        hashed_projects = {project: self.hash_terms(terms) for project, terms in training_projects.items()}
+        num_of_testing_invocations, remove_half = self.get_testing_settings()
+
+        overlap = 0.0
+        displacement = 0.0
+        identical = 0
+        testing_projects_id = self.read_testing_project_ids()
+        for testing_id in testing_projects_id.values():
+            testing_project = self.reader.get_testing_project_invocations(
+                self.src_dir, self.sub_folder, testing_id, num_of_testing_invocations, remove_half)
+
+            training_projects.update(testing_project)
+            exact = list(self.rank_projects(testing_id, training_projects))
+            training_projects.pop(testing_id)
+
+            hashed_projects[testing_id] = self.hash_terms(testing_project[testing_id])
+            hashed = list(self.rank_projects(testing_id, hashed_projects))
+            hashed_projects.pop(testing_id)
+
+            positions = {project: pos for pos, project in enumerate(hashed)}
+            top = exact[:num_of_neighbors]
+            overlap += len(set(top) & set(hashed[:num_of_neighbors])) / max(len(top), 1)
+            displacement += sum(abs(positions[project] - pos) for pos, project in enumerate(top)) / max(len(top), 1)
+            identical += top == hashed[:num_of_neighbors]
+
+        num_of_testing_projects = max(len(testing_projects_id), 1)
+        drift = {
+            "projects": len(testing_projects_id),
+            "overlap": overlap / num_of_testing_projects,
+            "displacement": displacement / num_of_testing_projects,
+            "identical": identical / num_of_testing_projects,
+        }
+        self.log.info("Feature hashing with %d features: top-%d overlap %.3f, mean displacement %.2f, "
+                      "identical rankings %.3f over %d testing projects", self.num_of_features, num_of_neighbors,
+                      drift["overlap"], drift["displacement"], drift["identical"], drift["projects"])
+        return drift
 
     def compute_jaccard_similarity(self, vector1, vector2):
         """
@@ -70,8 +281,8 @@ class GraphBasedSimilarityCalculator(SimilarityCalculator):
         :param v2: A dictionary representing the second vector.
         :return: The cosine similarity score between the two vectors.
         """
-        both_keys = set(v1.keys()).intersection(v2.keys())
-        scalar = sum(v1[k] * v2[k] for k in both_keys)
+        # Summed in the order of the first vector, so that the result does not depend on the hash seed
+        scalar = sum(v1[k] * v2[k] for k in v1 if k in v2)
         norm1 = math.sqrt(sum(f * f for f in v1.values()))
         norm2 = math.sqrt(sum(f * f for f in v2.values()))
         
@@ -79,21 +290,38 @@ class GraphBasedSimilarityCalculator(SimilarityCalculator):
             return 0.0
         return scalar / (norm1 * norm2)
 
-    def compute_term_frequency(self, projects):
+    def compute_term_frequency(self, projects, testing_pro=None):
         """
         Compute the term-frequency map which stores, for every invocation,
-        how many projects in the supplied list invoke it.
+        how many projects in the supplied list invoke it. Training projects count as many
+        times as their weight.
 
         :param projects: A dictionary where keys are project names and values are dictionaries of terms and their counts.
+        :param testing_pro: The testing project, which always counts once.
         :return: A dictionary where keys are terms and values are the number of projects invoking the term.
         """
         term_frequency = defaultdict(int)
-        for terms in projects.values():
+        for project, terms in projects.items():
+            weight = 1 if project == testing_pro else self.get_weight(project)
             for term in terms.keys():
-                term_frequency[term] += 1
+                term_frequency[term] += weight
 
         return dict(term_frequency)
 
+    def compute_tf_idf_vector(self, terms, total, frequency):
+        """
+        Compute the TF-IDF vector of a project.
+
+        :param terms: A dictionary of the project's terms and their counts.
+        :param total: The total number of projects.
+        :param frequency: A function returning the number of projects that include a term.
+        :return: A dictionary mapping every term to its TF-IDF value.
+        """
+        vector = {}
+        for term in terms.keys():
+            vector[term] = self.compute_tf_idf(terms[term], total, frequency(term))
+        return vector
+
     def compute_tf_idf(self, count, total, freq):
         """
         Standard Term-Frequency Inverse Document Frequency (TF-IDF) calculation.
@@ -0,0 +1,353 @@
+import os
+import sys
+import math
+import pickle
+import logging
+import argparse
+from collections import defaultdict, OrderedDict
+
+from graphSimilarity import GraphBasedSimilarityCalculator
+
+class IncrementalSimilarityIndex(GraphBasedSimilarityCalculator):
+    """
+    Keeps the TF-IDF neighbor lists of a growing corpus up to date without recomputing
+    every similarity file when projects are added to or removed from List.txt.
+
+    A neighbor list is refreshed completely only when the IDF weights of its project's
+    terms drifted more than `idf_tolerance` since its last refresh, or when one of its
+    neighbors was removed. Otherwise added projects are merged into the list only if
+    they enter its top-K.
+
+    The TF-IDF vectors are kept between updates, and only the vectors of the projects sharing
+    a term whose document frequency changed are rebuilt, found through an inverted index of
+    the terms. The other vectors and IDF weights only move with the number of projects, by
+    the same amount for every term, so their drift is tracked without looking at their terms;
+    all the vectors are rebuilt when the number of projects alone moved the IDF weights more
+    than `idf_tolerance`.
+
+    :param src_dir: Source directory where the project data is located.
+    :param sub_folder: Sub-folder under the source directory for storing the neighbor lists.
+    :param num_of_neighbors: Number of neighbors (K) kept for every project.
+    :param idf_tolerance: Maximum absolute IDF change tolerated before a list is refreshed.
+    """
+
+    log = logging.getLogger("IncrementalSimilarityIndex")
+
+    def __init__(self, src_dir, sub_folder=None, num_of_neighbors=20, idf_tolerance=0.05):
+        super().__init__(src_dir, sub_folder)
+        self.num_of_neighbors = num_of_neighbors
+        self.idf_tolerance = idf_tolerance
+        self.projects = OrderedDict()
+        self.document_frequency = defaultdict(int)
+        self.neighbors = {}
+        self.refresh_idf = {}
+        # Bounds of the signed IDF changes of the terms of every project since its last refresh
+        self.idf_deviation = {}
+        self.vectors = {}
+        # Number of projects the vectors were all last rebuilt with
+        self.vector_total = 0
+        self.term_projects = defaultdict(set)
+
+    def compute_idf(self, term):
+        """
+        Compute the current inverse document frequency of a term.
+
+        :param term: The invocation whose IDF is needed.
+        :return: The IDF of the term, 0.0 if no project contains it.
+        """
+        freq = self.document_frequency.get(term, 0)
+        if freq == 0:
+            return 0.0
+        return math.log(len(self.projects) / freq)
+
+    def build_vector(self, project):
+        """
+        Build the TF-IDF vector of a project using the current document frequencies.
+
+        :param project: The project name.
+        :return: A dictionary mapping every term of the project to its TF-IDF weight.
+        """
+        terms = self.projects[project]
+        return {term: self.compute_tf_idf(count, len(self.projects), self.document_frequency[term])
+                for term, count in terms.items()}
+
+    def compute_neighbors(self, project, vectors):
+        """
+        Compute the complete top-K neighbor list of a project and record the IDF
+        weights it was computed with.
+
+        :param project: The project whose neighbors are computed.
+        :param vectors: The current TF-IDF vectors of all projects.
+        :return: A list of (project, similarity) pairs sorted by decreasing similarity.
+        """
+        vector = vectors[project]
+        similarities = {}
+        for other in self.projects:
+            if other != project:
+                similarities[other] = self.compute_cosine_similarity(vector, vectors[other])
+
+        self.refresh_idf[project] = {term: self.compute_idf(term) for term in self.projects[project]}
+        self.idf_deviation[project] = (0.0, 0.0)
+        ranked = sorted(similarities.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:self.num_of_neighbors]
+
+    def compute_idf_deviation(self, project):
+        """
+        Compute how far the IDF weights of a project's terms moved since its neighbor
+        list was last refreshed.
+
+        :param project: The project name.
+        :return: A tuple with the lowest and the highest signed IDF change over the project's terms.
+        """
+        snapshot = self.refresh_idf.get(project, {})
+        changes = [self.compute_idf(term) - snapshot.get(term, 0.0) for term in self.projects[project]]
+        return (min(changes), max(changes)) if changes else (0.0, 0.0)
+
+    def compute_idf_drift(self, project):
+        """
+        Get how far the IDF weights of a project's terms moved since its neighbor list was last
+        refreshed, as tracked by `update`.
+
+        :param project: The project name.
+        :return: The maximum absolute IDF change over the project's terms.
+        """
+        low, high = self.idf_deviation.get(project, (0.0, 0.0))
+        return max(abs(low), abs(high))
+
+    def build(self, start_pos=1, end_pos=-1):
+        """
+        Load the projects of List.txt and compute every neighbor list from scratch.
+
+        :param start_pos: The first position of List.txt to index.
+        :param end_pos: The last position of List.txt to index, -1 for the end of the file.
+        :return: The number of neighbor lists written.
+        """
+        projects = self.reader.read_project_list(os.path.join(self.src_dir, "List.txt"), start_pos, end_pos)
+        self.projects.clear()
+        self.document_frequency.clear()
+        self.neighbors.clear()
+        self.refresh_idf.clear()
+        self.idf_deviation.clear()
+        self.vectors.clear()
+        self.vector_total = 0
+        self.term_projects.clear()
+        return self.update(added=projects.values())
+
+    def sync(self):
+        """
+        Bring the index in line with List.txt, adding the projects that appeared in the
+        list and removing the ones that disappeared from it.
+
+        :return: The number of neighbor lists that changed.
+        """
+        listed = self.reader.read_project_list(os.path.join(self.src_dir, "List.txt"), 1, -1).values()
+        listed_set = set(listed)
+        added = [project for project in listed if project not in self.projects]
+        removed = [project for project in self.projects if project not in listed_set]
+        return self.update(added=added, removed=removed)
+
+    def add_project(self, project):
+        """
+        Add a single project to the corpus.
+
+        :param project: The project file name, relative to the source directory.
+        :return: The number of neighbor lists that changed.
+        """
+        return self.update(added=[project])
+
+    def remove_project(self, project):
+        """
+        Remove a single project from the corpus.
+
+        :param project: The project file name, relative to the source directory.
+        :return: The number of neighbor lists that changed.
+        """
+        return self.update(removed=[project])
+
+    def update(self, added=(), removed=()):
+        """
+        Add and remove projects, update the document frequencies and refresh only the
+        neighbor lists affected by the change.
+
+        :param added: Names of the projects to add.
+        :param removed: Names of the projects to remove.
+        :return: The number of neighbor lists that changed, including the new ones.
+        """
+        removed = set(project for project in removed if project in self.projects)
+        added = [project for project in added if project not in self.projects]
+        previous_total = len(self.projects)
+        changed_terms = set()
+
+        for project in removed:
+            for term in self.projects.pop(project):
+                self.document_frequency[term] -= 1
+                if self.document_frequency[term] == 0:
+                    del self.document_frequency[term]
+                self.term_projects[term].discard(project)
+                if not self.term_projects[term]:
+                    del self.term_projects[term]
+                changed_terms.add(term)
+            self.neighbors.pop(project, None)
+            self.refresh_idf.pop(project, None)
+            self.idf_deviation.pop(project, None)
+            self.vectors.pop(project, None)
+            if self.sim_dir and os.path.exists(os.path.join(self.sim_dir, project)):
+                os.remove(os.path.join(self.sim_dir, project))
+
+        for project in added:
+            terms = self.reader.get_project_invocations(self.src_dir, project)[project]
+            self.projects[project] = terms
+            for term in terms:
+                self.document_frequency[term] += 1
+                self.term_projects[term].add(project)
+                changed_terms.add(term)
+
+        # Projects sharing a term whose document frequency changed
+        affected = set()
+        for term in changed_terms:
+            affected.update(self.term_projects.get(term, ()))
+
+        # The IDF of every term moved by the same amount with the number of projects
+        total = len(self.projects)
+        shift = math.log(total / previous_total) if previous_total and total else 0.0
+        vectors = self.vectors
+        if not self.vector_total or abs(math.log(total / self.vector_total)) > self.idf_tolerance:
+            for project in self.projects:
+                vectors[project] = self.build_vector(project)
+            self.vector_total = total
+        else:
+            for project in affected:
+                vectors[project] = self.build_vector(project)
+
+        changed = set()
+        num_of_refreshed = 0
+
+        for project in self.projects:
+            if project in added:
+                continue
+
+            if project in affected:
+                self.idf_deviation[project] = self.compute_idf_deviation(project)
+            elif shift:
+                low, high = self.idf_deviation.get(project, (0.0, 0.0))
+                self.idf_deviation[project] = (low + shift, high + shift)
+
+            current = self.neighbors.get(project, [])
+            if (self.compute_idf_drift(project) > self.idf_tolerance
+                    or any(other in removed for other, _ in current)):
+                updated = self.compute_neighbors(project, vectors)
+                num_of_refreshed += 1
+            else:
+                updated = list(current)
+                for other in added:
+                    similarity = self.compute_cosine_similarity(vectors[project], vectors[other])
+                    if len(updated) < self.num_of_neighbors or similarity > updated[-1][1]:
+                        updated.append((other, similarity))
+                        updated.sort(key=lambda item: item[1], reverse=True)
+                        del updated[self.num_of_neighbors:]
+
+            if updated != current:
+                self.neighbors[project] = updated
+                changed.add(project)
+
+        for project in added:
+            self.neighbors[project] = self.compute_neighbors(project, vectors)
+            changed.add(project)
+
+        if self.sim_dir:
+            for project in changed:
+                self.reader.write_similarity_scores(self.sim_dir, project, dict(self.neighbors[project]))
+
+        self.log.info("Added %d and removed %d projects: %d neighbor lists changed (%d refreshed for IDF drift "
+                      "or removed neighbors) out of %d", len(added), len(removed), len(changed),
+                      num_of_refreshed, len(self.projects))
+        return len(changed)
+
+    def get_neighbors(self, project):
+        """
+        Get the current neighbor list of a project.
+
+        :param project: The project name.
+        :return: A dictionary mapping neighbor projects to their similarity, sorted by decreasing similarity.
+        """
+        return dict(self.neighbors.get(project, []))
+
+    def save(self, filename):
+        """
+        Serialize the index so that later updates do not need to rebuild it.
+
+        :param filename: Path of the file to write.
+        """
+        state = {
+            "num_of_neighbors": self.num_of_neighbors,
+            "idf_tolerance": self.idf_tolerance,
+            "projects": self.projects,
+            "document_frequency": dict(self.document_frequency),
+            "neighbors": self.neighbors,
+            "refresh_idf": self.refresh_idf,
+            "idf_deviation": self.idf_deviation,
+            "vectors": self.vectors,
+            "vector_total": self.vector_total,
+        }
+        try:
+            with open(filename, 'wb') as writer:
+                pickle.dump(state, writer, protocol=pickle.HIGHEST_PROTOCOL)
+        except IOError as e:
+            self.log.error(f"Couldn't write file {filename}: {e}", exc_info=True)
+
+    @classmethod
+    def load(cls, filename, src_dir, sub_folder=None):
+        """
+        Restore an index previously written with `save`.
+
+        :param filename: Path of the serialized index.
+        :param src_dir: Source directory where the project data is located.
+        :param sub_folder: Sub-folder under the source directory for storing the neighbor lists.
+        :return: The restored index.
+        """
+        with open(filename, 'rb') as reader:
+            state = pickle.load(reader)
+
+        index = cls(src_dir, sub_folder, state["num_of_neighbors"], state["idf_tolerance"])
+        index.projects = state["projects"]
+        index.document_frequency = defaultdict(int, state["document_frequency"])
+        index.neighbors = state["neighbors"]
+        index.refresh_idf = state["refresh_idf"]
+        index.idf_deviation = state.get("idf_deviation") or {project: index.compute_idf_deviation(project)
+                                                             for project in index.projects}
+        index.vectors = state.get("vectors", {})
+        index.vector_total = state.get("vector_total", 0)
+        for project, terms in index.projects.items():
+            for term in terms:
+                index.term_projects[term].add(project)
+        return index
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Keep the TF-IDF neighbor lists of a growing corpus up to date.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Index the projects of List.txt and write all their neighbor lists")
+    build.add_argument("--neighbors", type=int, default=20, help="Number of neighbors kept for every project")
+    build.add_argument("--tolerance", type=float, default=0.05,
+                       help="IDF drift tolerated before a neighbor list is refreshed")
+    sync = commands.add_parser("sync", help="Add the projects that appeared in List.txt and remove the ones that "
+                                            "disappeared, rewriting only the neighbor lists that changed")
+    for command in (build, sync):
+        command.add_argument("src_dir", help="Source directory of the dataset")
+        command.add_argument("index", help="File of the serialized index")
+        command.add_argument("--sub-folder", default="evaluation/incremental",
+                             help="Sub-folder of the source directory the neighbor lists are written to")
+    options = parser.parse_args(args)
+
+    if options.command == "build":
+        index = IncrementalSimilarityIndex(options.src_dir, options.sub_folder, options.neighbors, options.tolerance)
+        index.build()
+    else:
+        index = IncrementalSimilarityIndex.load(options.index, options.src_dir, options.sub_folder)
+        index.sync()
+    index.save(options.index)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,55 @@
+"""
+Library API of MemoRec.
+
+Every name is imported from its module on first access, so that importing this module does
+no work: nothing is read, computed or logged, and modules with heavy dependencies such as
+numpy are only loaded when used, e.g.
+
+    import memorec
+    runner = memorec.Runner()
+    runner.run(["properties.yaml"])
+"""
+
+import importlib
+
+# Public names, mapped to the modules defining them
+_exports = {
+    "Runner": "runner",
+    "Configuration": "configuration",
+    "Similarity": "similarity",
+    "DataReader": "dataReader",
+    "DatasetSource": "datasetSource",
+    "EquivalenceHarness": "equivalenceHarness",
+    "FileArtifactStore": "artifactStore",
+    "SQLiteArtifactStore": "artifactStore",
+    "Corpus": "corpusIngest",
+    "CorpusIngestor": "corpusIngest",
+    "SharedCorpus": "sharedCorpus",
+    "SimilarityCalculator": "similarityCalculator",
+    "GraphBasedSimilarityCalculator": "graphSimilarity",
+    "IncrementalSimilarityIndex": "incrementalSimilarity",
+    "ModelSnapshot": "modelSnapshot",
+    "NearDuplicateCollapser": "nearDuplicates",
+    "SampledEvaluation": "sampledEvaluation",
+    "StructuralSimilarityStore": "structuralSimilarity",
+    "StructuralSimilarityCalculator": "structuralSimilarity",
+    "SyntacticSimilarityCalculator": "syntacticSimilarity",
+    "ContextAwareRecommendation": "cars",
+    "CooccurrenceRecommendation": "cooccurrenceRecommendation",
+    "SuccessCalculator": "successCalculator",
+    "StageCache": "stageCache",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
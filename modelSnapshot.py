@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import math
+import time
+import struct
+import logging
+import argparse
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from stageCache import StageCache
+from sharedCorpus import SharedCorpus
+from corpusIngest import Corpus, CorpusIngestor
+
+class SnapshotView(Mapping):
+    """
+    Read-only mapping from the projects of a snapshot to one of their structures, decoded on
+    access, standing in for the dictionaries of a corpusIngest.Corpus.
+    """
+
+    def __init__(self, snapshot, decode, present):
+        self.snapshot = snapshot
+        self.decode = decode
+        self.present = present
+
+    def __contains__(self, project):
+        pos = self.snapshot.project_ids.get(project)
+        return pos is not None and bool(self.present[pos])
+
+    def __getitem__(self, project):
+        if project not in self:
+            raise KeyError(project)
+        return self.decode(project)
+
+    def __iter__(self):
+        return (project for project, pos in self.snapshot.project_ids.items() if self.present[pos])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.present))
+
+
+class ModelSnapshot(SharedCorpus):
+    """
+    Versioned, memory-mapped snapshot of the built state of the recommender, so that a
+    serving process starts without reading or weighting the dataset again.
+
+    On top of the arrays of a SharedCorpus (vocabulary, invocation arrays, TF-IDF weights and
+    norms), the snapshot holds the IDF weight of every term, the normalized project vectors and
+    the declarations of every project with their invocation lists (`get_project_details2`) and
+    sets (`get_project_details_from_arff2`). IDF weights are computed over all the projects.
+
+    The file starts with a magic number, the format version and a JSON header holding the
+    layout of the arrays and the digest of the dataset it was exported from; the arrays follow,
+    aligned, and are mapped without being copied. A snapshot can be set as the corpus of
+    DataReader.
+
+    :param buffer: The buffer holding the arrays.
+    :param layout: A dictionary mapping array names to (dtype, offset, length) tuples.
+    :param header: The header of the snapshot file.
+    :param src_dir: Source directory of the dataset the snapshot is used with.
+    """
+
+    log = logging.getLogger("ModelSnapshot")
+
+    MAGIC = b"MEMOSNAP"
+    VERSION = 1
+
+    def __init__(self, buffer, layout, header, src_dir):
+        super().__init__(buffer, layout)
+        self.header = header
+        self.src_dir = os.path.abspath(src_dir)
+        self.terms = None
+        self.invocations = SnapshotView(self, self.get_project_terms, self.arrays["invocations_present"])
+        self.declarations = SnapshotView(self, self.get_declaration_lists, self.arrays["details_present"])
+        self.arff_declarations = SnapshotView(self, self.get_declaration_sets, self.arrays["arff_present"])
+
+    def __len__(self):
+        return len(self.project_ids)
+
+    def covers(self, path):
+        """
+        Check whether a directory is the source directory of the snapshot.
+        """
+        return os.path.abspath(path) == self.src_dir
+
+    @staticmethod
+    def encode_declarations(prefix, projects, structures, vocabulary):
+        """
+        Encode the declarations of every project with their invocations as term ids, adding
+        the invocations missing from the vocabulary to it.
+
+        :param prefix: Prefix of the names of the arrays.
+        :param projects: The projects, in snapshot order.
+        :param structures: A dictionary mapping projects to their declarations and invocations.
+        :param vocabulary: A dictionary mapping terms to their id.
+        :return: A dictionary mapping array names to numpy arrays.
+        """
+        present = np.zeros(len(projects), dtype=np.uint8)
+        offsets = [0]
+        names = []
+        term_offsets = [0]
+        terms = []
+        for pos, project in enumerate(projects):
+            if project in structures:
+                present[pos] = 1
+                for md, mis in structures[project].items():
+                    names.append(md)
+                    for mi in (sorted(mis) if isinstance(mis, (set, frozenset)) else mis):
+                        if mi not in vocabulary:
+                            vocabulary[mi] = len(vocabulary)
+                        terms.append(vocabulary[mi])
+                    term_offsets.append(len(terms))
+            offsets.append(len(names))
+
+        names_blob, name_offsets = SharedCorpus.encode(names)
+        return {
+            f"{prefix}_present": present,
+            f"{prefix}_offsets": np.array(offsets, dtype=np.int64),
+            f"{prefix}_names": names_blob,
+            f"{prefix}_name_offsets": name_offsets,
+            f"{prefix}_term_offsets": np.array(term_offsets, dtype=np.int64),
+            f"{prefix}_terms": np.array(terms, dtype=np.int32),
+        }
+
+    @classmethod
+    def build_arrays(cls, corpus):
+        """
+        Build the arrays of the snapshot from a corpus.
+
+        :param corpus: A corpusIngest.Corpus.
+        :return: A dictionary mapping array names to numpy arrays.
+        """
+        vocabulary, document_frequency = SharedCorpus.build_vocabulary(corpus)
+        arrays = SharedCorpus.build_arrays(corpus, vocabulary, document_frequency)
+        projects = list(corpus.invocations)
+
+        # Terms appearing only in declarations get a zero IDF
+        arrays.update(cls.encode_declarations("details", projects, corpus.declarations, vocabulary))
+        arrays.update(cls.encode_declarations("arff", projects, corpus.arff_declarations, vocabulary))
+        arrays["vocabulary"], arrays["vocabulary_offsets"] = SharedCorpus.encode(vocabulary)
+        idf = np.zeros(len(vocabulary), dtype=np.float64)
+        idf[:len(document_frequency)] = [math.log(len(projects) / freq) for freq in document_frequency]
+        arrays["idf"] = idf
+
+        norms = np.repeat(arrays["norms"], np.diff(arrays["project_offsets"]))
+        arrays["normalized"] = np.divide(arrays["weights"], norms, out=np.zeros_like(arrays["weights"]),
+                                         where=norms != 0)
+        arrays["invocations_present"] = np.ones(len(projects), dtype=np.uint8)
+        return arrays
+
+    @classmethod
+    def export(cls, corpus, filename):
+        """
+        Write the snapshot of a corpus.
+
+        :param corpus: A corpusIngest.Corpus.
+        :param filename: Path of the snapshot file.
+        :return: The header of the snapshot.
+        """
+        arrays = cls.build_arrays(corpus)
+        layout, size = cls.plan_layout(arrays)
+        header = {
+            "version": cls.VERSION,
+            "dataset": StageCache().dataset_digest(corpus.src_dir),
+            "fingerprint": Corpus.dataset_fingerprint(corpus.src_dir),
+            "src_dir": corpus.src_dir,
+            "created": time.time(),
+            "projects": len(corpus.invocations),
+            "terms": len(arrays["idf"]),
+            "layout": layout,
+        }
+        encoded = json.dumps(header).encode()
+        prefix = cls.MAGIC + struct.pack("<II", cls.VERSION, len(encoded)) + encoded
+        start = len(prefix) + (-len(prefix) % cls.ALIGNMENT)
+
+        mapped = np.memmap(filename, dtype=np.uint8, mode='w+', shape=(start + size,))
+        mapped[:len(prefix)] = np.frombuffer(prefix, dtype=np.uint8)
+        cls.fill(mapped[start:], layout, arrays)
+        mapped.flush()
+        del mapped
+        cls.log.info("Snapshot of %d projects and %d terms written to %s (%d bytes)",
+                     header["projects"], header["terms"], filename, start + size)
+        return header
+
+    @classmethod
+    def open(cls, filename, src_dir, verify=True):
+        """
+        Map a snapshot, refusing it if it was exported from another version of the format or
+        from another dataset. The dataset digest is only computed if the fingerprint of the
+        dataset changed since the export.
+
+        :param filename: Path of the snapshot file.
+        :param src_dir: Source directory of the dataset the snapshot is used with.
+        :param verify: Check the dataset digest.
+        :return: The ModelSnapshot.
+        :raise ValueError: If the file is not a snapshot of this version or of this dataset.
+        """
+        mapped = np.memmap(filename, dtype=np.uint8, mode='r')
+        fixed = len(cls.MAGIC) + 8
+        if len(mapped) < fixed or mapped[:len(cls.MAGIC)].tobytes() != cls.MAGIC:
+            raise ValueError(f"{filename} is not a model snapshot")
+        version, length = struct.unpack("<II", mapped[len(cls.MAGIC):fixed].tobytes())
+        if version != cls.VERSION:
+            raise ValueError(f"{filename} has version {version} instead of {cls.VERSION}")
+        header = json.loads(mapped[fixed:fixed + length].tobytes())
+
+        if verify and Corpus.dataset_fingerprint(src_dir) != header["fingerprint"]:
+            digest = StageCache().dataset_digest(src_dir)
+            if digest != header["dataset"]:
+                raise ValueError(f"{filename} was exported from another dataset ({header['dataset']} "
+                                 f"instead of {digest})")
+
+        start = fixed + length + (-(fixed + length) % cls.ALIGNMENT)
+        layout = {name: tuple(value) for name, value in header["layout"].items()}
+        snapshot = cls(mapped[start:], layout, header, src_dir)
+        snapshot.filename = filename
+        return snapshot
+
+    @property
+    def handle(self):
+        """
+        Picklable handle to pass to the worker processes, which map the snapshot file again.
+        """
+        return ("snapshot", self.filename, self.src_dir)
+
+    def get_terms(self):
+        if self.terms is None:
+            self.terms = super().get_terms()
+        return self.terms
+
+    def get_project_terms(self, project):
+        terms = self.get_terms()
+        ids, counts = self.get_invocations(project)
+        return {terms[term_id]: int(count) for term_id, count in zip(ids, counts)}
+
+    def decode_declarations(self, prefix, project):
+        """
+        Decode the declarations of a project.
+
+        :return: A list of (declaration, invocations) tuples, the invocations in stored order.
+        """
+        terms = self.get_terms()
+        pos = self.project_ids[project]
+        start, end = self.arrays[f"{prefix}_offsets"][pos:pos + 2]
+        name_offsets = self.arrays[f"{prefix}_name_offsets"]
+        names = self.arrays[f"{prefix}_names"][name_offsets[start]:name_offsets[end]].tobytes()
+        term_offsets = self.arrays[f"{prefix}_term_offsets"]
+        ids = self.arrays[f"{prefix}_terms"]
+
+        declarations = []
+        for i in range(start, end):
+            md = names[name_offsets[i] - name_offsets[start]:name_offsets[i + 1] - name_offsets[start]].decode("utf-8")
+            declarations.append((md, [terms[term_id] for term_id in ids[term_offsets[i]:term_offsets[i + 1]]]))
+        return declarations
+
+    def get_declaration_lists(self, project):
+        """
+        :return: The declarations of a project with their invocation lists, as DataReader.get_project_details2 does.
+        """
+        return OrderedDict(self.decode_declarations("details", project))
+
+    def get_declaration_sets(self, project):
+        """
+        :return: The declarations of a project with their invocation sets, as
+                 DataReader.get_project_details_from_arff2 does.
+        """
+        return {md: set(mis) for md, mis in self.decode_declarations("arff", project)}
+
+    def get_idf(self, term):
+        term_id = self.get_term_id(term)
+        return float(self.arrays["idf"][term_id]) if term_id is not None else 0.0
+
+    def get_normalized_vector(self, project):
+        """
+        Get the normalized TF-IDF vector of a project as zero-copy views.
+
+        :param project: The project name.
+        :return: A tuple of arrays (term ids, weights).
+        """
+        pos = self.project_ids[project]
+        start, end = self.arrays["project_offsets"][pos], self.arrays["project_offsets"][pos + 1]
+        return self.arrays["term_ids"][start:end], self.arrays["normalized"][start:end]
+
+    def compute_cosine_similarity(self, project1, project2):
+        ids1, weights1 = self.get_normalized_vector(project1)
+        ids2, weights2 = self.get_normalized_vector(project2)
+        _, index1, index2 = np.intersect1d(ids1, ids2, assume_unique=True, return_indices=True)
+        return float(np.dot(weights1[index1], weights2[index2]))
+
+    def get_neighbors(self, project, num_of_neighbors=20):
+        """
+        Rank the other projects of the snapshot by cosine similarity with a project.
+
+        :param project: The project name.
+        :param num_of_neighbors: Number of neighbors returned.
+        :return: A dictionary mapping the neighbors to their similarity, by decreasing similarity.
+        """
+        ids, weights = self.get_normalized_vector(project)
+        query = np.zeros(len(self.arrays["idf"]), dtype=np.float64)
+        query[ids] = weights
+
+        offsets = self.arrays["project_offsets"]
+        products = query[self.arrays["term_ids"]] * self.arrays["normalized"]
+        scores = np.zeros(len(offsets) - 1, dtype=np.float64)
+        non_empty = offsets[1:] > offsets[:-1]
+        if len(products):
+            scores[non_empty] = np.add.reduceat(products, offsets[:-1][non_empty])
+        scores[self.project_ids[project]] = -np.inf
+
+        projects = self.get_projects()
+        order = np.argsort(-scores, kind="stable")[:num_of_neighbors]
+        return {projects[pos]: float(scores[pos]) for pos in order if scores[pos] != -np.inf}
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Export or inspect a memory-mapped MemoRec model snapshot.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Build the snapshot of a dataset")
+    export.add_argument("src_dir", help="Source directory of the dataset")
+    export.add_argument("snapshot", help="Snapshot file to write")
+    export.add_argument("--corpus", help="Corpus file written by corpusIngest.py, instead of parsing the dataset")
+    export.add_argument("--workers", type=int, help="Number of worker processes parsing the dataset")
+    info = commands.add_parser("info", help="Load a snapshot against a dataset and print its header")
+    info.add_argument("snapshot", help="Snapshot file")
+    info.add_argument("src_dir", help="Source directory of the dataset")
+    options = parser.parse_args(args)
+
+    if options.command == "export":
+        corpus = Corpus.load(options.corpus) if options.corpus else \
+            CorpusIngestor(options.src_dir, options.workers).ingest()[0]
+        ModelSnapshot.export(corpus, options.snapshot)
+        return 0
+
+    before = time.time()
+    try:
+        snapshot = ModelSnapshot.open(options.snapshot, options.src_dir)
+    except ValueError as e:
+        print(e)
+        return 1
+    header = {key: value for key, value in snapshot.header.items() if key != "layout"}
+    print(json.dumps(header, indent=2))
+    print(f"Loaded in {time.time() - before:.3f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,121 @@
+import zlib
+import logging
+import numpy as np
+from collections import defaultdict
+from typing import Dict, List
+
+from dataReader import DataReader
+
+class NearDuplicateCollapser:
+    """
+    Detection of duplicate and near-duplicate projects by the signature of their invocation sets.
+
+    Every project is summarized by a MinHash signature of its set of invocations. Signatures
+    are split into bands and projects sharing a band are candidate duplicates (locality
+    sensitive hashing). Groups are clustered around a representative: in the given order,
+    every project joins the group of the first candidate representative whose invocation set
+    has a Jaccard similarity of at least `threshold` with its own, or else becomes the
+    representative of a new group, so that near-duplicates are never chained transitively.
+    Every group is collapsed into its representative, weighted by the size of the group.
+
+    :param src_dir: Source directory of the dataset.
+    :param threshold: Minimum Jaccard similarity of the invocation sets of two duplicates.
+    :param num_of_permutations: Length of the MinHash signatures.
+    :param num_of_bands: Number of bands the signatures are split into.
+    :param seed: Seed of the MinHash permutations.
+    """
+
+    log = logging.getLogger("NearDuplicateCollapser")
+
+    # Smallest prime above 2^32, so that the permutations are bijections of the 32-bit hashes
+    PRIME = 4294967311
+
+    def __init__(self, src_dir, threshold=0.9, num_of_permutations=64, num_of_bands=16, seed=1):
+        if num_of_permutations % num_of_bands != 0:
+            raise ValueError("The number of permutations must be a multiple of the number of bands")
+        self.src_dir = src_dir
+        self.threshold = threshold
+        self.num_of_bands = num_of_bands
+        self.rows_per_band = num_of_permutations // num_of_bands
+        random = np.random.RandomState(seed)
+        self.a = random.randint(1, 1 << 32, size=num_of_permutations, dtype=np.uint64)
+        self.b = random.randint(0, 1 << 32, size=num_of_permutations, dtype=np.uint64)
+        self.reader = DataReader()
+        # Invocation sets and signatures of the projects seen so far, reused across folds
+        self.invocations = {}
+        self.signatures = {}
+
+    def get_invocations(self, project: str) -> frozenset:
+        if project not in self.invocations:
+            self.invocations[project] = frozenset(
+                self.reader.get_project_invocations(self.src_dir, project)[project])
+        return self.invocations[project]
+
+    def get_signature(self, project: str) -> np.ndarray:
+        """
+        Compute the MinHash signature of the invocation set of a project.
+
+        :param project: The project name.
+        :return: An array with the minimum hash of the set under every permutation.
+        """
+        if project not in self.signatures:
+            invocations = self.get_invocations(project)
+            hashes = np.array([zlib.crc32(invocation.encode("utf-8")) for invocation in invocations], dtype=np.uint64)
+            if len(hashes) == 0:
+                signature = np.full(len(self.a), self.PRIME, dtype=np.uint64)
+            else:
+                # a * h overflows 64 bits, so a is split into 16-bit halves:
+                # a * h = ((a >> 16) * h mod p) * 2^16 + (a & 0xFFFF) * h (mod p), all below 2^51
+                high = ((self.a[:, None] >> np.uint64(16)) * hashes[None, :]) % np.uint64(self.PRIME)
+                low = (self.a[:, None] & np.uint64(0xFFFF)) * hashes[None, :]
+                signature = (((high << np.uint64(16)) + low + self.b[:, None]) % np.uint64(self.PRIME)).min(axis=1)
+            self.signatures[project] = signature
+        return self.signatures[project]
+
+    def compute_jaccard_similarity(self, project1: str, project2: str) -> float:
+        invocations1 = self.get_invocations(project1)
+        invocations2 = self.get_invocations(project2)
+        union = len(invocations1 | invocations2)
+        if union == 0:
+            return 1.0
+        return len(invocations1 & invocations2) / union
+
+    def find_groups(self, projects: List[str]) -> Dict[str, List[str]]:
+        """
+        Group the duplicate and near-duplicate projects of a list.
+
+        :param projects: The project names, in order of preference for the representatives.
+        :return: A dictionary mapping every representative to the projects of its group,
+                 itself first, in the order of the list. Every project of a group is a
+                 near-duplicate of its representative.
+        """
+        # Positions of the representatives in every bucket of a band of the signatures
+        representatives = defaultdict(list)
+        groups = {}
+        for pos, project in enumerate(projects):
+            signature = self.get_signature(project)
+            buckets = [(band, signature[band * self.rows_per_band:(band + 1) * self.rows_per_band].tobytes())
+                       for band in range(self.num_of_bands)]
+
+            candidates = sorted(set(i for bucket in buckets for i in representatives[bucket]))
+            for i in candidates:
+                if self.compute_jaccard_similarity(projects[i], project) >= self.threshold:
+                    groups[projects[i]].append(project)
+                    break
+            else:
+                groups[project] = [project]
+                for bucket in buckets:
+                    representatives[bucket].append(pos)
+        return groups
+
+    def collapse(self, projects: List[str]) -> Dict[str, int]:
+        """
+        Collapse the duplicate and near-duplicate projects of a list into weighted representatives.
+
+        :param projects: The project names, in order of preference for the representatives.
+        :return: A dictionary mapping every representative to the number of projects it stands for.
+        """
+        weights = {representative: len(group) for representative, group in self.find_groups(projects).items()}
+        self.log.info("Collapsed %d projects into %d representatives (%.1f%% smaller)", len(projects), len(weights),
+                      100.0 * (len(projects) - len(weights)) / max(len(projects), 1))
+        return weights
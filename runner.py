@@ -1,25 +1,45 @@
 import os
+import json
 import time
 import logging
 import sys
 from collections import defaultdict
 
-from similarity import *
-from graphSimilarity import *
-from similarityCalculator import *
-from cars import *
-from successCalculator import *
+from similarity import Similarity
+from dataReader import DataReader
+from successCalculator import SuccessCalculator
+from stageCache import StageCache
 
-from configuration import *
+from configuration import Configuration
+
+# The similarity calculators, recommendation engines and optional backends, and numpy with
+# them, are imported by the methods using them, so that importing the runner stays cheap
 
 class Runner:
     def __init__(self):
         self.src_dir = None
+        self.structural_dir = None
+        self.similarity_type = Similarity.GRAPH
         self.num_of_projects = 0
         self.ten_fold = False
         self.leave_one_out = False
         self.configuration = None
         self.pam = False
+        self.cache = None
+        self.memory_limit = None
+        self.num_of_features = None
+        self.collapser = None
+        self.collapsed_sizes = []
+        self.prune_candidates = True
+        self.recommendation_cutoff = None
+        self.num_of_workers = 1
+        self.recommendation_engine = "context-aware"
+        # Co-occurrence engine of the current fold, as a (fold key, engine) tuple
+        self.cooccurrence_engine = None
+        # Store of the precomputed structural similarities, shared by the folds of a run
+        self.structural_store = None
+        self.shard_index = None
+        self.shard_count = None
 
     def load_configurations(self, prop_file):
         """
@@ -32,8 +52,21 @@ class Runner:
         
         - Reads the properties file and parses it into a dictionary.
         - Sets the source directory using the 'sourceDirectory' key from the properties file.
+        - Sets the directory of the precomputed structural similarities ('structuralSimilaritiesDirectory').
+        - Sets the similarity type ('similarity'), either 'Graph' (default), 'Structural' or 'Syntactically'.
         - Validates and sets the configuration type based on predefined configurations.
         - Validates and sets the validation mode, either 'ten-fold' or 'leave-one-out'.
+        - Enables the stage cache if the 'cacheDirectory' key is set.
+        - Enables streaming similarity computation if the 'similarityMemoryLimit' key (in MB) is set.
+        - Hashes invocations into the number of features given by 'similarityFeatures', if set.
+        - Collapses near-duplicate training projects above the 'duplicateThreshold' Jaccard similarity, if set.
+        - Selects the recommendation engine, either 'context-aware' (default) or 'co-occurrence'.
+        - Writes only the top 'recommendationCutoff' context-aware recommendations of every testing project, if set.
+        - Stores the evaluation artifacts in the SQLite database given by 'artifactStore', if set.
+        - Reads the dataset files missing from the source directory from the archive given by 'datasetArchive', if set.
+        - Loads the parsed dataset from the corpus file given by 'corpusFile', ingesting it first if missing.
+        - Maps the model snapshot given by 'modelSnapshot', exporting it first if missing, and refuses it if it was
+          exported from another dataset.
         - Counts the number of projects by reading the 'List.txt' file in the source directory.
         
         If the file cannot be read, the method logs an error and returns False."""
@@ -46,6 +79,14 @@ class Runner:
             print(prop)
             # Set source directory
             self.src_dir = prop.get('sourceDirectory')
+            self.structural_dir = prop.get('structuralSimilaritiesDirectory')
+
+            similarity_type = prop.get('similarity')
+            if similarity_type:
+                try:
+                    self.similarity_type = Similarity(similarity_type)
+                except ValueError:
+                    logging.error(f"Invalid similarity {similarity_type}")
 
             conf = prop.get("configuration")
             if conf == "C1.1":
@@ -57,7 +98,7 @@ class Runner:
             elif conf == "C2.2":
                 self.configuration = Configuration.C2_2
             else:
-                log.error(f"Invalid configuration {conf}")
+                logging.error(f"Invalid configuration {conf}")
 
 
             # Set the validation mode
@@ -71,9 +112,86 @@ class Runner:
             else:
                 logging.error(f"Invalid validation mode {mode}")
 
+            # Enable the stage cache if a cache directory is configured
+            cache_dir = prop.get('cacheDirectory')
+            if cache_dir:
+                self.cache = StageCache(cache_dir)
+
+            # Bound the memory used by the similarity computation
+            memory_limit = prop.get('similarityMemoryLimit')
+            if memory_limit:
+                self.memory_limit = int(float(memory_limit) * 1024 * 1024)
+
+            # Hash invocations into a fixed number of features instead of an unbounded vocabulary
+            num_of_features = prop.get('similarityFeatures')
+            if num_of_features:
+                self.num_of_features = int(num_of_features)
+
+            # Collapse near-duplicate training projects into weighted representatives
+            duplicate_threshold = prop.get('duplicateThreshold')
+            if duplicate_threshold:
+                from nearDuplicates import NearDuplicateCollapser
+                self.collapser = NearDuplicateCollapser(self.src_dir, float(duplicate_threshold))
+
+            # Write only the top recommendations of the context-aware engine
+            recommendation_cutoff = prop.get('recommendationCutoff')
+            if recommendation_cutoff:
+                self.recommendation_cutoff = int(recommendation_cutoff)
+
+            # Select the recommendation engine
+            engine = prop.get('recommendationEngine')
+            if engine in ("context-aware", "co-occurrence"):
+                self.recommendation_engine = engine
+            elif engine:
+                logging.error(f"Invalid recommendation engine {engine}")
+
+            # Keep the evaluation artifacts in a single database instead of one file per project
+            artifact_store = prop.get('artifactStore')
+            if artifact_store:
+                from artifactStore import SQLiteArtifactStore
+                DataReader.set_store(SQLiteArtifactStore(artifact_store, self.src_dir))
+                if self.cache:
+                    logging.warning("The stage cache works on the per-file layout, disabling it")
+                    self.cache = None
+
+            # Read the dataset from a single archive
+            dataset_archive = prop.get('datasetArchive')
+            if dataset_archive:
+                from datasetSource import DatasetSource
+                DataReader.set_source(DatasetSource(dataset_archive, self.src_dir))
+
+            # Parse the whole dataset once, in parallel, instead of file by file on demand
+            corpus_file = prop.get('corpusFile')
+            if corpus_file:
+                from corpusIngest import Corpus, CorpusIngestor
+                corpus = None
+                if os.path.exists(corpus_file):
+                    try:
+                        corpus = Corpus.load(corpus_file, self.src_dir)
+                    except ValueError as e:
+                        logging.warning(f"Ingesting the dataset again: {e}")
+                if corpus is None:
+                    corpus, _ = CorpusIngestor(self.src_dir).ingest()
+                    corpus.save(corpus_file)
+                DataReader.set_corpus(corpus)
+
+            # Map the built state of the dataset instead of parsing it
+            model_snapshot = prop.get('modelSnapshot')
+            if model_snapshot:
+                from corpusIngest import CorpusIngestor
+                from modelSnapshot import ModelSnapshot
+                if not os.path.exists(model_snapshot):
+                    corpus = DataReader.corpus or CorpusIngestor(self.src_dir).ingest()[0]
+                    ModelSnapshot.export(corpus, model_snapshot)
+                try:
+                    DataReader.set_corpus(ModelSnapshot.open(model_snapshot, self.src_dir))
+                except ValueError as e:
+                    logging.error(f"Couldn't load model snapshot {model_snapshot}: {e}")
+                    return False
+
             # Count the number of projects by reading the project list
             project_list_path = os.path.join(self.src_dir, 'List.txt')
-            with open(project_list_path, 'r') as reader:
+            with DataReader.source.open(project_list_path) as reader:
                 self.num_of_projects = sum(1 for _ in reader)
 
             return True
@@ -89,7 +207,33 @@ class Runner:
         prop_file = "./properties.yaml"
 
         # Check command-line arguments
-        if len(args) == 1:
+        merge = False
+        drift = False
+        dedup = False
+        sample = False
+        if len(args) >= 3 and args[0].upper() == "SHARD":
+            self.shard_index = int(args[1])
+            self.shard_count = int(args[2])
+            if len(args) == 4:
+                prop_file = args[3]
+        elif len(args) >= 2 and args[0].upper() == "MERGE":
+            merge = True
+            self.shard_count = int(args[1])
+            if len(args) == 3:
+                prop_file = args[2]
+        elif len(args) >= 1 and args[0].upper() == "SAMPLE":
+            sample = True
+            if len(args) == 2:
+                prop_file = args[1]
+        elif len(args) >= 1 and args[0].upper() == "DEDUP":
+            dedup = True
+            if len(args) == 2:
+                prop_file = args[1]
+        elif len(args) >= 1 and args[0].upper() == "DRIFT":
+            drift = True
+            if len(args) == 2:
+                prop_file = args[1]
+        elif len(args) == 1:
             if args[0].upper() == "PAM":
                 self.pam = True
             else:
@@ -99,20 +243,41 @@ class Runner:
         if self.pam:
             self.src_dir = "../../dataset/PAM/SH_S-results/"
             logging.info(f"Computing PAM results from {self.src_dir} (leave-one-out cross-validation)")
-            self.calculate_success_pam()
+            try:
+                self.calculate_success_pam()
+            except FileNotFoundError as e:
+                logging.error(e)
             return
 
         # Load configurations from the properties file
         if self.load_configurations(prop_file):
-            if self.ten_fold:
-                ks = [1, 5, 10, 15, 20]
+            ks = [1, 5, 10, 15, 20]
+            if merge:
+                self.merge_shards(ks)
+                return
+            if drift:
+                self.compare_feature_hashing(max(ks))
+                return
+            if dedup:
+                self.compare_duplicate_collapsing(max(ks))
+                return
+            if sample:
+                from sampledEvaluation import SampledEvaluation
+                evaluation = SampledEvaluation(self)
                 for k in ks:
-                    logging.info(f"Running the evaluation with k = {k}")
-                    before = time.time()
-                    self.ten_fold_cross_validation(k, "Structural")
-                    after = time.time()
-                    logging.info(f"Evaluation with k = {k} took {after - before:.2f} seconds")
-                    # exit()
+                    logging.info(f"Running the sampled evaluation with k = {k}")
+                    evaluation.run(k, self.similarity_type)
+                return
+
+            if self.ten_fold and self.shard_count:
+                before = time.time()
+                logging.info(f"Running shard {self.shard_index} of {self.shard_count}")
+                self.run_shard(ks, self.similarity_type)
+                after = time.time()
+                logging.info(f"Shard {self.shard_index} took {after - before:.2f} seconds")
+            elif self.ten_fold:
+                logging.info(f"Running the evaluation with k = {', '.join(map(str, ks))}")
+                self.ten_fold_cross_validation_by_fold(ks, self.similarity_type)
 
             if self.leave_one_out:
                 before = time.time()
@@ -130,105 +295,521 @@ class Runner:
         :param num_of_neighbors: Number of neighbors to consider for the recommendation engine.
         :param similarity_type: Similarity metric to be used.
         """
+        return self.ten_fold_cross_validation_by_fold([num_of_neighbors], similarity_type)[num_of_neighbors]
+
+    def ten_fold_cross_validation_by_fold(self, ks, similarity_type):
+        """
+        Perform the ten-fold cross-validation for several numbers of neighbors. Folds are
+        evaluated one after the other, each for every number of neighbors, so that the state
+        built for a fold (its co-occurrence engine) is reused for every k and released before
+        the next fold.
+
+        :param ks: The numbers of neighbors to consider for the recommendation engine.
+        :param similarity_type: Similarity metric to be used.
+        :return: A dictionary mapping every k to a dictionary mapping every cutoff to its
+                 (success rate, precision, recall) tuple.
+        """
         logging.info("Starting 10-fold cross-validation...")
         num_of_folds = 10
         step = self.num_of_projects // 10
         # print(step, self.num_of_projects)
         ns = list(range(1, 21))
-        avg_success = defaultdict(float)
-        avg_precision = defaultdict(float)
-        avg_recall = defaultdict(float)
+        avg_success = {k: defaultdict(float) for k in ks}
+        avg_precision = {k: defaultdict(float) for k in ks}
+        avg_recall = {k: defaultdict(float) for k in ks}
+        elapsed = defaultdict(float)
 
         for i in range(num_of_folds):
-            start_time = time.time()
-
-            # print(i, step)
-
-            training_start_pos1 = 1
-            training_end_pos1 = i * step
-            training_start_pos2 = (i + 1) * step + 1
-            training_end_pos2 = self.num_of_projects
-            testing_start_pos = 1 + i * step
-            testing_end_pos = (i + 1) * step
-            # print(training_start_pos1, training_end_pos1, training_start_pos2, training_end_pos2, testing_start_pos, testing_end_pos)
-            k = i + 1
-            sub_folder = f"evaluation/round{k}"
-
-            # print(similarity_type,
-            # self.src_dir, sub_folder, 
-            # self.configuration, training_start_pos1,
-            # training_end_pos1, training_start_pos2,
-            # training_end_pos2, testing_start_pos, testing_end_pos)
-
-            # exit()
-
-            # training_start_pos1 = 1
-            # training_end_pos1 = 1712
-            # training_start_pos2 = 1927
-            # training_end_pos2 = 2148
-            # testing_start_pos = 1713
-            # testing_end_pos = 1926
-
-            # print(similarity_type,
-            # self.src_dir, sub_folder, 
-            # self.configuration, training_start_pos1,
-            # training_end_pos1, training_start_pos2,
-            # training_end_pos2, testing_start_pos, testing_end_pos)
-
-            # Depending on the similarity type, initialize the similarity calculator
-            if similarity_type == Similarity.SYNTACTICALLY:
-                calculator = GraphBasedSimilarityCalculator(self.src_dir, sub_folder,
-                                                            self.configuration, training_start_pos1, training_end_pos1, 
-                                                            training_start_pos2, training_end_pos2,
-                                                            testing_start_pos, testing_end_pos)
+            for k in ks:
+                before = time.time()
+                metrics = self.evaluate_fold(i, step, k, similarity_type, ns)
+                elapsed[k] += time.time() - before
+
+                for n in ns:
+                    success, precision, recall = metrics[str(n)]
+                    avg_success[k][n] += success
+                    avg_precision[k][n] += precision
+                    avg_recall[k][n] += recall
+
+                    # print(success, precision, recall)
+        self.cooccurrence_engine = None
+
+        results = {}
+        for k in ks:
+            results[k] = {n: (avg_success[k][n] / num_of_folds,
+                              avg_precision[k][n] / num_of_folds,
+                              avg_recall[k][n] / num_of_folds) for n in ns}
+            self.log_results("10-FOLDS", results[k], k)
+            logging.info(f"Evaluation with k = {k} took {elapsed[k]:.2f} seconds")
+        return results
+
+    def evaluate_fold(self, i, step, num_of_neighbors, similarity_type, ns):
+        """
+        Compute the similarities, recommendations and metrics of one fold of the ten-fold
+        cross-validation, restoring the stages found in the cache.
+
+        :param i: The index of the fold, from 0 to 9.
+        :param step: The number of testing projects per fold.
+        :param num_of_neighbors: Number of neighbors to consider for the recommendation engine.
+        :param similarity_type: Similarity metric to be used.
+        :param ns: The list of cutoffs.
+        :return: A dictionary mapping every cutoff, as a string, to a [success rate, precision, recall] list.
+        """
+        start_time = time.time()
+
+        # print(i, step)
+
+        (training_start_pos1, training_end_pos1, training_start_pos2, training_end_pos2,
+         testing_start_pos, testing_end_pos) = self.get_fold_bounds(i, step)
+        # print(training_start_pos1, training_end_pos1, training_start_pos2, training_end_pos2, testing_start_pos, testing_end_pos)
+        k = i + 1
+        sub_folder = f"evaluation/round{k}"
+
+        # print(similarity_type,
+        # self.src_dir, sub_folder, 
+        # self.configuration, training_start_pos1,
+        # training_end_pos1, training_start_pos2,
+        # training_end_pos2, testing_start_pos, testing_end_pos)
+
+        # exit()
+
+        # training_start_pos1 = 1
+        # training_end_pos1 = 1712
+        # training_start_pos2 = 1927
+        # training_end_pos2 = 2148
+        # testing_start_pos = 1713
+        # testing_end_pos = 1926
+
+        # print(similarity_type,
+        # self.src_dir, sub_folder, 
+        # self.configuration, training_start_pos1,
+        # training_end_pos1, training_start_pos2,
+        # training_end_pos2, testing_start_pos, testing_end_pos)
+
+        # Streaming similarities only keep the neighbors read by the recommendation engine
+        top_k = num_of_neighbors if self.memory_limit else None
+        calculator = self.create_similarity_calculator(similarity_type, sub_folder,
+                                                       training_start_pos1, training_end_pos1,
+                                                       training_start_pos2, training_end_pos2,
+                                                       testing_start_pos, testing_end_pos, top_k)
+
+        fold_dir = os.path.join(self.src_dir, sub_folder)
+        split_dirs = {name: os.path.join(fold_dir, name) for name in ("TestingInvocations", "GroundTruth")}
+        sim_dirs = {"Similarities": os.path.join(fold_dir, "Similarities")}
+        rec_dirs = {"Recommendations": os.path.join(fold_dir, "Recommendations")}
+
+        if self.cache:
+            split_key = self.cache.key("split", dataset=self.cache.dataset_digest(self.src_dir),
+                                       configuration=self.configuration,
+                                       fold=[training_start_pos1, training_end_pos1, training_start_pos2,
+                                             training_end_pos2, testing_start_pos, testing_end_pos])
+            sim_key = self.cache.key("similarities", split=split_key, similarity=Similarity(similarity_type).value,
+                                     features=self.num_of_features, top_k=top_k,
+                                     duplicates=self.collapser.threshold if self.collapser else None,
+                                     structural=calculator.store.fingerprint()
+                                     if Similarity(similarity_type) == Similarity.STRUCTURAL else None)
+            if self.recommendation_engine == "co-occurrence":
+                # The co-occurrence engine ignores the similarities and the number of neighbors
+                rec_key = self.cache.key("recommendations", split=split_key, engine=self.recommendation_engine)
             else:
-                calculator = GraphBasedSimilarityCalculator(self.src_dir, sub_folder,
-                                                            self.configuration, training_start_pos1, training_end_pos1, 
-                                                            training_start_pos2, training_end_pos2,
-                                                            testing_start_pos, testing_end_pos)
+                rec_key = self.cache.key("recommendations", similarities=sim_key, k=num_of_neighbors,
+                                         engine=self.recommendation_engine, cutoff=self.recommendation_cutoff)
+            metrics_key = self.cache.key("metrics", recommendations=rec_key, ns=ns)
+
+        if self.cache and self.cache.restore("split", split_key, split_dirs) \
+                and self.cache.restore("similarities", sim_key, sim_dirs):
+            logging.info("\tFold %d: split and similarities restored from cache", i)
+        else:
             calculator.compute_project_similarity()
+            if self.cache:
+                self.cache.store("split", split_key, split_dirs)
+                self.cache.store("similarities", sim_key, sim_dirs)
 
-            engine = ContextAwareRecommendation(self.src_dir, sub_folder, num_of_neighbors,
-                                                testing_start_pos, testing_end_pos)
+        if self.cache and self.cache.restore("recommendations", rec_key, rec_dirs):
+            logging.info("\tFold %d: recommendations restored from cache", i)
+        else:
+            DataReader.store.set_k(num_of_neighbors)
+            engine = self.create_recommendation_engine(sub_folder, num_of_neighbors,
+                                                       training_start_pos1, training_end_pos1,
+                                                       training_start_pos2, training_end_pos2,
+                                                       testing_start_pos, testing_end_pos)
             engine.recommendation()
-            elapsed_time = time.time() - start_time
-            logging.info("\tFold %d time %.2f ms", i, elapsed_time * 1000)
-
+            if self.cache:
+                self.cache.store("recommendations", rec_key, rec_dirs)
+        DataReader.store.flush()
+        elapsed_time = time.time() - start_time
+        logging.info("\tFold %d time %.2f ms", i, elapsed_time * 1000)
+
+        metrics = self.cache.load_json("metrics", metrics_key) if self.cache else None
+        if metrics is None:
             calc = SuccessCalculator(self.src_dir, sub_folder, testing_start_pos, testing_end_pos)
-            for n in ns:
-                success = calc.compute_success_rate(n)
-                precision = calc.compute_precision(n)
-                recall = calc.compute_recall(n)
-                avg_success[n] += success
-                avg_precision[n] += precision
-                avg_recall[n] += recall
-
-                # print(success, precision, recall)
-
-        logging.info("### 10-FOLDS RESULTS ###")
-        logging.info("N, SR, P, R, Neighbors")
-        for n in ns:
-            logging.info("%d\t%.3f\t%.3f\t%.3f\t%d", 
-                        n, 
-                        avg_success[n] / num_of_folds, 
-                        avg_precision[n] / num_of_folds, 
-                        avg_recall[n] / num_of_folds, 
-                        num_of_neighbors)
-        
-        # exit()
+            metrics = {str(n): list(values) for n, values in calc.compute_metrics(ns, self.num_of_workers).items()}
+            if self.cache:
+                self.cache.store_json("metrics", metrics_key, metrics)
 
+        return metrics
 
-if __name__ == "__main__":
-    runner = Runner()
-    runner.run(sys.argv[1:])
+    def get_fold_bounds(self, i, step):
+        """
+        Compute the positions in List.txt of the training and testing ranges of a fold.
 
+        :param i: The index of the fold, from 0 to 9.
+        :param step: The number of testing projects per fold.
+        :return: A tuple (training_start_pos1, training_end_pos1, training_start_pos2,
+                 training_end_pos2, testing_start_pos, testing_end_pos).
+        """
+        training_start_pos1 = 1
+        training_end_pos1 = i * step
+        training_start_pos2 = (i + 1) * step + 1
+        training_end_pos2 = self.num_of_projects
+        testing_start_pos = 1 + i * step
+        testing_end_pos = (i + 1) * step
+        return (training_start_pos1, training_end_pos1, training_start_pos2, training_end_pos2,
+                testing_start_pos, testing_end_pos)
+
+    def create_similarity_calculator(self, similarity_type, sub_folder, training_start_pos1, training_end_pos1,
+                                     training_start_pos2, training_end_pos2, testing_start_pos, testing_end_pos,
+                                     top_k=None):
+        """
+        Initialize the similarity calculator for a fold depending on the similarity type,
+        on the collapsed training corpus if near-duplicate collapsing is enabled.
 
+        :param top_k: Number of most similar projects written for every testing project by the
+                      streaming graph similarity, None for all of them.
+        """
+        if not isinstance(similarity_type, Similarity):
+            similarity_type = Similarity(similarity_type)
+
+        if similarity_type == Similarity.SYNTACTICALLY:
+            from syntacticSimilarity import SyntacticSimilarityCalculator
+            calculator = SyntacticSimilarityCalculator(self.src_dir, sub_folder,
+                                                       self.configuration, training_start_pos1, training_end_pos1,
+                                                       training_start_pos2, training_end_pos2,
+                                                       testing_start_pos, testing_end_pos)
+        elif similarity_type == Similarity.STRUCTURAL:
+            from structuralSimilarity import StructuralSimilarityCalculator
+            calculator = StructuralSimilarityCalculator(self.src_dir, sub_folder,
+                                                        self.configuration, training_start_pos1, training_end_pos1,
+                                                        training_start_pos2, training_end_pos2,
+                                                        testing_start_pos, testing_end_pos,
+                                                        store=self.get_structural_store())
+        else:
+            from graphSimilarity import GraphBasedSimilarityCalculator
+            calculator = GraphBasedSimilarityCalculator(self.src_dir, sub_folder,
+                                                        self.configuration, training_start_pos1, training_end_pos1, 
+                                                        training_start_pos2, training_end_pos2,
+                                                        testing_start_pos, testing_end_pos,
+                                                        memory_limit=self.memory_limit, top_k=top_k,
+                                                        num_of_features=self.num_of_features)
+
+        if self.collapser:
+            training = list(calculator.read_training_project_ids().values())
+            calculator.set_training_weights(self.collapser.collapse(training))
+            self.collapsed_sizes.append((len(training), len(calculator.training_weights)))
+        return calculator
+
+    def get_structural_store(self):
+        """
+        Get the store of the precomputed structural similarities, created once per run so that
+        the similarity files are fingerprinted only once.
 
-# Set up logging to print to console
-logging.basicConfig(level=logging.INFO)
+        :return: A StructuralSimilarityStore.
+        """
+        from structuralSimilarity import StructuralSimilarityStore
+        store = self.structural_store
+        if store is None or (store.src_dir, store.structural_dir) != (self.src_dir, self.structural_dir):
+            store = self.structural_store = StructuralSimilarityStore(self.src_dir, self.structural_dir)
+        return store
+
+    def compare_duplicate_collapsing(self, num_of_neighbors):
+        """
+        Run the ten-fold evaluation on the full and on the collapsed training corpus and report
+        how much the corpus shrank and how the metrics changed.
 
-# Initialize the Runner class
-runner = Runner()
+        :param num_of_neighbors: Number of neighbors to consider for the recommendation engine.
+        :return: A dictionary mapping every N to the (success, precision, recall) differences.
+        """
+        if not self.collapser:
+            logging.error("Set duplicateThreshold to compare the collapsed corpus with the full one")
+            return None
+
+        collapser = self.collapser
+        self.collapser = None
+        full = self.ten_fold_cross_validation(num_of_neighbors, self.similarity_type)
+        self.collapser = collapser
+        self.collapsed_sizes = []
+        collapsed = self.ten_fold_cross_validation(num_of_neighbors, self.similarity_type)
+
+        before = sum(size for size, _ in self.collapsed_sizes)
+        after = sum(size for _, size in self.collapsed_sizes)
+        logging.info("Training corpus collapsed from %d to %d projects over the folds (%.1f%% smaller)",
+                     before, after, 100.0 * (before - after) / max(before, 1))
+        difference = {n: tuple(c - f for c, f in zip(collapsed[n], full[n])) for n in full}
+        self.log_results("COLLAPSED - FULL", difference, num_of_neighbors)
+        return difference
+
+    def compare_feature_hashing(self, num_of_neighbors):
+        """
+        Report, fold by fold, how far the neighbor rankings computed with feature hashing drift
+        from the ones computed with the exact invocation vocabulary.
+
+        :param num_of_neighbors: The number of top neighbors compared for every testing project.
+        :return: A dictionary with the drift statistics averaged over the folds.
+        """
+        if not self.num_of_features:
+            logging.error("Set similarityFeatures to compare feature hashing with the exact vocabulary")
+            return None
 
-# # Test the load_configurations method
-success = runner.run([])
\ No newline at end of file
+        from graphSimilarity import GraphBasedSimilarityCalculator
+        step = self.num_of_projects // 10
+        totals = defaultdict(float)
+        for i in range(10):
+            (training_start_pos1, training_end_pos1, training_start_pos2, training_end_pos2,
+             testing_start_pos, testing_end_pos) = self.get_fold_bounds(i, step)
+            calculator = GraphBasedSimilarityCalculator(self.src_dir, f"evaluation/round{i + 1}", self.configuration,
+                                                        training_start_pos1, training_end_pos1,
+                                                        training_start_pos2, training_end_pos2,
+                                                        testing_start_pos, testing_end_pos,
+                                                        num_of_features=self.num_of_features)
+            for name, value in calculator.compare_with_exact_vocabulary(num_of_neighbors).items():
+                totals[name] += value
+
+        drift = {name: value / 10 for name, value in totals.items() if name != "projects"}
+        drift["projects"] = int(totals["projects"])
+        logging.info("### FEATURE HASHING DRIFT (%d features, top %d) ###", self.num_of_features, num_of_neighbors)
+        logging.info("Overlap, Displacement, Identical")
+        logging.info("%.3f\t%.2f\t%.3f", drift["overlap"], drift["displacement"], drift["identical"])
+        return drift
+
+    def create_recommendation_engine(self, sub_folder, num_of_neighbors, training_start_pos1, training_end_pos1,
+                                     training_start_pos2, training_end_pos2, testing_start_pos, testing_end_pos):
+        """
+        Initialize the configured recommendation engine for a fold. The co-occurrence engine
+        only depends on the training projects of the fold, so the engine of the last fold is
+        kept and reused for every number of neighbors; only one matrix is alive at a time.
+        """
+        if self.recommendation_engine == "co-occurrence":
+            from cooccurrenceRecommendation import CooccurrenceRecommendation
+            key = (sub_folder, training_start_pos1, training_end_pos1, training_start_pos2, training_end_pos2,
+                   testing_start_pos, testing_end_pos)
+            if self.cooccurrence_engine is None or self.cooccurrence_engine[0] != key:
+                # Released before the next matrix is built
+                self.cooccurrence_engine = None
+                self.cooccurrence_engine = (key, CooccurrenceRecommendation(
+                    self.src_dir, sub_folder, training_start_pos1, training_end_pos1,
+                    training_start_pos2, training_end_pos2, testing_start_pos, testing_end_pos))
+            engine = self.cooccurrence_engine[1]
+            engine.set_testing_projects(None)
+            return engine
+        from cars import ContextAwareRecommendation
+        return ContextAwareRecommendation(self.src_dir, sub_folder, num_of_neighbors,
+                                          testing_start_pos, testing_end_pos,
+                                          prune_candidates=self.prune_candidates,
+                                          cutoff=self.recommendation_cutoff)
+
+    def get_work_items(self, ks):
+        """
+        List the (fold, k, testing project) work items of a ten-fold cross-validation.
+
+        :param ks: The numbers of neighbors evaluated.
+        :return: A list of (fold, k, project) tuples ordered by fold, testing project and k.
+        """
+        num_of_folds = 10
+        step = self.num_of_projects // 10
+        reader = DataReader()
+        items = []
+        for i in range(num_of_folds):
+            bounds = self.get_fold_bounds(i, step)
+            projects = reader.read_project_list(os.path.join(self.src_dir, "List.txt"), bounds[4], bounds[5])
+            for project in projects.values():
+                for k in ks:
+                    items.append((i, k, project))
+        return items
+
+    def select_shard_items(self, items, shard_index, shard_count):
+        """
+        Select the work items of a shard. Items are split into contiguous chunks of (fold,
+        testing project) groups, so that every testing project is split and compared against
+        its fold only once, and every shard touches as few folds as possible.
+
+        :param items: The work items, as returned by `get_work_items`.
+        :param shard_index: The index of the shard, from 0 to shard_count - 1.
+        :param shard_count: The number of shards.
+        :return: The list of work items of the shard.
+        """
+        groups = list(dict.fromkeys((fold, project) for fold, _, project in items))
+        start = len(groups) * shard_index // shard_count
+        end = len(groups) * (shard_index + 1) // shard_count
+        selected = set(groups[start:end])
+        return [item for item in items if (item[0], item[2]) in selected]
+
+    def get_shard_file(self, shard_index, shard_count):
+        return os.path.join(self.src_dir, "evaluation", "shards", f"partial-{shard_index}-of-{shard_count}.json")
+
+    def run_shard(self, ks, similarity_type):
+        """
+        Evaluate the work items of this shard and write their metric vectors to a partial
+        results file on the shared filesystem, to be combined with `merge_shards`.
+
+        :param ks: The numbers of neighbors evaluated.
+        :param similarity_type: Similarity metric to be used.
+        """
+        step = self.num_of_projects // 10
+        ns = list(range(1, 21))
+        items = self.select_shard_items(self.get_work_items(ks), self.shard_index, self.shard_count)
+        results = []
+
+        for i in sorted(set(fold for fold, _, _ in items)):
+            fold_items = [item for item in items if item[0] == i]
+            projects = list(dict.fromkeys(project for _, _, project in fold_items))
+            (training_start_pos1, training_end_pos1, training_start_pos2, training_end_pos2,
+             testing_start_pos, testing_end_pos) = self.get_fold_bounds(i, step)
+            sub_folder = f"evaluation/shards/shard{self.shard_index}/round{i + 1}"
+
+            calculator = self.create_similarity_calculator(similarity_type, sub_folder,
+                                                           training_start_pos1, training_end_pos1,
+                                                           training_start_pos2, training_end_pos2,
+                                                           testing_start_pos, testing_end_pos,
+                                                           max(ks) if self.memory_limit else None)
+            calculator.set_testing_projects(projects)
+            calculator.compute_project_similarity()
+
+            for k in ks:
+                k_projects = [project for _, item_k, project in fold_items if item_k == k]
+                if not k_projects:
+                    continue
+
+                engine = self.create_recommendation_engine(sub_folder, k, training_start_pos1, training_end_pos1,
+                                                           training_start_pos2, training_end_pos2,
+                                                           testing_start_pos, testing_end_pos)
+                engine.set_testing_projects(k_projects)
+                DataReader.store.set_k(k)
+                engine.recommendation()
+
+                calc = SuccessCalculator(self.src_dir, sub_folder, testing_start_pos, testing_end_pos)
+                for project in k_projects:
+                    metrics = calc.compute_project_metrics(project, ns)
+                    results.append({"fold": i, "k": k, "project": project,
+                                    "metrics": [list(metrics[n]) for n in ns]})
+            DataReader.store.flush()
+            logging.info("\tShard %d: fold %d done (%d testing projects)", self.shard_index, i, len(projects))
+
+        shard_file = self.get_shard_file(self.shard_index, self.shard_count)
+        os.makedirs(os.path.dirname(shard_file), exist_ok=True)
+        with open(shard_file + ".tmp", 'w') as writer:
+            json.dump({"shard_index": self.shard_index, "shard_count": self.shard_count, "ks": ks, "ns": ns,
+                       "num_of_projects": self.num_of_projects, "items": results}, writer)
+        os.replace(shard_file + ".tmp", shard_file)
+
+    def merge_shards(self, ks):
+        """
+        Combine the partial results of all shards into the 10-FOLDS RESULTS table of every k.
+
+        :param ks: The numbers of neighbors evaluated.
+        :return: A dictionary mapping every k to its results, as returned by `ten_fold_cross_validation`,
+                 or None if some partial results are missing.
+        """
+        num_of_folds = 10
+        ns = list(range(1, 21))
+        metrics = {}
+        for shard_index in range(self.shard_count):
+            shard_file = self.get_shard_file(shard_index, self.shard_count)
+            try:
+                with open(shard_file, 'r') as reader:
+                    partial = json.load(reader)
+            except IOError as e:
+                logging.error(f"Couldn't read partial results {shard_file}: {e}")
+                return None
+            for item in partial["items"]:
+                metrics[(item["fold"], item["k"], item["project"])] = item["metrics"]
+
+        items = self.get_work_items(ks)
+        missing = [item for item in items if item not in metrics]
+        if missing:
+            logging.error(f"Missing results for {len(missing)} work items, e.g. {missing[0]}")
+            return None
+
+        all_results = {}
+        for k in ks:
+            avg_success = defaultdict(float)
+            avg_precision = defaultdict(float)
+            avg_recall = defaultdict(float)
+
+            for i in range(num_of_folds):
+                fold_metrics = [metrics[item] for item in items if item[0] == i and item[1] == k]
+                for index, n in enumerate(ns):
+                    number_of_matches = precision = recall = 0
+                    for vector in fold_metrics:
+                        number_of_matches += vector[index][0]
+                        precision += vector[index][1]
+                        recall += vector[index][2]
+                    avg_success[n] += (number_of_matches / len(fold_metrics)) * 100
+                    avg_precision[n] += precision / len(fold_metrics)
+                    avg_recall[n] += recall / len(fold_metrics)
+
+            results = {n: (avg_success[n] / num_of_folds,
+                           avg_precision[n] / num_of_folds,
+                           avg_recall[n] / num_of_folds) for n in ns}
+            self.log_results("10-FOLDS", results, k)
+            all_results[k] = results
+        return all_results
+
+    def calculate_success_pam(self, num_of_workers=None):
+        """
+        Evaluate the recommendations produced by PAM against their ground truth.
+
+        The PAM results directory follows the layout of an evaluation round: a List.txt file
+        with the projects, and the Recommendations and GroundTruth directories with one file per
+        project. Result files are streamed in parallel, and every file is read only once for all
+        the cutoffs. The result files are always read from the file system, whatever the
+        configured artifact store.
+
+        :param num_of_workers: Number of worker processes, defaults to the number of CPUs.
+        :return: A dictionary mapping every cutoff N to a (success rate, precision, recall) tuple,
+                 as returned by `ten_fold_cross_validation`.
+        :raise FileNotFoundError: If the results directory does not follow the layout.
+        """
+        from artifactStore import FileArtifactStore
+
+        missing = [name for name in ("List.txt", "Recommendations", "GroundTruth")
+                   if not os.path.exists(os.path.join(self.src_dir, name))]
+        if missing:
+            raise FileNotFoundError(f"The PAM results directory {self.src_dir} has no {', '.join(missing)}: "
+                                    f"it must hold a List.txt file and the Recommendations and GroundTruth "
+                                    f"directories")
+
+        ns = list(range(1, 21))
+        calc = SuccessCalculator(self.src_dir, "", 1, -1, FileArtifactStore())
+        results = calc.compute_metrics(ns, num_of_workers or os.cpu_count() or 1)
+        self.log_results("PAM", results)
+        return results
+
+    def log_results(self, title, results, num_of_neighbors=None):
+        """
+        Log a table with the success rate, precision and recall of every cutoff.
+
+        :param title: The title of the table.
+        :param results: A dictionary mapping every cutoff to a (success rate, precision, recall) tuple.
+        :param num_of_neighbors: Number of neighbors used by the recommendation engine, if any.
+        """
+        logging.info(f"### {title} RESULTS ###")
+        if num_of_neighbors is None:
+            logging.info("N, SR, P, R")
+        else:
+            logging.info("N, SR, P, R, Neighbors")
+        for n, (success, precision, recall) in results.items():
+            if num_of_neighbors is None:
+                logging.info("%d\t%.3f\t%.3f\t%.3f", n, success, precision, recall)
+            else:
+                logging.info("%d\t%.3f\t%.3f\t%.3f\t%d", n, success, precision, recall, num_of_neighbors)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    similarity_log = logging.getLogger("GraphBasedSimilarityCalculator")
+    handler = logging.FileHandler('similarity_calculator.log')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    similarity_log.addHandler(handler)
+
+    runner = Runner()
+    runner.run(sys.argv[1:])
@@ -0,0 +1,244 @@
+import os
+import time
+import random
+import logging
+import numpy as np
+from collections import defaultdict
+
+from dataReader import DataReader
+from successCalculator import SuccessCalculator
+
+class SampledEvaluation:
+    """
+    Approximate ten-fold cross-validation on a stratified sample of the testing projects.
+
+    Testing projects are stratified into buckets of equal count by the size of their files,
+    and evaluated in batches drawn from every bucket in proportion to its size,
+    each against the training projects of its own fold. After every batch, the success rate,
+    precision and recall are estimated with stratified means and percentile bootstrap
+    confidence intervals, and the evaluation stops as soon as all the intervals are tight
+    enough. With folds of equal size, the stratified mean estimates the same quantity as the
+    average over the folds of the full evaluation.
+
+    The similarity calculator of every fold is created once, and the similarities of a testing
+    project are computed only once, so that successive batches and runs with other numbers of
+    neighbors only add recommendations. The calculators of all folds share one training corpus,
+    in which every project is held only once, and in streaming mode every batch reads the
+    training corpus of a fold only once.
+
+    The default tolerances stop the evaluation after a few hundred testing projects: half-widths
+    of 5 points of success rate and 0.05 of precision and recall take about 400 projects in the
+    worst case, against about 1500 for 2.5 points and 0.025.
+
+    :param runner: A Runner with the configurations loaded.
+    :param num_of_buckets: Number of size buckets the testing projects are stratified by.
+    :param batch_size: Number of testing projects evaluated between two checks of the intervals.
+    :param sr_tolerance: Half-width of the intervals of the success rates, in percentage points,
+                         below which the evaluation stops.
+    :param tolerance: Half-width of the intervals of precision and recall below which the
+                      evaluation stops.
+    :param confidence: Confidence level of the intervals.
+    :param num_of_resamples: Number of bootstrap resamples.
+    :param max_fraction: Maximum fraction of the testing projects evaluated.
+    :param seed: Seed of the sampling and of the bootstrap.
+    """
+
+    log = logging.getLogger("SampledEvaluation")
+
+    def __init__(self, runner, num_of_buckets=4, batch_size=20, sr_tolerance=5.0, tolerance=0.05, confidence=0.95,
+                 num_of_resamples=1000, max_fraction=1.0, seed=1):
+        self.runner = runner
+        self.num_of_buckets = num_of_buckets
+        self.batch_size = batch_size
+        self.sr_tolerance = sr_tolerance
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.num_of_resamples = num_of_resamples
+        self.max_fraction = max_fraction
+        self.seed = seed
+        self.ns = list(range(1, 21))
+        self.reader = DataReader()
+        self.strata = None
+        self.calculators = {}
+        # Term frequencies of the training projects, shared by the calculators of all folds
+        self.shared_corpus = {}
+        # Testing projects of every fold whose similarities are computed
+        self.similar_projects = defaultdict(set)
+
+    def get_strata(self):
+        """
+        Stratify the testing projects of all folds by the size of their files, which avoids
+        parsing them.
+
+        :return: A list of strata, each a list of (fold, project) tuples, from the smallest
+                 projects to the largest.
+        """
+        step = self.runner.num_of_projects // 10
+        items = []
+        for i in range(10):
+            bounds = self.runner.get_fold_bounds(i, step)
+            projects = self.reader.read_project_list(os.path.join(self.runner.src_dir, "List.txt"),
+                                                     bounds[4], bounds[5])
+            items.extend((i, project) for project in projects.values())
+
+        sizes = {}
+        for _, project in items:
+            try:
+                sizes[project] = os.path.getsize(self.reader.source.locate(os.path.join(self.runner.src_dir, project)))
+            except (OSError, TypeError):
+                sizes[project] = 0
+        items.sort(key=lambda item: sizes[item[1]])
+        num_of_buckets = max(1, min(self.num_of_buckets, len(items)))
+        return [items[len(items) * b // num_of_buckets:len(items) * (b + 1) // num_of_buckets]
+                for b in range(num_of_buckets)]
+
+    def get_sample_order(self, strata):
+        """
+        Order the testing projects so that every prefix of the order samples the strata in
+        proportion to their sizes: the j-th project of a shuffled stratum of size N is placed
+        at (j + u) / N, with u a random offset of the stratum.
+
+        :param strata: The strata, as returned by `get_strata`.
+        :return: A list of (stratum, fold, project) tuples.
+        """
+        rng = random.Random(self.seed)
+        keyed = []
+        for h, stratum in enumerate(strata):
+            shuffled = list(stratum)
+            rng.shuffle(shuffled)
+            offset = rng.random()
+            keyed.extend(((j + offset) / len(shuffled), h, fold, project) for j, (fold, project) in enumerate(shuffled))
+        keyed.sort()
+        return [(h, fold, project) for _, h, fold, project in keyed]
+
+    def evaluate_batch(self, batch, num_of_neighbors, similarity_type):
+        """
+        Compute the similarities, recommendations and metrics of a batch of testing projects.
+
+        :param batch: A list of (stratum, fold, project) tuples.
+        :return: A list of (stratum, metric vector) tuples, the vector holding the success (in
+                 percent), precision and recall of every cutoff.
+        """
+        step = self.runner.num_of_projects // 10
+        folds = defaultdict(list)
+        for h, fold, project in batch:
+            folds[fold].append((h, project))
+
+        results = []
+        for i, fold_items in sorted(folds.items()):
+            projects = [project for _, project in fold_items]
+            (training_start_pos1, training_end_pos1, training_start_pos2, training_end_pos2,
+             testing_start_pos, testing_end_pos) = self.runner.get_fold_bounds(i, step)
+            sub_folder = f"evaluation/sample/round{i + 1}"
+
+            if i not in self.calculators:
+                self.calculators[i] = self.runner.create_similarity_calculator(
+                    similarity_type, sub_folder, training_start_pos1, training_end_pos1,
+                    training_start_pos2, training_end_pos2, testing_start_pos, testing_end_pos,
+                    num_of_neighbors if self.runner.memory_limit else None)
+                self.calculators[i].set_shared_corpus(self.shared_corpus)
+            missing = [project for project in projects if project not in self.similar_projects[i]]
+            if missing:
+                self.calculators[i].set_testing_projects(missing)
+                self.calculators[i].compute_project_similarity()
+                self.similar_projects[i].update(missing)
+
+            engine = self.runner.create_recommendation_engine(sub_folder, num_of_neighbors,
+                                                              training_start_pos1, training_end_pos1,
+                                                              training_start_pos2, training_end_pos2,
+                                                              testing_start_pos, testing_end_pos)
+            engine.set_testing_projects(projects)
+            DataReader.store.set_k(num_of_neighbors)
+            engine.recommendation()
+            DataReader.store.flush()
+
+            calc = SuccessCalculator(self.runner.src_dir, sub_folder, testing_start_pos, testing_end_pos)
+            for h, project in fold_items:
+                metrics = calc.compute_project_metrics(project, self.ns)
+                vector = []
+                for n in self.ns:
+                    success, precision, recall = metrics[n]
+                    vector.extend((success * 100, precision, recall))
+                results.append((h, vector))
+        return results
+
+    def estimate(self, values, weights, rng):
+        """
+        Compute the stratified means of the metrics and their bootstrap confidence intervals.
+        Strata not sampled yet are left out and the weights of the others renormalized.
+
+        :param values: A dictionary mapping strata to the list of metric vectors of their projects.
+        :param weights: The share of every stratum in the testing projects.
+        :param rng: The numpy random generator of the bootstrap.
+        :return: A tuple of arrays (estimates, lower bounds, upper bounds).
+        """
+        sampled = [h for h in values if values[h]]
+        total_weight = sum(weights[h] for h in sampled)
+        estimates = 0.0
+        resampled = 0.0
+        for h in sampled:
+            matrix = np.array(values[h], dtype=np.float64)
+            size = len(matrix)
+            weight = weights[h] / total_weight
+            estimates = estimates + weight * matrix.mean(axis=0)
+            # Every bootstrap resample draws the projects of the stratum with replacement
+            counts = rng.multinomial(size, np.full(size, 1.0 / size), size=self.num_of_resamples)
+            resampled = resampled + weight * (counts @ matrix) / size
+
+        alpha = (1 - self.confidence) / 2
+        lower, upper = np.quantile(resampled, [alpha, 1 - alpha], axis=0)
+        return estimates, lower, upper
+
+    def is_tight(self, lower, upper):
+        half_widths = (upper - lower).reshape(len(self.ns), 3) / 2
+        return bool(np.all(half_widths[:, 0] <= self.sr_tolerance) and np.all(half_widths[:, 1:] <= self.tolerance))
+
+    def run(self, num_of_neighbors, similarity_type):
+        """
+        Evaluate batches of the stratified sample until the confidence intervals are tight
+        enough or the maximum fraction of testing projects is reached.
+
+        :param num_of_neighbors: Number of neighbors to consider for the recommendation engine.
+        :param similarity_type: Similarity metric to be used.
+        :return: A dictionary mapping every cutoff to the ((SR, low, high), (P, low, high),
+                 (R, low, high)) estimates, and the number of testing projects evaluated.
+        """
+        before = time.time()
+        if self.strata is None:
+            self.strata = self.get_strata()
+        strata = self.strata
+        total = sum(len(stratum) for stratum in strata)
+        weights = {h: len(stratum) / total for h, stratum in enumerate(strata)}
+        order = self.get_sample_order(strata)
+        limit = max(1, int(total * self.max_fraction))
+        rng = np.random.default_rng(self.seed)
+
+        values = {h: [] for h in range(len(strata))}
+        evaluated = 0
+        while evaluated < min(limit, len(order)):
+            batch = order[evaluated:min(evaluated + self.batch_size, limit)]
+            for h, vector in self.evaluate_batch(batch, num_of_neighbors, similarity_type):
+                values[h].append(vector)
+            evaluated += len(batch)
+
+            estimates, lower, upper = self.estimate(values, weights, rng)
+            self.log.info("%d of %d testing projects evaluated", evaluated, total)
+            if all(len(vectors) >= 2 for vectors in values.values()) and self.is_tight(lower, upper):
+                self.log.info("Confidence intervals tight enough, stopping")
+                break
+
+        results = {}
+        for pos, n in enumerate(self.ns):
+            results[n] = tuple((estimates[3 * pos + j], lower[3 * pos + j], upper[3 * pos + j]) for j in range(3))
+        self.report(results, evaluated, total, num_of_neighbors, time.time() - before)
+        return results, evaluated
+
+    def report(self, results, evaluated, total, num_of_neighbors, elapsed):
+        self.log.info("### SAMPLED 10-FOLDS RESULTS (%d of %d testing projects, %.0f%% confidence, %.2f s) ###",
+                      evaluated, total, self.confidence * 100, elapsed)
+        self.log.info("N, SR [low, high], P [low, high], R [low, high], Neighbors")
+        for n, ((success, success_low, success_high), (precision, precision_low, precision_high),
+                (recall, recall_low, recall_high)) in results.items():
+            self.log.info("%d\t%.3f [%.3f, %.3f]\t%.3f [%.3f, %.3f]\t%.3f [%.3f, %.3f]\t%d", n,
+                          success, success_low, success_high, precision, precision_low, precision_high,
+                          recall, recall_low, recall_high, num_of_neighbors)
@@ -0,0 +1,308 @@
+import math
+import atexit
+import logging
+import numpy as np
+from multiprocessing import shared_memory
+
+class SharedCorpus:
+    """
+    Read-only, zero-copy view of a parsed corpus for worker processes.
+
+    The vocabulary, the per-project invocation arrays and the TF-IDF vectors are laid out as
+    flat numpy arrays in a single buffer, either a `multiprocessing.shared_memory` block or a
+    memory-mapped file. Workers attach to the buffer through a small picklable handle instead
+    of re-reading the dataset or receiving a pickled copy of it, so memory stays flat as
+    workers are added on the same host.
+
+    Arrays of the layout:
+
+    - `vocabulary`, `vocabulary_offsets`: UTF-8 invocation names, term id i spanning
+      vocabulary[vocabulary_offsets[i]:vocabulary_offsets[i + 1]];
+    - `projects`, `project_name_offsets`: UTF-8 project names, in the same way;
+    - `project_offsets`, `term_ids`, `counts`: invocation arrays of every project, project p
+      spanning term_ids[project_offsets[p]:project_offsets[p + 1]];
+    - `weights`, `norms`: TF-IDF weights aligned with `term_ids`, and the norm of every project vector.
+
+    :param buffer: The buffer holding the arrays.
+    :param layout: A dictionary mapping array names to (dtype, offset, length) tuples.
+    :param shm: The shared memory block, if the buffer is one.
+    """
+
+    log = logging.getLogger("SharedCorpus")
+
+    ALIGNMENT = 8
+
+    # Corpora attached by this process, keyed by handle, so that a worker attaches only once
+    attached = {}
+
+    def __init__(self, buffer, layout, shm=None, owner=False):
+        # The views are created before the block is stored, so that they are released first
+        # and the block can be closed when the corpus is garbage collected
+        self.arrays = {name: np.frombuffer(buffer, dtype=np.dtype(dtype), count=length, offset=offset)
+                       for name, (dtype, offset, length) in layout.items()}
+        self.layout = layout
+        self.shm = shm
+        self.owner = owner
+        # Path of the mapped file, if the buffer is one
+        self.filename = None
+        self.project_ids = {name: pos for pos, name in enumerate(self.decode("projects", "project_name_offsets"))}
+        self.term_ids = None
+
+    @staticmethod
+    def build_vocabulary(corpus):
+        """
+        Number the invocations of a corpus in order of first appearance and count the projects
+        containing each of them.
+
+        :param corpus: A corpusIngest.Corpus.
+        :return: A tuple (vocabulary mapping terms to their ID, document frequency of every ID).
+        """
+        vocabulary = {}
+        document_frequency = []
+        for terms in corpus.invocations.values():
+            for term in terms:
+                if term not in vocabulary:
+                    vocabulary[term] = len(vocabulary)
+                    document_frequency.append(0)
+                document_frequency[vocabulary[term]] += 1
+        return vocabulary, document_frequency
+
+    @staticmethod
+    def build_arrays(corpus, vocabulary=None, document_frequency=None):
+        """
+        Build the arrays of the layout from a corpus. IDF weights are computed over the whole corpus.
+
+        :param corpus: A corpusIngest.Corpus.
+        :param vocabulary: The vocabulary of the corpus, as returned by `build_vocabulary`, None to build it.
+        :param document_frequency: The document frequencies of the vocabulary.
+        :return: A dictionary mapping array names to numpy arrays.
+        """
+        projects = list(corpus.invocations)
+        if vocabulary is None:
+            vocabulary, document_frequency = SharedCorpus.build_vocabulary(corpus)
+
+        project_offsets = [0]
+        term_ids = []
+        counts = []
+        weights = []
+        norms = []
+        total = len(projects)
+        for project in projects:
+            squares = 0.0
+            for term, count in corpus.invocations[project].items():
+                term_id = vocabulary[term]
+                weight = count * math.log(total / document_frequency[term_id])
+                term_ids.append(term_id)
+                counts.append(count)
+                weights.append(weight)
+                squares += weight * weight
+            project_offsets.append(len(term_ids))
+            norms.append(math.sqrt(squares))
+
+        vocabulary_blob, vocabulary_offsets = SharedCorpus.encode(vocabulary)
+        projects_blob, project_name_offsets = SharedCorpus.encode(projects)
+        return {
+            "vocabulary": vocabulary_blob,
+            "vocabulary_offsets": vocabulary_offsets,
+            "projects": projects_blob,
+            "project_name_offsets": project_name_offsets,
+            "project_offsets": np.array(project_offsets, dtype=np.int64),
+            "term_ids": np.array(term_ids, dtype=np.int32),
+            "counts": np.array(counts, dtype=np.int32),
+            "weights": np.array(weights, dtype=np.float64),
+            "norms": np.array(norms, dtype=np.float64),
+        }
+
+    @staticmethod
+    def encode(names):
+        """
+        Encode strings as one UTF-8 blob and the offsets of every string in it.
+
+        :return: A tuple of arrays (blob, offsets).
+        """
+        encoded = [name.encode("utf-8") for name in names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(name) for name in encoded]) if encoded else []
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    @classmethod
+    def plan_layout(cls, arrays):
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            layout[name] = (array.dtype.str, offset, len(array))
+            offset += array.nbytes
+            offset += -offset % cls.ALIGNMENT
+        return layout, max(offset, 1)
+
+    @staticmethod
+    def fill(buffer, layout, arrays):
+        for name, array in arrays.items():
+            dtype, offset, length = layout[name]
+            np.frombuffer(buffer, dtype=np.dtype(dtype), count=length, offset=offset)[:] = array
+
+    @classmethod
+    def create(cls, corpus):
+        """
+        Copy a corpus into a new shared memory block. The creating process owns the block and
+        must `unlink` it when the workers are done.
+
+        :param corpus: A corpusIngest.Corpus.
+        :return: The SharedCorpus of the new block.
+        """
+        arrays = cls.build_arrays(corpus)
+        layout, size = cls.plan_layout(arrays)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        cls.fill(shm.buf, layout, arrays)
+        cls.log.info("Shared corpus of %d projects and %d terms in %d bytes (%s)",
+                     len(arrays["norms"]), len(arrays["vocabulary_offsets"]) - 1, size, shm.name)
+        return cls(shm.buf, layout, shm, owner=True)
+
+    @classmethod
+    def save(cls, corpus, filename):
+        """
+        Write a corpus to a file that workers can memory-map with `open`.
+
+        :param corpus: A corpusIngest.Corpus.
+        :param filename: Path of the file to write.
+        :return: The handle to pass to `attach`.
+        """
+        arrays = cls.build_arrays(corpus)
+        layout, size = cls.plan_layout(arrays)
+        mapped = np.memmap(filename, dtype=np.uint8, mode='w+', shape=(size,))
+        cls.fill(mapped, layout, arrays)
+        mapped.flush()
+        del mapped
+        return ("file", filename, layout)
+
+    @property
+    def handle(self):
+        """
+        Picklable handle to pass to the worker processes.
+        """
+        if self.filename is not None:
+            return ("file", self.filename, self.layout)
+        return ("shm", self.shm.name, self.layout)
+
+    @classmethod
+    def attach(cls, handle):
+        """
+        Attach to a shared corpus from a worker process, without copying it. Before Python
+        3.13, shared memory blocks should only be attached by processes started from the
+        creating one, which share its resource tracker.
+
+        :param handle: The handle returned by `handle` or `save`.
+        :return: A SharedCorpus.
+        """
+        kind, name, layout = handle
+        if not cls.attached:
+            atexit.register(cls.detach_all)
+        if (kind, name) not in cls.attached:
+            if kind == "snapshot":
+                # The snapshot was checked against the dataset by the process that opened it
+                from modelSnapshot import ModelSnapshot
+                cls.attached[(kind, name)] = ModelSnapshot.open(name, layout, verify=False)
+            elif kind == "file":
+                corpus = cls(np.memmap(name, dtype=np.uint8, mode='r'), layout)
+                corpus.filename = name
+                cls.attached[(kind, name)] = corpus
+            else:
+                try:
+                    shm = shared_memory.SharedMemory(name=name, track=False)
+                except TypeError:
+                    shm = shared_memory.SharedMemory(name=name)
+                cls.attached[(kind, name)] = cls(shm.buf, layout, shm)
+        return cls.attached[(kind, name)]
+
+    @classmethod
+    def detach_all(cls):
+        """
+        Close all the corpora attached by this process.
+        """
+        for corpus in cls.attached.values():
+            corpus.close()
+        cls.attached.clear()
+
+    def decode(self, blob, offsets):
+        data = self.arrays[blob].tobytes()
+        bounds = self.arrays[offsets]
+        return [data[bounds[i]:bounds[i + 1]].decode("utf-8") for i in range(len(bounds) - 1)]
+
+    def get_terms(self):
+        """
+        :return: The vocabulary, indexed by term id.
+        """
+        return self.decode("vocabulary", "vocabulary_offsets")
+
+    def get_term(self, term_id):
+        """
+        Decode a single term from the buffer, without decoding the vocabulary.
+        """
+        offsets = self.arrays["vocabulary_offsets"]
+        return self.arrays["vocabulary"][offsets[term_id]:offsets[term_id + 1]].tobytes().decode("utf-8")
+
+    def get_term_id(self, term):
+        if self.term_ids is None:
+            self.term_ids = {name: pos for pos, name in enumerate(self.get_terms())}
+        return self.term_ids.get(term)
+
+    def get_projects(self):
+        return list(self.project_ids)
+
+    def get_invocations(self, project):
+        """
+        Get the invocation array of a project as zero-copy views.
+
+        :param project: The project name.
+        :return: A tuple of arrays (term ids, counts).
+        """
+        pos = self.project_ids[project]
+        start, end = self.arrays["project_offsets"][pos], self.arrays["project_offsets"][pos + 1]
+        return self.arrays["term_ids"][start:end], self.arrays["counts"][start:end]
+
+    def get_vector(self, project):
+        """
+        Get the TF-IDF vector of a project as zero-copy views.
+
+        :param project: The project name.
+        :return: A tuple (term ids, weights, norm).
+        """
+        pos = self.project_ids[project]
+        start, end = self.arrays["project_offsets"][pos], self.arrays["project_offsets"][pos + 1]
+        return self.arrays["term_ids"][start:end], self.arrays["weights"][start:end], self.arrays["norms"][pos]
+
+    def get_project_terms(self, project):
+        """
+        Get the invocation frequencies of a project, as DataReader.get_project_invocations does.
+
+        :param project: The project name.
+        :return: A dictionary mapping invocations to their frequency.
+        """
+        ids, counts = self.get_invocations(project)
+        return {self.get_term(term_id): int(count) for term_id, count in zip(ids, counts)}
+
+    def compute_cosine_similarity(self, project1, project2):
+        """
+        Compute the cosine similarity of the TF-IDF vectors of two projects.
+        """
+        ids1, weights1, norm1 = self.get_vector(project1)
+        ids2, weights2, norm2 = self.get_vector(project2)
+        if norm1 == 0 or norm2 == 0:
+            return 0.0
+        _, index1, index2 = np.intersect1d(ids1, ids2, assume_unique=True, return_indices=True)
+        return float(np.dot(weights1[index1], weights2[index2]) / (norm1 * norm2))
+
+    def close(self):
+        """
+        Release the views of this process on the buffer.
+        """
+        self.arrays = {}
+        if self.shm is not None:
+            self.shm.close()
+
+    def unlink(self):
+        """
+        Destroy the shared memory block. Only the creating process should call this.
+        """
+        if self.shm is not None and self.owner:
+            self.shm.unlink()
@@ -2,4 +2,5 @@ from enum import Enum
 
 class Similarity(Enum):
     SYNTACTICALLY = "Syntactically"
-    STRUCTURAL = "Structural"
\ No newline at end of file
+    STRUCTURAL = "Structural"
+    GRAPH = "Graph"
\ No newline at end of file
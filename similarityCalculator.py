@@ -2,8 +2,8 @@ import os
 from abc import ABC, abstractmethod
 from typing import Dict, Any
 
-from dataReader import *
-from configuration import *
+from dataReader import DataReader
+from configuration import Configuration
 
 class SimilarityCalculator(ABC):
     """
@@ -35,6 +35,11 @@ class SimilarityCalculator(ABC):
         self.training_end_pos2 = training_end_pos2
         self.testing_start_pos = testing_start_pos
         self.testing_end_pos = testing_end_pos
+        self.testing_projects = None
+        self.training_weights = None
+        # Training corpus loaded by the first call of compute_project_similarity
+        self.training_corpus = None
+        self.shared_corpus = None
         self.reader = DataReader()
         if self.sub_folder:
             self.set_sim_dir(os.path.join(self.src_dir, self.sub_folder, "Similarities"))
@@ -49,18 +54,15 @@ class SimilarityCalculator(ABC):
         """
         pass
 
-    def compute_project_similarity(self):
+    def read_training_project_ids(self) -> Dict[int, str]:
         """
-        Compute the similarity between all testing projects and training projects.
+        Read the IDs of all training projects, i.e. the two training ranges of List.txt,
+        restricted to the representatives set with `set_training_weights` if any.
 
-        This method reads the training and testing projects, applies the configuration settings, 
-        and computes the similarity between them.
+        :return: A dictionary mapping the position of every training project to its ID.
         """
-        # print("entered")
-        training_projects = {}
         training_projects_id = {}
 
-        # Read all training project IDs
         if self.training_start_pos1 < self.training_end_pos1:
             training_projects_id.update(self.reader.read_project_list(
                 os.path.join(self.src_dir, "List.txt"), 
@@ -75,20 +77,35 @@ class SimilarityCalculator(ABC):
                 self.training_end_pos2
             ))
 
-        # Read all training projects
-        for training_id in training_projects_id.values():
-            training_projects.update(self.reader.get_project_invocations(self.src_dir, training_id))
+        if self.training_weights is not None:
+            training_projects_id = {pos: project for pos, project in training_projects_id.items()
+                                    if project in self.training_weights}
+        return training_projects_id
 
-        # print(training_projects)
-        # exit()
+    def read_testing_project_ids(self) -> Dict[int, str]:
+        """
+        Read the IDs of all testing projects, restricted to the ones set with
+        `set_testing_projects` if any.
 
-        # Read all testing project IDs
+        :return: A dictionary mapping the position of every testing project to its ID.
+        """
         testing_projects_id = self.reader.read_project_list(
             os.path.join(self.src_dir, "List.txt"), 
             self.testing_start_pos, 
             self.testing_end_pos
         )
+        if self.testing_projects is not None:
+            testing_projects_id = {pos: project for pos, project in testing_projects_id.items()
+                                   if project in self.testing_projects}
+        return testing_projects_id
 
+    def get_testing_settings(self):
+        """
+        Get how testing projects are split according to the configuration.
+
+        :return: A tuple with the number of invocations kept as query for the testing declaration
+                 and whether the second half of the declarations is removed.
+        """
         num_of_testing_invocations = 0
         remove_half = False
 
@@ -104,20 +121,60 @@ class SimilarityCalculator(ABC):
         elif self.configuration == Configuration.C2_2:
             num_of_testing_invocations = 4
             remove_half = False
+
+        return num_of_testing_invocations, remove_half
+
+    def compute_project_similarity(self):
+        """
+        Compute the similarity between all testing projects and training projects.
+
+        This method reads the training and testing projects, applies the configuration settings, 
+        and computes the similarity between them.
+        """
+        # print("entered")
+        # Read all training projects, once for every subset of testing projects
+        if self.training_corpus is None:
+            self.training_corpus = {}
+            for training_id in self.read_training_project_ids().values():
+                if self.shared_corpus is not None and training_id in self.shared_corpus:
+                    self.training_corpus[training_id] = self.shared_corpus[training_id]
+                    continue
+                self.training_corpus.update(self.prepare_terms(self.reader.get_project_invocations(self.src_dir, training_id)))
+                if self.shared_corpus is not None:
+                    self.shared_corpus[training_id] = self.training_corpus[training_id]
+        training_projects = self.training_corpus
+
+        # print(training_projects)
+        # exit()
+
+        # Read all testing project IDs
+        testing_projects_id = self.read_testing_project_ids()
+
+        num_of_testing_invocations, remove_half = self.get_testing_settings()
         
         # print(self.configuration, Configuration.C2_1)
         # print(num_of_testing_invocations)
 
         for testing_id in testing_projects_id.values():
             # Get half of all declarations and use for similarity computation
-            testing_project = self.reader.get_testing_project_invocations(
+            testing_project = self.prepare_terms(self.reader.get_testing_project_invocations(
                 self.src_dir, self.sub_folder, testing_id, num_of_testing_invocations, remove_half
-            )
+            ))
 
             training_projects.update(testing_project)
             self.compute_similarity(testing_id, training_projects)
             training_projects.pop(testing_id)
 
+    def prepare_terms(self, projects: Dict[str, Dict[str, int]]) -> Dict[str, Dict[str, int]]:
+        """
+        Transform the term frequencies of projects before they are compared. Subclasses may
+        override this to change the representation of the terms.
+
+        :param projects: A dictionary mapping projects to their term frequencies.
+        :return: The transformed dictionary, by default unchanged.
+        """
+        return projects
+
     def get_sim_dir(self) -> str:
         """
         Get the directory path where the similarity results are stored.
@@ -132,6 +189,43 @@ class SimilarityCalculator(ABC):
 
         :param sim_dir: The similarity directory path.
         """
-        if not os.path.exists(sim_dir):
-            os.makedirs(sim_dir)
-        self.sim_dir = sim_dir
\ No newline at end of file
+        self.reader.make_artifact_dir(sim_dir)
+        self.sim_dir = sim_dir
+
+    def set_testing_projects(self, testing_projects):
+        """
+        Restrict the computation to a subset of the testing projects.
+
+        :param testing_projects: The IDs of the testing projects to process, None for all of them.
+        """
+        self.testing_projects = set(testing_projects) if testing_projects is not None else None
+
+    def set_shared_corpus(self, shared_corpus):
+        """
+        Share the training corpus with other calculators, e.g. the ones of the other folds: the
+        projects found in the shared dictionary are not read again, and the projects read are
+        added to it, so that every project is held in memory only once.
+
+        :param shared_corpus: A dictionary mapping projects to their term frequencies, as
+                              returned by `prepare_terms`.
+        """
+        self.shared_corpus = shared_corpus
+        self.training_corpus = None
+
+    def set_training_weights(self, training_weights):
+        """
+        Restrict the training corpus to representatives of groups of near-duplicate projects.
+
+        :param training_weights: A dictionary mapping every representative to the number of
+                                 projects it stands for, None to use all training projects.
+        """
+        self.training_weights = training_weights
+        self.training_corpus = None
+
+    def get_weight(self, project: str) -> int:
+        """
+        Get the number of projects a project stands for in the training corpus.
+        """
+        if self.training_weights is None:
+            return 1
+        return self.training_weights.get(project, 1)
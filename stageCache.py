@@ -0,0 +1,342 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+
+from dataReader import DataReader
+
+class StageCache:
+    """
+    Content-addressed cache of the outputs of the evaluation stages (split generation,
+    similarities, recommendations and metrics).
+
+    Every stage output is stored under a key which is the hash of all the inputs of the
+    stage: dataset digests, configuration, fold bounds, number of neighbors and the
+    version of the code. A stage whose key already exists in the cache is restored
+    instead of being computed again.
+
+    :param cache_dir: Directory where the cached artifacts are stored, None to only compute digests.
+    """
+
+    log = logging.getLogger("StageCache")
+
+    STATS_FILE = "stats.json"
+    MANIFEST_FILE = "manifest.json"
+    ARTIFACT_FILE = "artifact.json"
+
+    # Modules whose code determines the output of each stage. Stages not listed here
+    # depend on every module of the project.
+    STAGE_MODULES = {
+        "split": ["configuration.py", "dataReader.py", "similarityCalculator.py"],
+        "similarities": ["dataReader.py", "graphSimilarity.py", "nearDuplicates.py", "similarityCalculator.py",
+                         "structuralSimilarity.py", "syntacticSimilarity.py"],
+        "recommendations": ["cars.py", "cooccurrenceRecommendation.py", "dataReader.py", "graphSimilarity.py"],
+        "metrics": ["dataReader.py", "successCalculator.py"],
+    }
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.reader = DataReader()
+        self.file_digests = {}
+        self.dataset_digests = {}
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def code_version(modules=None):
+        """
+        Compute the version of the code as the digest of the Python modules a stage depends on.
+
+        :param modules: File names of the modules, None for all the modules of the project.
+        :return: A hexadecimal digest that changes whenever one of the modules changes.
+        """
+        digest = hashlib.sha256()
+        code_dir = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(code_dir)):
+            if name.endswith(".py") and (modules is None or name in modules):
+                with open(os.path.join(code_dir, name), 'rb') as reader:
+                    digest.update(name.encode())
+                    digest.update(reader.read())
+        return digest.hexdigest()
+
+    def file_digest(self, filename):
+        """
+        Compute the digest of a file. Digests are memoized by path, size and modification time.
+
+        :param filename: Path of the file.
+        :return: A hexadecimal digest of the file content, or None if the file cannot be read.
+        """
+        try:
+            stat = os.stat(filename)
+        except (OSError, TypeError):
+            return None
+
+        memo_key = (filename, stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self.file_digests:
+            digest = hashlib.sha256()
+            with open(filename, 'rb') as reader:
+                for chunk in iter(lambda: reader.read(1 << 20), b''):
+                    digest.update(chunk)
+            self.file_digests[memo_key] = digest.hexdigest()
+        return self.file_digests[memo_key]
+
+    def dataset_digest(self, src_dir):
+        """
+        Compute the digest of a dataset: List.txt and every project file it lists.
+
+        :param src_dir: Source directory of the dataset.
+        :return: A hexadecimal digest of the dataset.
+        """
+        if src_dir not in self.dataset_digests:
+            list_file = os.path.join(src_dir, "List.txt")
+            digest = hashlib.sha256()
+            digest.update(str(self.file_digest(self.reader.source.locate(list_file))).encode())
+            for project in self.reader.read_project_list(list_file, 1, -1).values():
+                digest.update(project.encode())
+                digest.update(str(self.file_digest(self.reader.source.locate(os.path.join(src_dir, project)))).encode())
+            self.dataset_digests[src_dir] = digest.hexdigest()
+        return self.dataset_digests[src_dir]
+
+    def key(self, stage, **inputs):
+        """
+        Compute the key of a stage from its inputs and the version of the code it runs.
+
+        :param stage: Name of the stage.
+        :param inputs: All the inputs the stage output depends on; values must be JSON serializable.
+        :return: A hexadecimal key.
+        """
+        if stage not in self.versions:
+            self.versions[stage] = self.code_version(self.STAGE_MODULES.get(stage))
+        payload = json.dumps({"stage": stage, "code": self.versions[stage], "inputs": inputs},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def entry_dir(self, stage, key):
+        return os.path.join(self.cache_dir, stage, key)
+
+    def contains(self, stage, key):
+        return os.path.exists(os.path.join(self.entry_dir(stage, key), self.MANIFEST_FILE))
+
+    def restore(self, stage, key, directories):
+        """
+        Restore the directories of a cached stage output.
+
+        :param stage: Name of the stage.
+        :param key: Key of the stage output.
+        :param directories: A dictionary mapping artifact names to the directories they are restored to.
+        :return: True if the stage output was found and restored, False otherwise.
+        """
+        if not self.contains(stage, key):
+            self.record(hit=False)
+            return False
+
+        entry = self.entry_dir(stage, key)
+        for name, target in directories.items():
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            shutil.copytree(os.path.join(entry, name), target)
+        self.touch(stage, key)
+        self.record(hit=True)
+        return True
+
+    def store(self, stage, key, directories):
+        """
+        Store the directories produced by a stage under its key.
+
+        :param stage: Name of the stage.
+        :param key: Key of the stage output.
+        :param directories: A dictionary mapping artifact names to the directories to store.
+        """
+        def copy(tmp_dir):
+            for name, source in directories.items():
+                shutil.copytree(source, os.path.join(tmp_dir, name))
+        self.write_entry(stage, key, copy)
+
+    def load_json(self, stage, key):
+        """
+        Load a JSON stage output, such as the metrics of a fold.
+
+        :param stage: Name of the stage.
+        :param key: Key of the stage output.
+        :return: The decoded value, or None if the key is not in the cache.
+        """
+        if not self.contains(stage, key):
+            self.record(hit=False)
+            return None
+
+        with open(os.path.join(self.entry_dir(stage, key), self.ARTIFACT_FILE), 'r') as reader:
+            value = json.load(reader)
+        self.touch(stage, key)
+        self.record(hit=True)
+        return value
+
+    def store_json(self, stage, key, value):
+        """
+        Store a JSON serializable stage output under its key.
+
+        :param stage: Name of the stage.
+        :param key: Key of the stage output.
+        :param value: The value to store.
+        """
+        def dump(tmp_dir):
+            with open(os.path.join(tmp_dir, self.ARTIFACT_FILE), 'w') as writer:
+                json.dump(value, writer)
+        self.write_entry(stage, key, dump)
+
+    def write_entry(self, stage, key, write):
+        """
+        Write a cache entry into a temporary directory and move it in place atomically,
+        so that concurrent runs never observe a partial entry.
+        """
+        entry = self.entry_dir(stage, key)
+        tmp_dir = f"{entry}.tmp{os.getpid()}"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        write(tmp_dir)
+
+        now = time.time()
+        manifest = {"stage": stage, "key": key, "created": now, "last_used": now,
+                    "size": self.directory_size(tmp_dir)}
+        with open(os.path.join(tmp_dir, self.MANIFEST_FILE), 'w') as writer:
+            json.dump(manifest, writer)
+
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.replace(tmp_dir, entry)
+
+    def touch(self, stage, key):
+        manifest_file = os.path.join(self.entry_dir(stage, key), self.MANIFEST_FILE)
+        try:
+            with open(manifest_file, 'r') as reader:
+                manifest = json.load(reader)
+            manifest["last_used"] = time.time()
+            with open(manifest_file, 'w') as writer:
+                json.dump(manifest, writer)
+        except (IOError, ValueError) as e:
+            self.log.error(f"Couldn't update manifest {manifest_file}: {e}", exc_info=True)
+
+    def record(self, hit):
+        """
+        Record a cache hit or miss both for this run and in the persistent statistics.
+        """
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        stats = self.read_stats()
+        stats["hits" if hit else "misses"] += 1
+        try:
+            with open(os.path.join(self.cache_dir, self.STATS_FILE), 'w') as writer:
+                json.dump(stats, writer)
+        except IOError as e:
+            self.log.error(f"Couldn't write cache statistics: {e}", exc_info=True)
+
+    def read_stats(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.STATS_FILE), 'r') as reader:
+                return json.load(reader)
+        except (IOError, ValueError):
+            return {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def directory_size(path):
+        size = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                size += os.path.getsize(os.path.join(root, name))
+        return size
+
+    def entries(self):
+        """
+        List the manifests of all the entries in the cache.
+
+        :return: A list of manifest dictionaries.
+        """
+        manifests = []
+        for stage in sorted(os.listdir(self.cache_dir)):
+            stage_dir = os.path.join(self.cache_dir, stage)
+            if not os.path.isdir(stage_dir):
+                continue
+            for key in sorted(os.listdir(stage_dir)):
+                manifest_file = os.path.join(stage_dir, key, self.MANIFEST_FILE)
+                if os.path.exists(manifest_file):
+                    with open(manifest_file, 'r') as reader:
+                        manifests.append(json.load(reader))
+        return manifests
+
+    def stats(self):
+        """
+        Compute the statistics of the cache.
+
+        :return: A dictionary with the number of entries and bytes per stage, and the
+                 total number of hits and misses.
+        """
+        stats = self.read_stats()
+        stages = {}
+        for manifest in self.entries():
+            stage = stages.setdefault(manifest["stage"], {"entries": 0, "bytes": 0})
+            stage["entries"] += 1
+            stage["bytes"] += manifest["size"]
+        stats["stages"] = stages
+        stats["entries"] = sum(stage["entries"] for stage in stages.values())
+        stats["bytes"] = sum(stage["bytes"] for stage in stages.values())
+        return stats
+
+    def evict(self, max_bytes=None, max_age=None, stage=None):
+        """
+        Evict cache entries, least recently used first.
+
+        :param max_bytes: Evict entries until the cache is not larger than this size.
+        :param max_age: Evict entries that were not used for more than this many seconds.
+        :param stage: Restrict the eviction to one stage. If no limit is given, every entry
+                      of the stage (or of the cache) is evicted.
+        :return: The number of evicted entries.
+        """
+        manifests = [m for m in self.entries() if stage is None or m["stage"] == stage]
+        manifests.sort(key=lambda m: m["last_used"])
+        total = sum(m["size"] for m in self.entries())
+        now = time.time()
+        evicted = 0
+
+        for manifest in manifests:
+            expired = max_age is not None and now - manifest["last_used"] > max_age
+            oversized = max_bytes is not None and total > max_bytes
+            if expired or oversized or (max_age is None and max_bytes is None):
+                shutil.rmtree(self.entry_dir(manifest["stage"], manifest["key"]))
+                total -= manifest["size"]
+                evicted += 1
+
+        self.log.info("Evicted %d cache entries, %d bytes left", evicted, total)
+        return evicted
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Inspect or evict the stage cache.")
+    parser.add_argument("cache_dir", help="Directory of the stage cache")
+    parser.add_argument("command", choices=["stats", "evict"])
+    parser.add_argument("--max-size", type=float, help="Evict until the cache is at most this many MB")
+    parser.add_argument("--max-age", type=float, help="Evict entries unused for more than this many days")
+    parser.add_argument("--stage", help="Restrict eviction to one stage")
+    options = parser.parse_args(args)
+
+    cache = StageCache(options.cache_dir)
+    if options.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    else:
+        max_bytes = options.max_size * 1024 * 1024 if options.max_size is not None else None
+        max_age = options.max_age * 24 * 3600 if options.max_age is not None else None
+        print(f"Evicted {cache.evict(max_bytes, max_age, options.stage)} entries")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(sys.argv[1:])
@@ -0,0 +1,221 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from typing import Dict, List, Tuple
+
+from dataReader import DataReader
+from similarityCalculator import SimilarityCalculator
+
+class StructuralSimilarityStore:
+    """
+    Indexed store of the precomputed structural similarities.
+
+    The similarity files of `structural_dir` (one file per project, with lines
+    `project<TAB>other<TAB>score`) are ingested once into a neighbor table keyed by the
+    position of the projects in List.txt: every project owns a contiguous slice of the
+    `neighbors.npy` and `scores.npy` arrays, sorted by decreasing similarity, located through
+    `offsets.npy`. The arrays are memory-mapped, so lookups do not load the whole table.
+    The index records the fingerprint of List.txt and of the similarity files it was built
+    from, and is ingested again when they change. The fingerprint is computed once per store,
+    so a store is meant to be created once per run and shared by the calculators of the folds.
+
+    :param src_dir: Source directory where the project data is located.
+    :param structural_dir: Directory of the precomputed structural similarity files.
+    :param index_dir: Directory of the indexed store, by default `structural_index` under the source directory.
+    """
+
+    log = logging.getLogger("StructuralSimilarityStore")
+
+    def __init__(self, src_dir: str, structural_dir: str, index_dir: str = None):
+        if not structural_dir:
+            raise ValueError("The structural similarity needs the directory of the precomputed structural "
+                             "similarities, set structuralSimilaritiesDirectory")
+        self.src_dir = src_dir
+        self.structural_dir = structural_dir
+        self.index_dir = index_dir or os.path.join(src_dir, "structural_index")
+        self.reader = DataReader()
+        self.projects = None
+        self.project_ids = None
+        self.offsets = self.neighbors = self.scores = None
+        self.digest = None
+
+    def fingerprint(self) -> str:
+        """
+        Compute a fingerprint of the inputs of the index from the content of List.txt and the
+        size and modification time of every structural similarity file, without reading them.
+        The files are only looked at on the first call.
+
+        :return: A hexadecimal digest, or None if List.txt cannot be read.
+        """
+        if self.digest is None:
+            self.digest = self.compute_fingerprint()
+        return self.digest
+
+    def compute_fingerprint(self) -> str:
+        list_file = os.path.join(self.src_dir, "List.txt")
+        digest = hashlib.sha256()
+        try:
+            with self.reader.source.open(list_file) as file:
+                digest.update(file.read().encode())
+        except (OSError, TypeError):
+            return None
+        for project in self.reader.read_project_list(list_file, 1, -1).values():
+            try:
+                stat = os.stat(os.path.join(self.structural_dir, project))
+                digest.update(f"{project}\t{stat.st_size}\t{stat.st_mtime_ns}\n".encode())
+            except (OSError, TypeError):
+                digest.update(f"{project}\t-\n".encode())
+        return digest.hexdigest()
+
+    def is_ingested(self) -> bool:
+        if not all(os.path.exists(os.path.join(self.index_dir, name))
+                   for name in ("projects.json", "offsets.npy", "neighbors.npy", "scores.npy", "fingerprint.json")):
+            return False
+        with open(os.path.join(self.index_dir, "fingerprint.json"), 'r') as reader:
+            return json.load(reader) == self.fingerprint()
+
+    def ingest(self):
+        """
+        Read all the precomputed structural similarity files and write the neighbor table.
+        """
+        fingerprint = self.fingerprint()
+        projects = list(self.reader.read_project_list(os.path.join(self.src_dir, "List.txt"), 1, -1).values())
+        project_ids = {project: pos for pos, project in enumerate(projects)}
+
+        offsets = [0]
+        neighbors = []
+        scores = []
+        for project in projects:
+            similarities = {}
+            filename = os.path.join(self.structural_dir, project)
+            if os.path.exists(filename):
+                similarities = self.reader.get_similarity_scores(filename, -1)
+            ranked = sorted(((score, project_ids[other]) for other, score in similarities.items()
+                             if other in project_ids and other != project),
+                            key=lambda item: item[0], reverse=True)
+            neighbors.extend(other for _, other in ranked)
+            scores.extend(score for score, _ in ranked)
+            offsets.append(len(neighbors))
+
+        os.makedirs(self.index_dir, exist_ok=True)
+        np.save(os.path.join(self.index_dir, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(self.index_dir, "neighbors.npy"), np.array(neighbors, dtype=np.int32))
+        np.save(os.path.join(self.index_dir, "scores.npy"), np.array(scores, dtype=np.float64))
+        with open(os.path.join(self.index_dir, "projects.json"), 'w') as writer:
+            json.dump(projects, writer)
+        # Written last, so that an interrupted ingestion is started again
+        with open(os.path.join(self.index_dir, "fingerprint.json"), 'w') as writer:
+            json.dump(fingerprint, writer)
+
+        self.log.info("Ingested %d structural similarities of %d projects into %s",
+                      len(neighbors), len(projects), self.index_dir)
+
+    def open(self):
+        """
+        Open the store, ingesting the structural similarity files first if needed.
+        """
+        if not self.is_ingested():
+            self.ingest()
+
+        with open(os.path.join(self.index_dir, "projects.json"), 'r') as reader:
+            self.projects = json.load(reader)
+        self.project_ids = {project: pos for pos, project in enumerate(self.projects)}
+        self.offsets = np.load(os.path.join(self.index_dir, "offsets.npy"), mmap_mode='r')
+        self.neighbors = np.load(os.path.join(self.index_dir, "neighbors.npy"), mmap_mode='r')
+        self.scores = np.load(os.path.join(self.index_dir, "scores.npy"), mmap_mode='r')
+
+    def lookup(self, project: str, allowed: np.ndarray) -> List[Tuple[str, float]]:
+        """
+        Get the neighbors of a project, restricted to a set of projects.
+
+        :param project: The project whose neighbors are requested.
+        :param allowed: A boolean mask over the projects of List.txt selecting the allowed neighbors.
+        :return: A list of (project, similarity) pairs sorted by decreasing similarity.
+        """
+        if self.projects is None:
+            self.open()
+
+        pos = self.project_ids.get(project)
+        if pos is None:
+            return []
+
+        start, end = self.offsets[pos], self.offsets[pos + 1]
+        neighbors = self.neighbors[start:end]
+        mask = allowed[neighbors]
+        return [(self.projects[other], float(score))
+                for other, score in zip(neighbors[mask], self.scores[start:end][mask])]
+
+    def get_mask(self, projects) -> np.ndarray:
+        """
+        Build the boolean mask selecting a set of projects.
+
+        :param projects: The project names.
+        :return: A boolean array over the projects of List.txt.
+        """
+        if self.projects is None:
+            self.open()
+
+        mask = np.zeros(len(self.projects), dtype=bool)
+        for project in projects:
+            pos = self.project_ids.get(project)
+            if pos is not None:
+                mask[pos] = True
+        return mask
+
+
+class StructuralSimilarityCalculator(SimilarityCalculator):
+    """
+    Similarity calculator backed by the precomputed structural similarities. The neighbor
+    list of every testing project is looked up in the indexed store and restricted to the
+    training projects of the fold; nothing is recomputed.
+
+    :param structural_dir: Directory of the precomputed structural similarity files.
+    :param index_dir: Directory of the indexed store, by default `structural_index` under the source directory.
+    :param store: A StructuralSimilarityStore shared with the calculators of other folds, used
+                  instead of `structural_dir` and `index_dir`.
+    """
+
+    log = logging.getLogger("StructuralSimilarityCalculator")
+
+    def __init__(self, src_dir, sub_folder=None, conf=None, training_start_pos1=None, training_end_pos1=None,
+                 training_start_pos2=None, training_end_pos2=None, testing_start_pos=None, testing_end_pos=None,
+                 structural_dir=None, index_dir=None, store=None):
+        super().__init__(src_dir, sub_folder, conf, training_start_pos1, training_end_pos1, training_start_pos2,
+                         training_end_pos2, testing_start_pos, testing_end_pos)
+        self.store = store or StructuralSimilarityStore(src_dir, structural_dir, index_dir)
+        self.training_mask = None
+
+    def compute_similarity(self, testing_pro: str, projects: Dict[str, Dict[str, int]]):
+        """
+        Look up the neighbors of the testing project among the supplied projects and write them.
+
+        :param testing_pro: The ID of the testing project.
+        :param projects: A dictionary whose keys are the IDs of the candidate projects.
+        """
+        allowed = self.training_mask
+        if allowed is None:
+            allowed = self.store.get_mask(project for project in projects if project != testing_pro)
+
+        sorted_similarities = dict(self.store.lookup(testing_pro, allowed))
+        self.reader.write_similarity_scores(self.get_sim_dir(), testing_pro, sorted_similarities)
+
+    def compute_project_similarity(self):
+        """
+        Write the neighbor lists of all testing projects, restricted to the training set of the fold.
+        The testing projects are still split into their testing invocations and ground truth.
+        """
+        training_projects_id = self.read_training_project_ids()
+        testing_projects_id = self.read_testing_project_ids()
+        num_of_testing_invocations, remove_half = self.get_testing_settings()
+
+        self.training_mask = self.store.get_mask(training_projects_id.values())
+        try:
+            for testing_id in testing_projects_id.values():
+                self.reader.get_testing_project_invocations(
+                    self.src_dir, self.sub_folder, testing_id, num_of_testing_invocations, remove_half
+                )
+                self.compute_similarity(testing_id, {})
+        finally:
+            self.training_mask = None
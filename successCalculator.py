@@ -1,10 +1,15 @@
-from dataReader import *
+from dataReader import DataReader
 import os
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 class SuccessCalculator:
 
-    def __init__(self, src_dir, sub_folder, testing_start_pos, testing_end_pos):
+    def __init__(self, src_dir, sub_folder, testing_start_pos, testing_end_pos, store=None):
         self.reader = DataReader()  # Create an instance of DataReader
+        if store is not None:
+            # Read the artifacts from this store instead of the one shared by all readers
+            self.reader.store = store
         self.src_dir = src_dir
         self.sub_folder = sub_folder
         self.rec_dir = os.path.join(self.src_dir, self.sub_folder, "Recommendations")
@@ -62,6 +67,84 @@ class SuccessCalculator:
 
         return recall / len(testing_projects_id)
 
+    def compute_project_metrics(self, project, ns):
+        """
+        Compute the matches of a single project for every cutoff, reading its recommendation
+        and ground-truth files only once.
+
+        :param project: The testing project.
+        :param ns: The list of cutoffs.
+        :return: A dictionary mapping every cutoff to a (success, precision, recall) tuple,
+                 where success is 1 if at least one recommendation matches, 0 otherwise.
+        """
+        top_rec = []
+        try:
+            with self.reader.open_artifact(os.path.join(self.rec_dir, project), 'r') as file:
+                for line in file:
+                    top_rec.append(line.split("\t")[0].strip())
+                    if len(top_rec) == max(ns):
+                        break
+        except IOError as e:
+            self.reader.log.error(f"Couldn't read file {os.path.join(self.rec_dir, project)}: {e}", exc_info=True)
+
+        return self.compute_ranking_metrics(project, top_rec, ns)
+
+    def compute_ranking_metrics(self, project, top_rec, ns):
+        """
+        Compute the matches of a ranking of recommendations with the ground truth of a project.
+
+        :param project: The testing project.
+        :param top_rec: The recommended invocations, best first.
+        :param ns: The list of cutoffs.
+        :return: A dictionary mapping every cutoff to a (success, precision, recall) tuple.
+        """
+        ground_truth = self.reader.read_ground_truth_invocations(os.path.join(self.gt_dir, project))
+
+        metrics = {}
+        for n in ns:
+            intersection = ground_truth.intersection(top_rec[:n])
+            recall = len(intersection) / len(ground_truth) if ground_truth else 0
+            metrics[n] = (1 if intersection else 0, len(intersection) / n, recall)
+        return metrics
+
+    def compute_metrics(self, ns, num_of_workers=1):
+        """
+        Compute success rate, precision and recall for every cutoff in a single pass over
+        the recommendation and ground-truth files. Projects are evaluated in parallel when
+        more than one worker is requested.
+
+        :param ns: The list of cutoffs.
+        :param num_of_workers: Number of worker processes, 1 to evaluate in the current process.
+        :return: A dictionary mapping every cutoff to a (success rate, precision, recall) tuple.
+        """
+        testing_projects_id = self.reader.read_project_list(
+            os.path.join(self.src_dir, "List.txt"), 
+            self.testing_start_pos, 
+            self.testing_end_pos
+        )
+        projects = list(testing_projects_id.values())
+
+        if num_of_workers > 1 and len(projects) > 1:
+            chunksize = max(1, len(projects) // (num_of_workers * 4))
+            with ProcessPoolExecutor(max_workers=num_of_workers, initializer=DataReader.set_worker_state,
+                                     initargs=(DataReader.get_worker_state(),)) as executor:
+                project_metrics = list(executor.map(self.compute_project_metrics, projects, repeat(ns),
+                                                    chunksize=chunksize))
+        else:
+            project_metrics = [self.compute_project_metrics(project, ns) for project in projects]
+
+        results = {}
+        for n in ns:
+            number_of_matches = precision = recall = 0
+            for metrics in project_metrics:
+                number_of_matches += metrics[n][0]
+                precision += metrics[n][1]
+                recall += metrics[n][2]
+            results[n] = ((number_of_matches / len(projects)) * 100,
+                          precision / len(projects),
+                          recall / len(projects))
+        return results
+
 # def main():
 #     # Modify these paths and positions according to your file structure
 #     src_dir = "/home/smanduru/ReCS/MemoRec/dataset/pkg_cls_curated_RQ2/"
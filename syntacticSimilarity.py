@@ -0,0 +1,195 @@
+import zlib
+import logging
+import numpy as np
+from typing import Dict, Iterable, Tuple
+
+from similarityCalculator import SimilarityCalculator
+
+class SyntacticSimilarityCalculator(SimilarityCalculator):
+    """
+    Similarity calculator comparing projects by the names of their declarations and invocations.
+
+    Every project is represented by the character n-grams of its names, hashed into a sparse
+    profile vector of fixed width and normalized to unit length. The similarities of a whole
+    fold are computed as a single sparse matrix product between the testing and the training
+    profiles.
+
+    :param ngram_size: Length of the character n-grams.
+    :param num_of_features: Width of the hashed profile vectors.
+    :param block_size: Maximum number of values multiplied at a time by the matrix product.
+    """
+
+    log = logging.getLogger("SyntacticSimilarityCalculator")
+
+    def __init__(self, src_dir, sub_folder=None, conf=None, training_start_pos1=None, training_end_pos1=None,
+                 training_start_pos2=None, training_end_pos2=None, testing_start_pos=None, testing_end_pos=None,
+                 ngram_size=3, num_of_features=4096, block_size=1 << 22):
+        super().__init__(src_dir, sub_folder, conf, training_start_pos1, training_end_pos1, training_start_pos2,
+                         training_end_pos2, testing_start_pos, testing_end_pos)
+        self.ngram_size = ngram_size
+        self.num_of_features = num_of_features
+        self.block_size = block_size
+        self.name_features = {}
+        self.training_profiles = None
+
+    def compute_profile(self, names: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compute the hashed n-gram profile of a list of names.
+
+        :param names: The declaration and invocation names of a project, with repetitions.
+        :return: The L2-normalized sparse profile, as a tuple of sorted feature indices and
+                 their values.
+        """
+        features = [self.get_name_features(name) for name in names]
+        if not features:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        indices, counts = np.unique(np.concatenate(features), return_counts=True)
+        values = counts.astype(np.float64)
+        return indices, values / np.linalg.norm(values)
+
+    def stack_profiles(self, profiles):
+        """
+        Stack sparse profiles into the rows of a sparse matrix, in compressed sparse row format.
+
+        :param profiles: A list of (indices, values) tuples.
+        :return: A tuple (row offsets, feature indices, values).
+        """
+        offsets = np.zeros(len(profiles) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(indices) for indices, _ in profiles])
+        if not profiles:
+            return offsets, np.zeros(0, dtype=np.int64), np.zeros(0)
+        return (offsets, np.concatenate([indices for indices, _ in profiles]),
+                np.concatenate([values for _, values in profiles]))
+
+    def get_name_features(self, name: str) -> np.ndarray:
+        """
+        Hash the character n-grams of a name. Hashes are memoized, since the same names recur
+        across projects.
+
+        :param name: A declaration or invocation name.
+        :return: The feature indices of the n-grams of the name.
+        """
+        features = self.name_features.get(name)
+        if features is None:
+            padded = f"#{name}#"
+            features = np.array([zlib.crc32(padded[i:i + self.ngram_size].encode()) % self.num_of_features
+                                 for i in range(max(1, len(padded) - self.ngram_size + 1))], dtype=np.int64)
+            self.name_features[name] = features
+        return features
+
+    @staticmethod
+    def get_names(method_invocations: Dict[str, Iterable[str]]):
+        """
+        List the names of the declarations and invocations of a project.
+
+        :param method_invocations: A dictionary mapping declarations to their invocations.
+        :return: A list of names, with every invocation repeated as many times as it occurs.
+        """
+        names = []
+        for declaration, invocations in method_invocations.items():
+            names.append(declaration)
+            names.extend(invocations)
+        return names
+
+    def get_testing_names(self, testing_id, num_of_testing_invocations, remove_half):
+        """
+        Split a testing project and list the names left visible by its split: the remaining
+        declarations with their invocations, and the query of the testing declaration. The
+        split is written to the round, for the recommendation engine.
+
+        :param testing_id: The ID of the testing project.
+        :param num_of_testing_invocations: Number of invocations kept as query.
+        :param remove_half: Whether the second half of the declarations is removed.
+        :return: A list of names, as returned by `get_names`.
+        """
+        method_invocations, testing_declaration, query, ground_truth_mis = self.reader.split_testing_project(
+            self.src_dir, testing_id, num_of_testing_invocations, remove_half)
+        self.reader.write_testing_split(self.src_dir, self.sub_folder, testing_id, testing_declaration,
+                                        query, ground_truth_mis)
+        method_invocations[testing_declaration] = query
+        return self.get_names(method_invocations)
+
+    def compute_similarity(self, testing_pro: str, projects: Dict[str, Dict[str, int]]):
+        """
+        Compute the similarity between the testing project and all other projects from the
+        names of their declarations and invocations, as `compute_project_similarity` does.
+
+        :param testing_pro: The ID of the testing project.
+        :param projects: A dictionary of all projects with their respective term frequencies.
+        """
+        training = [project for project in projects if project != testing_pro]
+        testing_profile = self.compute_profile(self.get_testing_names(testing_pro, *self.get_testing_settings()))
+        training_profiles = self.stack_profiles([
+            self.compute_profile(self.get_names(self.reader.get_project_details2(self.src_dir, project)))
+            for project in training])
+        self.write_ranked_similarities([testing_pro], [testing_profile], training, training_profiles)
+
+    def set_training_weights(self, training_weights):
+        super().set_training_weights(training_weights)
+        self.training_profiles = None
+
+    def compute_project_similarity(self):
+        """
+        Compute the similarity between all testing projects and training projects with one
+        batched matrix product. The names of a testing project are those left visible by its split:
+        the remaining declarations with their invocations, and the query of the testing declaration.
+        """
+        training_projects_id = self.read_training_project_ids()
+        testing_projects_id = self.read_testing_project_ids()
+        num_of_testing_invocations, remove_half = self.get_testing_settings()
+
+        training = list(training_projects_id.values())
+        if self.training_profiles is None:
+            self.training_profiles = self.stack_profiles([
+                self.compute_profile(self.get_names(self.reader.get_project_details2(self.src_dir, training_id)))
+                for training_id in training])
+
+        testing = list(testing_projects_id.values())
+        testing_profiles = [self.compute_profile(self.get_testing_names(testing_id, num_of_testing_invocations,
+                                                                        remove_half))
+                            for testing_id in testing]
+        self.write_ranked_similarities(testing, testing_profiles, training, self.training_profiles)
+
+    def multiply_profiles(self, testing_profiles, training_profiles):
+        """
+        Compute the cosine similarities of all testing and training profiles at once. The
+        testing profiles are expanded into a dense matrix, which is multiplied with the sparse
+        training matrix in blocks of rows holding at most `block_size` values together.
+
+        :param testing_profiles: A list of sparse profiles.
+        :param training_profiles: The stacked sparse training profiles.
+        :return: A matrix of similarities, with a row per testing and a column per training project.
+        """
+        offsets, indices, values = training_profiles
+        num_of_training = len(offsets) - 1
+        dense = np.zeros((len(testing_profiles), self.num_of_features))
+        for i, (testing_indices, testing_values) in enumerate(testing_profiles):
+            dense[i, testing_indices] = testing_values
+
+        similarities = np.zeros((len(testing_profiles), num_of_training))
+        values_per_block = max(1, self.block_size // max(1, len(testing_profiles)))
+        start = 0
+        while start < num_of_training:
+            end = start + 1
+            while end < num_of_training and offsets[end + 1] - offsets[start] <= values_per_block:
+                end += 1
+            rows = np.arange(start, end)
+            rows = rows[offsets[rows + 1] > offsets[rows]]
+            if len(rows):
+                block = slice(offsets[start], offsets[end])
+                products = dense[:, indices[block]] * values[block]
+                # Sum the products of every non-empty row; empty rows hold no values in between
+                similarities[:, rows] = np.add.reduceat(products, offsets[rows] - offsets[start], axis=1)
+            start = end
+        return similarities
+
+    def write_ranked_similarities(self, testing, testing_profiles, training, training_profiles):
+        """
+        Compute the cosine similarities of all testing and training profiles and write the
+        training projects ranked by decreasing similarity, ties in List.txt order.
+        """
+        similarities = self.multiply_profiles(testing_profiles, training_profiles)
+        for i, testing_pro in enumerate(testing):
+            order = np.argsort(-similarities[i], kind='stable')
+            sorted_similarities = {training[j]: float(similarities[i, j]) for j in order}
+            self.reader.write_similarity_scores(self.get_sim_dir(), testing_pro, sorted_similarities)